@@ -0,0 +1,240 @@
+"""
+问题 -> SQL 答案缓存
+把问题中的年月、机构等字面量提取为槽位，以去掉槽位后的问题模板为键缓存 SQL 模板，
+命中时把新问题的槽位值代入 SQL，不再调用模型
+"""
+from __future__ import annotations
+
+from collections import OrderedDict
+import re
+import threading
+import time
+import unicodedata
+from typing import Callable, Iterable, NamedTuple
+
+MONTH = 'month'
+YEAR = 'year'
+ORG = 'org'
+
+_MONTH_PATTERNS = (
+    re.compile(r"(?<!\d)(\d{4})\s*年\s*(\d{1,2})\s*月"),
+    re.compile(r"(?<!\d)(\d{4})[-/.](\d{1,2})(?!\d)"),
+    re.compile(r"(?<!\d)(\d{4})(0[1-9]|1[0-2])(?!\d)"),
+)
+_YEAR_PATTERN = re.compile(r"(?<!\d)(\d{4})\s*年")
+# 相对时间依赖提问时刻，不能按字面量缓存
+_RELATIVE_RE = re.compile(r"今年|去年|前年|明年|本月|上月|上个月|下个月|本季|上季|本年|上年|当月|当年|最近|近\d+|目前|当前|今天|昨天")
+_PUNCT_RE = re.compile(r"[\s?？。!！,，;；]+")
+_MARKER_RE = re.compile(r"\x00(\d+):(\w+)\x00")
+# SQL 中的年月 (YYYYMM、YYYY-MM) 和年份 (YYYY) 字面量
+_DATE_LITERAL_RE = re.compile(r"(?<!\d)(?:19|20)\d{2}(?:[-/]?(?:0[1-9]|1[0-2]))?(?!\d)")
+
+
+class Slot(NamedTuple):
+    kind: str
+    value: str
+    start: int
+    end: int
+
+
+def _normalize(question: str) -> str:
+    return unicodedata.normalize('NFKC', question).strip()
+
+
+def extract_slots(question: str, orgs: Iterable[str] = ()) -> tuple[str, list[Slot]]:
+    """
+    提取年月和机构槽位
+    Args:
+        question: 问题
+        orgs: 已知的机构名称
+    Returns:
+        (问题模板, 槽位列表)，年月值格式为 YYYYMM，年份为 YYYY
+    """
+    text = _normalize(question)
+    taken = [False] * len(text)
+    slots: list[Slot] = []
+
+    def claim(kind: str, value: str, start: int, end: int) -> None:
+        if any(taken[start:end]):
+            return
+        taken[start:end] = [True] * (end - start)
+        slots.append(Slot(kind, value, start, end))
+
+    for org in sorted(set(orgs), key=len, reverse=True):
+        if org:
+            for m in re.finditer(re.escape(org), text):
+                claim(ORG, org, m.start(), m.end())
+    for pattern in _MONTH_PATTERNS:
+        for m in pattern.finditer(text):
+            month = int(m.group(2))
+            if 1 <= month <= 12:
+                claim(MONTH, f"{m.group(1)}{month:02d}", m.start(), m.end())
+    for m in _YEAR_PATTERN.finditer(text):
+        claim(YEAR, m.group(1), m.start(), m.end())
+
+    slots.sort(key=lambda s: s.start)
+    parts = []
+    last = 0
+    for i, slot in enumerate(slots):
+        parts.append(text[last:slot.start])
+        parts.append(f"<{slot.kind}{i}>")
+        last = slot.end
+    parts.append(text[last:])
+    template = _PUNCT_RE.sub('', ''.join(parts)).lower()
+    return template, slots
+
+
+def _renderings(slot: Slot) -> list[tuple[str, str]]:
+    """槽位值在 SQL 中可能出现的写法: (格式, 文本)"""
+    if slot.kind == MONTH:
+        return [('yyyymm', slot.value), ('yyyy_mm', f"{slot.value[:4]}-{slot.value[4:]}")]
+    if slot.kind == YEAR:
+        return [('yyyy', slot.value)]
+    return [('text', slot.value)]
+
+
+def _render(fmt: str, value: str) -> str:
+    if fmt == 'yyyy_mm':
+        return f"{value[:4]}-{value[4:]}"
+    return value
+
+
+def make_template(sql: str, slots: list[Slot]) -> str | None:
+    """
+    把 SQL 中的槽位值替换为占位标记
+    有槽位在 SQL 中找不到、多个槽位值相同，或替换后仍残留年月、年份字面量
+    (例如由月份推算出的年初、同比的上年同月、1 月环比的上年 12 月) 时无法安全复用，返回 None
+    """
+    values = [s.value for s in slots]
+    if len(set(values)) != len(values):
+        return None
+    # 长的值先替换，避免 2025 截断 202503
+    order = sorted(range(len(slots)), key=lambda i: len(slots[i].value), reverse=True)
+    for i in order:
+        found = False
+        for fmt, text in _renderings(slots[i]):
+            bound = r"(?<!\d)" if text[0].isdigit() else ""
+            pattern = re.compile(bound + re.escape(text) + (r"(?!\d)" if text[-1].isdigit() else ""))
+            sql, n = pattern.subn(lambda _: f"\x00{i}:{fmt}\x00", sql)
+            found = found or n > 0
+        if not found:
+            return None
+    if _DATE_LITERAL_RE.search(_MARKER_RE.sub(' ', sql)):
+        return None
+    return sql
+
+
+def bind(template: str, slots: list[Slot]) -> str:
+    """把新问题的槽位值代入 SQL 模板"""
+    return _MARKER_RE.sub(lambda m: _render(m.group(2), slots[int(m.group(1))].value), template)
+
+
+class _Entry(NamedTuple):
+    template: str
+    version: str
+    stored_at: float
+
+
+class AnswerCache:
+    """
+    问题 -> SQL 缓存
+    """
+
+    def __init__(self,
+                 max_entries: int = 512,
+                 ttl: float | None = 24 * 3600,
+                 orgs: Iterable[str] = (),
+                 clock: Callable[[], float] = time.monotonic) -> None:
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.orgs: set[str] = set(orgs)
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.rejects = 0
+        self.expirations = 0
+        self._entries: OrderedDict[str, _Entry] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def add_orgs(self, orgs: Iterable[str]) -> None:
+        """登记可识别为槽位的机构名称"""
+        self.orgs.update(o for o in orgs if o)
+
+    def cacheable(self, question: str) -> bool:
+        return self.enabled and _RELATIVE_RE.search(_normalize(question)) is None
+
+    def get(self, question: str, version: str) -> str | None:
+        """
+        查找缓存并代入槽位
+        Args:
+            question: 问题
+            version: 指标图版本，与写入时不同则视为失效
+        """
+        if not self.cacheable(question):
+            return None
+        key, slots = extract_slots(question, self.orgs)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (entry.version != version or self._expired(entry)):
+                del self._entries[key]
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        return bind(entry.template, slots)
+
+    def put(self, question: str, version: str, sql: str) -> bool:
+        """
+        写入缓存
+        Returns:
+            SQL 无法可靠地模板化时返回 False
+        """
+        if not self.cacheable(question):
+            return False
+        key, slots = extract_slots(question, self.orgs)
+        template = make_template(sql, slots)
+        with self._lock:
+            if template is None:
+                self.rejects += 1
+                return False
+            self._entries[key] = _Entry(template, version, self.clock())
+            self._entries.move_to_end(key)
+            self.stores += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return True
+
+    def discard(self, question: str) -> None:
+        """删除问题对应的缓存，例如 SQL 执行失败时"""
+        key, _ = extract_slots(question, self.orgs)
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def _expired(self, entry: _Entry) -> bool:
+        return self.ttl is not None and self.clock() - entry.stored_at > self.ttl
+
+    def stats(self) -> dict[str, int | float]:
+        """命中统计"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'stores': self.stores,
+                'rejects': self.rejects,
+                'expirations': self.expirations,
+                'entries': len(self._entries),
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
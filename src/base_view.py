@@ -0,0 +1,108 @@
+"""
+物化基础视图
+把 reference/income_cost.sql 的关联结果按排序键写入磁盘上的 DuckDB 数据库，
+SQL 文本或其读取的 parquet 变化时才重建，会话以只读方式直接查询该表
+"""
+from __future__ import annotations
+
+import hashlib
+import os
+from pathlib import Path
+from typing import Iterable
+
+import duckdb
+import pyarrow as pa
+
+from fingerprint import paths_fingerprint
+from util import REF, TableRegistry, registry as default_registry
+
+_META = '_base_view_meta'
+
+
+class BaseView:
+    """
+    磁盘上的物化基础表
+    """
+
+    def __init__(self, sql_path: str | Path, db_path: str | Path, table: str = 'df',
+                 sort_by: Iterable[str] = ('财务期间', '外服机构', '指标'),
+                 registry: TableRegistry | None = None) -> None:
+        """
+        Args:
+            sql_path: 基础视图的 SQL 文件
+            db_path: DuckDB 数据库文件
+            table: 物化后的表名，与 single_view_agent 提示中的 df 一致
+            sort_by: 排序键，存在的列才参与排序，便于按财务期间/机构裁剪行组
+            registry: 提供参考表视图，SQL 可直接引用表名
+        """
+        self.sql_path = Path(sql_path)
+        self.db_path = Path(db_path)
+        self.table = table
+        self.sort_by = tuple(sort_by)
+        self.registry = registry or default_registry
+
+    @property
+    def sql(self) -> str:
+        return self.sql_path.read_text(encoding='utf-8').strip().rstrip(';')
+
+    def fingerprint(self) -> str:
+        """SQL 文本与其读取的 parquet 文件的指纹"""
+        sql = self.sql
+        h = hashlib.sha256(sql.encode('utf-8'))
+        h.update(paths_fingerprint(self.registry.files_for(sql)).encode('utf-8'))
+        return h.hexdigest()
+
+    def stored_fingerprint(self) -> str | None:
+        """数据库中记录的指纹，数据库不存在或未完成构建时为 None"""
+        if not self.db_path.exists():
+            return None
+        try:
+            with duckdb.connect(str(self.db_path), read_only=True) as conn:
+                row = conn.execute(f"SELECT fingerprint FROM {_META} WHERE name = ?", [self.table]).fetchone()
+        except duckdb.Error:
+            return None
+        return row[0] if row else None
+
+    def stale(self) -> bool:
+        return self.stored_fingerprint() != self.fingerprint()
+
+    def build(self) -> None:
+        """在临时文件中重建后原子替换，正在读取旧文件的会话不受影响"""
+        fingerprint = self.fingerprint()
+        sql = self.sql
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.db_path.with_name(f"{self.db_path.name}.{os.getpid()}.tmp")
+        tmp.unlink(missing_ok=True)
+        with duckdb.connect(str(tmp)) as conn:
+            self.registry.register(conn)
+            columns = [row[0] for row in conn.execute(f"DESCRIBE {sql}").fetchall()]
+            order = [f'"{c}"' for c in self.sort_by if c in columns]
+            conn.execute(f'CREATE TABLE "{self.table}" AS SELECT * FROM ({sql}) base'
+                         + (f" ORDER BY {', '.join(order)}" if order else ''))
+            # 参考表视图只用于构建
+            for name in self.registry.available():
+                conn.execute(f'DROP VIEW IF EXISTS "df_{name}"')
+                conn.execute(f'DROP VIEW IF EXISTS "{name}"')
+            conn.execute(f"CREATE TABLE {_META} (name VARCHAR, fingerprint VARCHAR)")
+            conn.execute(f"INSERT INTO {_META} VALUES (?, ?)", [self.table, fingerprint])
+            conn.execute("CHECKPOINT")
+        os.replace(tmp, self.db_path)
+        self.db_path.with_name(f"{tmp.name}.wal").unlink(missing_ok=True)
+
+    def connect(self) -> duckdb.DuckDBPyConnection:
+        """
+        只读连接，基础表过期时先重建
+        """
+        if self.stale():
+            self.build()
+        return duckdb.connect(str(self.db_path), read_only=True)
+
+    def schema(self, conn: duckdb.DuckDBPyConnection) -> pa.Table:
+        """基础表的空表，只带列定义，用于生成提示"""
+        return conn.execute(f'SELECT * FROM "{self.table}" LIMIT 0').arrow()
+
+
+def income_cost_view(db_path: str | Path | None = None) -> BaseView:
+    """reference/income_cost.sql 的物化基础表，默认存放在 BASE_VIEW_DB"""
+    return BaseView(REF / 'income_cost.sql',
+                    db_path or os.environ.get('BASE_VIEW_DB') or REF.parent / '.cache' / 'income_cost.duckdb')
@@ -0,0 +1,123 @@
+"""
+查询取消
+工作线程借出 DuckDB 游标或 Kuzu 连接时登记到当前的 CancelScope，
+调用方超时或被取消时中断正在执行的查询；等待空闲连接期间定期检查是否已取消
+"""
+from __future__ import annotations
+
+from contextvars import ContextVar
+import queue
+import threading
+from typing import Any, Callable, Protocol, TypeVar
+
+T = TypeVar('T')
+
+# 等待空闲连接时检查取消的间隔秒数
+POLL_INTERVAL = 0.1
+
+
+class Interruptible(Protocol):
+    def interrupt(self) -> Any: ...
+
+
+class Cancelled(Exception):
+    """所在的 CancelScope 已被取消"""
+
+
+_current: ContextVar[CancelScope | None] = ContextVar('cancel_scope', default=None)
+
+
+class CancelScope:
+    """
+    一次工具调用的取消范围
+    """
+
+    def __init__(self) -> None:
+        self.cancelled = False
+        self._targets: list[Interruptible] = []
+        self._lock = threading.Lock()
+
+    def run(self, func: Callable[..., T], *args: Any) -> T:
+        """在本范围内执行，期间借出的连接都会登记"""
+        token = _current.set(self)
+        try:
+            if self.cancelled:
+                raise Cancelled()
+            return func(*args)
+        finally:
+            _current.reset(token)
+
+    def attach(self, target: Interruptible) -> None:
+        with self._lock:
+            if self.cancelled:
+                raise Cancelled()
+            self._targets.append(target)
+
+    def detach(self, target: Interruptible) -> None:
+        with self._lock:
+            if target in self._targets:
+                self._targets.remove(target)
+
+    def cancel(self) -> None:
+        """标记取消并中断所有登记的连接"""
+        with self._lock:
+            self.cancelled = True
+            targets = list(self._targets)
+        for target in targets:
+            try:
+                target.interrupt()
+            except Exception:
+                pass
+
+
+def attach(target: Interruptible) -> CancelScope | None:
+    """
+    把连接登记到当前线程所在的 CancelScope
+    Returns:
+        登记到的范围，没有范围时为 None
+    Raises:
+        Cancelled: 范围已被取消
+    """
+    scope = _current.get()
+    if scope is not None:
+        scope.attach(target)
+    return scope
+
+
+def detach(scope: CancelScope | None, target: Interruptible) -> None:
+    if scope is not None:
+        scope.detach(target)
+
+
+def check() -> None:
+    """
+    Raises:
+        Cancelled: 当前线程所在的 CancelScope 已被取消
+    """
+    scope = _current.get()
+    if scope is not None and scope.cancelled:
+        raise Cancelled()
+
+
+def get(items: queue.Queue[T], interval: float = POLL_INTERVAL) -> T:
+    """
+    从队列取出一项，队列为空时等待；所在范围被取消时不再等待
+    Raises:
+        Cancelled: 等待期间所在范围被取消
+    """
+    while True:
+        check()
+        try:
+            return items.get(timeout=interval)
+        except queue.Empty:
+            pass
+
+
+def acquire(lock: threading.Lock, interval: float = POLL_INTERVAL) -> None:
+    """
+    获取锁，所在范围被取消时不再等待
+    Raises:
+        Cancelled: 等待期间所在范围被取消
+    """
+    while not lock.acquire(timeout=interval):
+        check()
@@ -0,0 +1,184 @@
+"""
+DuckDB 连接池
+同一个共享数据库上固定数量的游标，供并发查询使用
+"""
+from __future__ import annotations
+
+from contextlib import contextmanager
+import os
+import queue
+import threading
+from typing import Callable, Iterator
+
+import duckdb
+import pandas as pd
+import pyarrow as pa
+
+import cancellation
+
+
+class _ReleasingBatches:
+    """读完、出错或被回收时归还游标的批次迭代器"""
+
+    def __init__(self, reader: pa.RecordBatchReader, release: Callable[[], None]) -> None:
+        self._reader = reader
+        self._release: Callable[[], None] | None = release
+
+    def __iter__(self) -> _ReleasingBatches:
+        return self
+
+    def __next__(self) -> pa.RecordBatch:
+        try:
+            return self._reader.read_next_batch()
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self) -> None:
+        if self._release is not None:
+            release, self._release = self._release, None
+            release()
+
+    def __del__(self) -> None:
+        self.close()
+
+
+class DuckDBPool:
+    """
+    DuckDB 游标池
+
+    所有游标连接同一个数据库实例，视图等目录对象对所有槽位可见。
+    DuckDB 的 threads / memory_limit 是数据库级设置，
+    对池内每个游标上的查询同样生效。
+    """
+
+    def __init__(self,
+                 size: int | None = None,
+                 database: str = ':memory:',
+                 threads: int | None = None,
+                 memory_limit: str | None = None,
+                 setup: Callable[[duckdb.DuckDBPyConnection], None] | None = None) -> None:
+        self.size = size or min(8, os.cpu_count() or 1)
+        config: dict[str, str | int] = {}
+        if threads:
+            config['threads'] = threads
+        if memory_limit:
+            config['memory_limit'] = memory_limit
+        self.db = duckdb.connect(database, config=config)
+        if setup is not None:
+            setup(self.db)
+        self._cursors = [self.db.cursor() for _ in range(self.size)]
+        self._locks = [threading.Lock() for _ in range(self.size)]
+        self._idle: queue.Queue[int] = queue.Queue()
+        for slot in range(self.size):
+            self._idle.put(slot)
+        # 槽位 -> 借出时所在的取消范围
+        self._scopes: list[cancellation.CancelScope | None] = [None] * self.size
+
+    def _take_idle(self) -> int:
+        """
+        取出一个空闲槽位并加锁
+        指定槽位借出时不离开空闲队列，跳过这些槽位；空闲槽位都被指定借出时轮流短暂等待
+        """
+        seen: set[int] = set()
+        while True:
+            slot = cancellation.get(self._idle)
+            if slot in seen:
+                acquired = self._locks[slot].acquire(timeout=cancellation.POLL_INTERVAL)
+            else:
+                acquired = self._locks[slot].acquire(blocking=False)
+            if acquired:
+                return slot
+            seen.add(slot)
+            self._idle.put(slot)
+
+    def _checkout(self, slot: int | None) -> int:
+        pooled = slot is None
+        # 工具调用超时后不再等待，线程立即归还给执行器
+        if slot is None:
+            slot = self._take_idle()
+        elif not 0 <= slot < self.size:
+            raise ValueError(f"slot {slot} out of range [0, {self.size})")
+        else:
+            cancellation.acquire(self._locks[slot])
+        try:
+            self._scopes[slot] = cancellation.attach(self._cursors[slot])
+        except cancellation.Cancelled:
+            self._locks[slot].release()
+            if pooled:
+                self._idle.put(slot)
+            raise
+        return slot
+
+    def _checkin(self, slot: int, pooled: bool) -> None:
+        cancellation.detach(self._scopes[slot], self._cursors[slot])
+        self._scopes[slot] = None
+        self._locks[slot].release()
+        if pooled:
+            self._idle.put(slot)
+
+    @contextmanager
+    def acquire(self, slot: int | None = None) -> Iterator[duckdb.DuckDBPyConnection]:
+        """
+        借出一个游标
+        Args:
+            slot: 指定槽位，为空时取任意空闲槽位
+        """
+        held = self._checkout(slot)
+        try:
+            yield self._cursors[held]
+        finally:
+            self._checkin(held, slot is None)
+
+    def query(self, sql: str, df: pd.DataFrame | pa.Table | None = None,
+              slot: int | None = None) -> pd.DataFrame:
+        """
+        执行查询
+        Args:
+            sql: SQL 语句
+            df: 注册为 df 的数据表
+            slot: 指定槽位
+        """
+        with self.acquire(slot) as cursor:
+            if df is None:
+                return cursor.execute(sql).df()
+            cursor.register('df', df)
+            try:
+                return cursor.execute(sql).df()
+            finally:
+                cursor.unregister('df')
+
+    def stream(self, sql: str, df: pd.DataFrame | pa.Table | None = None,
+               slot: int | None = None, batch_size: int = 100_000) -> pa.RecordBatchReader:
+        """
+        以 Arrow RecordBatchReader 流式返回查询结果
+        游标在结果读完或读取器被释放前一直被占用
+        Args:
+            sql: SQL 语句
+            df: 注册为 df 的数据表
+            slot: 指定槽位
+            batch_size: 每批行数
+        """
+        held = self._checkout(slot)
+        cursor = self._cursors[held]
+
+        def release() -> None:
+            if df is not None:
+                cursor.unregister('df')
+            self._checkin(held, slot is None)
+
+        try:
+            if df is not None:
+                cursor.register('df', df)
+            reader = cursor.execute(sql).fetch_record_batch(batch_size)
+        except BaseException:
+            release()
+            raise
+
+        return pa.RecordBatchReader.from_batches(reader.schema, _ReleasingBatches(reader, release))
+
+    def close(self) -> None:
+        """关闭所有游标和数据库"""
+        for cursor in self._cursors:
+            cursor.close()
+        self.db.close()
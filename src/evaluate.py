@@ -0,0 +1,242 @@
+"""
+问题集评测
+有界并发地为问题生成 SQL，执行后与标准答案比较，每道题的结果立即追加到 JSONL，
+中断后重新运行时跳过已完成的题目，生成 SQL 失败 (超时、限流等) 的题目默认重试；按问题类别汇总准确率、p50/p95 耗时和 token 用量
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import hashlib
+import json
+import math
+import os
+from pathlib import Path
+import time
+from typing import Any, Awaitable, Callable, Iterable
+
+import pandas as pd
+from pydantic_ai.usage import Usage, UsageLimits
+
+from rollup import frames_match
+from util import do_query, wrap_sql
+
+UNCATEGORIZED = '未分类'
+# 生成 SQL 阶段失败的错误前缀
+GENERATE_ERROR = 'generate: '
+# 正确 / 错误 / 没有标准答案
+_MARKS = {True: '✓', False: '✗', None: '-'}
+
+# 生成 SQL: 问题 -> (SQL, 用量)
+Generate = Callable[[str], Awaitable[tuple[str, Usage | None]]]
+# 执行 SQL: SQL -> 结果
+Execute = Callable[[str], pd.DataFrame]
+
+
+def question_id(question: dict[str, Any]) -> str:
+    """题目 id，未提供时由问题文本生成"""
+    if question.get('id') is not None:
+        return str(question['id'])
+    return hashlib.sha1(question['question'].encode('utf-8')).hexdigest()[:12]
+
+
+def load_checkpoint(path: Path, retry_errors: bool = True) -> dict[str, dict[str, Any]]:
+    """
+    已完成的题目，忽略中断时写了一半的最后一行
+    Args:
+        retry_errors: 为 True 时生成 SQL 失败的题目不算完成，重新运行时重试
+    """
+    done = {}
+    if path.exists():
+        with path.open(encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if retry_errors and record['error'].startswith(GENERATE_ERROR):
+                    continue
+                done[record['id']] = record
+    return done
+
+
+def results_match(expected: pd.DataFrame, actual: pd.DataFrame) -> bool:
+    """忽略列名 (模型的别名各不相同) 和行序比较结果"""
+    if expected.shape[1] != actual.shape[1]:
+        return False
+    names = [f"c{i}" for i in range(expected.shape[1])]
+    expected, actual = expected.set_axis(names, axis=1), actual.set_axis(names, axis=1)
+    return frames_match(expected, actual)
+
+
+def _golden(question: dict[str, Any], execute: Execute) -> pd.DataFrame | None:
+    if question.get('answer') is not None:
+        return pd.DataFrame(question['answer'])
+    sql = question.get('golden_sql') or question.get('sql')
+    return execute(sql) if sql else None
+
+
+async def _evaluate_one(question: dict[str, Any], generate: Generate, execute: Execute) -> dict[str, Any]:
+    record: dict[str, Any] = {
+        'id': question_id(question),
+        'question': question['question'],
+        'category': question.get('category') or UNCATEGORIZED,
+        'sql': '',
+        'error': '',
+        'correct': None,
+        'latency': 0.0,
+        'requests': 0,
+        'input_tokens': 0,
+        'output_tokens': 0,
+    }
+    start = time.perf_counter()
+    try:
+        sql, usage = await generate(question['question'])
+        record['sql'] = sql
+        if usage is not None:
+            record['requests'] = usage.requests
+            record['input_tokens'] = usage.request_tokens or 0
+            record['output_tokens'] = usage.response_tokens or 0
+    except Exception as e:
+        record['error'] = f"{GENERATE_ERROR}{e}"
+    record['latency'] = time.perf_counter() - start
+    if record['error']:
+        return record
+    try:
+        actual = await asyncio.to_thread(execute, record['sql'])
+        expected = await asyncio.to_thread(_golden, question, execute)
+        record['correct'] = None if expected is None else results_match(expected, actual)
+    except Exception as e:
+        record['error'] = f"execute: {e}"
+        record['correct'] = False
+    return record
+
+
+async def evaluate(questions: Iterable[dict[str, Any]], generate: Generate, checkpoint: str | Path,
+                   execute: Execute = do_query, concurrency: int = 4,
+                   on_record: Callable[[dict[str, Any]], None] | None = None,
+                   retry_errors: bool = True) -> list[dict[str, Any]]:
+    """
+    评测问题集
+    Args:
+        questions: [{'question', 'category', 'sql' 或 'answer' (标准答案), 'id'}]
+        generate: 生成 SQL 的协程函数
+        checkpoint: JSONL 结果文件，已有的题目不再评测
+        execute: 执行 SQL 的函数，在线程中调用
+        concurrency: 同时评测的题目数
+        on_record: 每完成一题的回调
+        retry_errors: 重试此前生成 SQL 失败的题目
+    Returns:
+        全部题目的结果，含此前已完成的
+    """
+    checkpoint = Path(checkpoint)
+    checkpoint.parent.mkdir(parents=True, exist_ok=True)
+    done = load_checkpoint(checkpoint, retry_errors)
+    # 中断时写了一半的行之后另起一行
+    if checkpoint.exists() and checkpoint.stat().st_size:
+        with checkpoint.open('rb+') as f:
+            f.seek(-1, 2)
+            if f.read(1) != b'\n':
+                f.write(b'\n')
+    questions = list(questions)
+    pending = [q for q in questions if question_id(q) not in done]
+    semaphore = asyncio.Semaphore(concurrency)
+    lock = asyncio.Lock()
+
+    async def run(question: dict[str, Any]) -> None:
+        async with semaphore:
+            record = await _evaluate_one(question, generate, execute)
+        async with lock:
+            with checkpoint.open('a', encoding='utf-8') as f:
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+            done[record['id']] = record
+        if on_record is not None:
+            on_record(record)
+
+    await asyncio.gather(*(run(q) for q in pending))
+    return [done[question_id(q)] for q in questions if question_id(q) in done]
+
+
+def _percentile(values: list[float], q: float) -> float:
+    """最近秩百分位数"""
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[max(0, math.ceil(q / 100 * len(values)) - 1)]
+
+
+def report(records: Iterable[dict[str, Any]]) -> pd.DataFrame:
+    """
+    按类别汇总，最后一行为全部题目
+    Returns:
+        列: 题数、出错数、准确率 (只计有标准答案的题)、p50/p95 耗时、平均 token
+    """
+    frame = pd.DataFrame(list(records))
+    if frame.empty:
+        return frame
+    groups = [(category, group) for category, group in frame.groupby('category', sort=True)]
+    groups.append(('全部', frame))
+    rows = []
+    for category, group in groups:
+        graded = group['correct'].dropna()
+        rows.append({
+            'category': category,
+            'questions': len(group),
+            'errors': int((group['error'] != '').sum()),
+            'accuracy': float(graded.astype(bool).mean()) if len(graded) else float('nan'),
+            'p50': _percentile(group['latency'].tolist(), 50),
+            'p95': _percentile(group['latency'].tolist(), 95),
+            'input_tokens': float(group['input_tokens'].mean()),
+            'output_tokens': float(group['output_tokens'].mean()),
+        })
+    return pd.DataFrame(rows).set_index('category')
+
+
+def agent_generator(agent, deps, usage_limits: UsageLimits | None = None) -> Generate:
+    """
+    kag_agent 智能体的 SQL 生成函数，不经过问答缓存
+    Args:
+        agent: make_agent() 创建的智能体
+        deps: SupportDependencies
+        usage_limits: 每道题的请求上限
+    """
+    from kag_agent import compile_spec
+    from sql_compiler import QuerySpec
+
+    async def generate(prompt: str) -> tuple[str, Usage]:
+        result = await agent.run(prompt, deps=deps, usage_limits=usage_limits)
+        sql = result.output
+        if isinstance(sql, QuerySpec):
+            sql = await deps.graph.arun(compile_spec, deps, sql)
+        return wrap_sql(sql), result.usage()
+
+    return generate
+
+
+async def _main(args: argparse.Namespace) -> None:
+    from graph.kuzu_graph import KuzuGraph
+    from graph.metric_catalog import MetricCatalog
+    from kag_agent import SupportDependencies, make_agent
+
+    with open(args.questions, encoding='utf-8') as f:
+        questions = json.load(f)
+    graph = KuzuGraph("./kuzudb")
+    deps = SupportDependencies(graph=graph, catalog=MetricCatalog.load(graph))
+    agent = make_agent(structured=os.environ.get("AGENT_OUTPUT", "spec") == "spec")
+    generate = agent_generator(agent, deps, UsageLimits(request_limit=args.request_limit))
+    async with agent.run_mcp_servers():
+        records = await evaluate(questions, generate, args.out, concurrency=args.concurrency,
+                                 retry_errors=not args.keep_errors,
+                                 on_record=lambda r: print(f"[{r['category']}] {r['question']} "
+                                                           f"{_MARKS[r['correct']]} {r['latency']:.1f}s"))
+    print(report(records).to_string(float_format=lambda v: f"{v:.2f}"))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="问题集评测")
+    parser.add_argument('questions', nargs='?', default='reference/question.json')
+    parser.add_argument('--out', default='reference/eval.jsonl', help="JSONL 结果，存在时续跑")
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--request-limit', type=int, default=3)
+    parser.add_argument('--keep-errors', action='store_true', help="不重试此前生成 SQL 失败的题目")
+    asyncio.run(_main(parser.parse_args()))
@@ -0,0 +1,100 @@
+"""
+文件指纹
+以 mtime / size (可选内容哈希) 判断数据文件是否变化，用于缓存失效
+"""
+from __future__ import annotations
+
+import hashlib
+import os
+from pathlib import Path
+import threading
+import time
+from typing import Iterable
+
+_digests: dict[tuple[str, int, int], str] = {}
+_digests_lock = threading.Lock()
+
+# recent_fingerprint 的复查间隔秒数
+RECHECK_SECONDS = float(os.environ.get('FINGERPRINT_RECHECK', '2'))
+_recent: dict[tuple[tuple[str, ...], bool], tuple[float, str]] = {}
+_recent_lock = threading.Lock()
+
+
+def _content_digest(path: str, mtime_ns: int, size: int) -> str:
+    key = (path, mtime_ns, size)
+    with _digests_lock:
+        if key in _digests:
+            return _digests[key]
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    with _digests_lock:
+        _digests[key] = h.hexdigest()
+    return _digests[key]
+
+
+def _expand(paths: Iterable[str | Path]) -> list[str]:
+    files = []
+    for path in paths:
+        path = str(path)
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                files.extend(os.path.join(root, name) for name in names)
+        else:
+            files.append(path)
+    return sorted(set(files))
+
+
+def file_fingerprint(path: str | Path, hash_content: bool = False) -> tuple[str, int, int, str]:
+    """
+    单个文件的指纹
+    Args:
+        path: 文件路径
+        hash_content: 是否计算内容哈希，同一版本的文件只计算一次
+    Returns:
+        (路径, mtime_ns, size, 内容哈希)，文件不存在时 mtime/size 为 -1
+    """
+    path = str(path)
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return (path, -1, -1, '')
+    digest = _content_digest(path, st.st_mtime_ns, st.st_size) if hash_content else ''
+    return (path, st.st_mtime_ns, st.st_size, digest)
+
+
+def paths_fingerprint(paths: Iterable[str | Path], hash_content: bool = False) -> str:
+    """
+    一组文件或目录的组合指纹，目录会递归展开
+    Args:
+        paths: 文件或目录
+        hash_content: 是否计算内容哈希
+    """
+    h = hashlib.sha256()
+    for path in _expand(paths):
+        h.update(repr(file_fingerprint(path, hash_content)).encode('utf-8'))
+    return h.hexdigest()
+
+
+def recent_fingerprint(paths: Iterable[str | Path], max_age: float | None = None,
+                       hash_content: bool = False) -> str:
+    """
+    paths_fingerprint 的短期缓存，max_age 秒内重复调用直接返回上次的结果，
+    用于每次请求都要检查、遍历整个目录代价较高的图数据库版本
+    Args:
+        paths: 文件或目录
+        max_age: 复查间隔秒数，默认 RECHECK_SECONDS，为 0 时每次重新计算
+        hash_content: 是否计算内容哈希
+    """
+    key = (tuple(str(p) for p in paths), hash_content)
+    max_age = RECHECK_SECONDS if max_age is None else max_age
+    now = time.monotonic()
+    with _recent_lock:
+        cached = _recent.get(key)
+    if cached is not None and now - cached[0] < max_age:
+        return cached[1]
+    version = paths_fingerprint(key[0], hash_content)
+    with _recent_lock:
+        _recent[key] = (now, version)
+    return version
@@ -4,10 +4,24 @@ KuzuGraph class.
 """
 from __future__ import annotations
 
-from typing import Dict, List, Any
+import asyncio
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import os
+from pathlib import Path
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, List, Tuple, TypeVar
 
 import kuzu
 
+import cancellation
+from fingerprint import paths_fingerprint
+
+T = TypeVar("T")
+
 class KuzuQueryException(Exception):
     """Exception for the Kuzu queries."""
 
@@ -28,6 +42,30 @@ class KuzuQueryException(Exception):
         return self.details
 
 
+class _PooledConnection:
+    """连接池中的连接及其预编译语句缓存"""
+
+    __slots__ = ('conn', 'statements')
+
+    def __init__(self, conn: kuzu.Connection) -> None:
+        self.conn = conn
+        self.statements: OrderedDict[str, kuzu.PreparedStatement] = OrderedDict()
+
+    def prepare(self, query: str, cache_size: int) -> kuzu.PreparedStatement:
+        """按查询模板缓存预编译语句，命中时跳过解析和计划"""
+        statement = self.statements.get(query)
+        if statement is not None:
+            self.statements.move_to_end(query)
+            return statement
+        statement = self.conn.prepare(query)
+        if not statement.is_success():
+            raise RuntimeError(statement.get_error_message())
+        self.statements[query] = statement
+        while len(self.statements) > cache_size:
+            self.statements.popitem(last=False)
+        return statement
+
+
 class KuzuGraph:
     """
     Kuzu 图数据库操作类
@@ -42,22 +80,92 @@ class KuzuGraph:
         "bool": "BOOL",
     }
 
-    def __init__(self, db_path: str) -> None:
+    def __init__(self, db_path: str, pool_size: int = 4, statement_cache_size: int = 128,
+                 schema_cache_dir: str | Path | None = None, buffer_pool_size: int = 0) -> None:
+        """
+        Args:
+            db_path: 数据库目录
+            pool_size: 连接池大小
+            statement_cache_size: 每个连接缓存的预编译语句数
+            schema_cache_dir: schema 描述的缓存目录
+            buffer_pool_size: 缓冲池字节数，为 0 时使用 Kuzu 默认值 (约系统内存的 80%)
+        """
         self.db_path: str = db_path
-        self.db = kuzu.Database(db_path, read_only=True)
-        self.conn = kuzu.Connection(self.db)
-        self._schema:str = ""
-        self.refresh_schema()
+        self.schema_cache_dir = Path(
+            schema_cache_dir or os.environ.get("KUZU_SCHEMA_CACHE_DIR")
+            or Path(db_path).absolute().parent / ".cache" / "kuzu_schema"
+        )
+        self.db = kuzu.Database(db_path, read_only=True, buffer_pool_size=buffer_pool_size)
+        self.pool_size = pool_size
+        self.statement_cache_size = statement_cache_size
+        self._idle: queue.LifoQueue[_PooledConnection] = queue.LifoQueue()
+        for _ in range(pool_size):
+            self._idle.put(_PooledConnection(kuzu.Connection(self.db)))
+        self._executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix='kuzu')
+        self._stats_lock = threading.Lock()
+        self._checkouts = 0
+        self._waiting = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._schema: str | None = None
+        self._schema_version: str | None = None
+
+    @contextmanager
+    def connection(self) -> Iterator[_PooledConnection]:
+        """
+        从连接池借出一个连接
+        """
+        start = time.perf_counter()
+        with self._stats_lock:
+            self._waiting += 1
+        try:
+            # 工具调用超时后不再等待，线程立即归还给执行器
+            pooled = cancellation.get(self._idle)
+        finally:
+            waited = time.perf_counter() - start
+            with self._stats_lock:
+                self._waiting -= 1
+                self._checkouts += 1
+                self._wait_total += waited
+                self._wait_max = max(self._wait_max, waited)
+        try:
+            scope = cancellation.attach(pooled.conn)
+        except cancellation.Cancelled:
+            self._idle.put(pooled)
+            raise
+        try:
+            yield pooled
+        finally:
+            cancellation.detach(scope, pooled.conn)
+            self._idle.put(pooled)
+
+    def pool_stats(self) -> Dict[str, Any]:
+        """连接池大小与等待时间统计"""
+        with self._stats_lock:
+            return {
+                'size': self.pool_size,
+                'idle': self._idle.qsize(),
+                'waiting': self._waiting,
+                'checkouts': self._checkouts,
+                'wait_total': self._wait_total,
+                'wait_max': self._wait_max,
+                'wait_avg': self._wait_total / self._checkouts if self._checkouts else 0.0,
+            }
 
     def explain(self, query: str, params: Dict[str, Any] | None = None):
         """
         执行查询计划
         """
+        with self.connection() as pooled:
+            self._execute(pooled, query, params).close()
+
+    def _execute(self, pooled: _PooledConnection, query: str,
+                 params: Dict[str, Any] | None = None) -> kuzu.QueryResult:
         try:
             if params is None:
-                self.conn.execute(query)
+                result = pooled.conn.execute(query)
             else:
-                self.conn.execute(query, params)
+                result = pooled.conn.execute(pooled.prepare(query, self.statement_cache_size), params)
         except Exception as e:
             raise KuzuQueryException(
                 {
@@ -65,30 +173,61 @@ class KuzuGraph:
                     "detail": str(e),
                 }
             ) from e
+        if isinstance(result, list):
+            # 多语句时只取最后一条的结果
+            for r in result[:-1]:
+                r.close()
+            result = result[-1]
+        return result
 
-    def query(self, query: str, params: Dict[str, Any] | None = None) -> List[Dict[str, Any]]:
+    def query(self, query: str, params: Dict[str, Any] | None = None,
+              as_tuple: bool = False) -> List[Dict[str, Any]] | List[Tuple[Any, ...]]:
         """
         执行查询
+        Args:
+            query: cypher
+            params: 查询参数
+            as_tuple: 为 True 时每行返回元组，否则返回 {列名: 值}
+        """
+        return list(self.query_iter(query, params, as_tuple))
+
+    def query_iter(self, query: str, params: Dict[str, Any] | None = None,
+                   as_tuple: bool = False) -> Iterator[Dict[str, Any]] | Iterator[Tuple[Any, ...]]:
+        """
+        执行查询并逐行返回结果，不经过 DataFrame，适合大结果集
+        Args:
+            query: cypher
+            params: 查询参数
+            as_tuple: 为 True 时每行返回元组，否则返回 {列名: 值}
+        """
+        # 查询结果在执行后已物化，连接可以先归还
+        with self.connection() as pooled:
+            result = self._execute(pooled, query, params)
+        return self._rows(result, as_tuple)
+
+    async def aquery(self, query: str, params: Dict[str, Any] | None = None,
+                     as_tuple: bool = False) -> List[Dict[str, Any]] | List[Tuple[Any, ...]]:
         """
+        在工作线程中执行查询，不阻塞事件循环
+        """
+        return await self.arun(self.query, query, params, as_tuple)
+
+    async def arun(self, func: Callable[..., T], *args: Any) -> T:
+        """
+        在图数据库的线程池中执行阻塞调用，线程数与连接池大小相同
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    @staticmethod
+    def _rows(result: kuzu.QueryResult, as_tuple: bool) -> Iterator[Any]:
         try:
-            if params is None:
-                result = self.conn.execute(query)
-            else:
-                result = self.conn.execute(query, params)
-            # 假设 Kuzu 的查询结果对象有类似获取列名的方法，这里需要根据实际的 Kuzu API 来调整
-            # 以下代码假设 result 有一个正确的方法来获取列名
-            if isinstance(result, kuzu.QueryResult):                
-                # column_names = result.get_column_names()
-                _df = result.get_as_df()
-                return _df.to_dict(orient="records")
-            return []  # 确保在所有代码路径上返回 List[Dict[str, Any]] 类型的值
-        except Exception as e:
-            raise KuzuQueryException(
-                {
-                    "message": f"Error executing graph query: {query}",
-                    "detail": str(e),
-                }
-            ) from e
+            columns = result.get_column_names()
+            while result.has_next():
+                row = result.get_next()
+                yield tuple(row) if as_tuple else dict(zip(columns, row))
+        finally:
+            result.close()
 
     def _wrap_name(self, name: str) -> str:
         """Wrap name with backticks."""
@@ -96,13 +235,48 @@ class KuzuGraph:
             return f"`{name}`"
         return name
 
+    @property
+    def schema_version(self) -> str:
+        """图数据库目录的指纹，作为 schema 的版本号"""
+        if self._schema_version is None:
+            self._schema_version = paths_fingerprint([self.db_path])
+        return self._schema_version
+
     def refresh_schema(self) -> None:
         """Refreshes the Kùzu graph schema information"""
+        self._schema_version = paths_fingerprint([self.db_path])
+        with self.connection() as pooled:
+            self._schema = self._render_schema(pooled.conn)
+        self._save_schema()
+
+    def _schema_cache_path(self) -> Path:
+        return self.schema_cache_dir / f"{self.schema_version}.txt"
+
+    def _load_schema(self) -> str:
+        """优先读取磁盘上同一版本的 schema 缓存"""
+        path = self._schema_cache_path()
+        try:
+            return path.read_text(encoding="utf-8")
+        except OSError:
+            self.refresh_schema()
+            return self._schema  # type: ignore[return-value]
+
+    def _save_schema(self) -> None:
+        path = self._schema_cache_path()
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_suffix(f".{os.getpid()}.tmp")
+            tmp.write_text(self._schema or "", encoding="utf-8")
+            os.replace(tmp, path)
+        except OSError:
+            pass
+
+    def _render_schema(self, conn: kuzu.Connection) -> str:
         node_properties = []
-        node_table_names = self.conn._get_node_table_names()
+        node_table_names = conn._get_node_table_names()
         for table_name in node_table_names:
             current_table_schema = {"properties": [], "label": self._wrap_name(table_name)}
-            properties = self.conn._get_node_property_names(table_name)
+            properties = conn._get_node_property_names(table_name)
             for property_name in properties:
                 property_type = properties[property_name]["type"]
                 list_type_flag = ""
@@ -120,7 +294,7 @@ class KuzuGraph:
             node_properties.append(current_table_schema)
 
         relationships = []
-        rel_tables = self.conn._get_rel_table_names()
+        rel_tables = conn._get_rel_table_names()
         for table in rel_tables:
             relationships.append(
                 "(:%s)-[:%s]->(:%s)" % (self._wrap_name(table["src"]), table["name"], self._wrap_name(table["dst"]))
@@ -130,7 +304,7 @@ class KuzuGraph:
         for table in rel_tables:
             table_name = self._wrap_name(table["name"])
             current_table_schema = {"properties": [], "label": table_name}
-            query_result = self.conn.execute(
+            query_result = conn.execute(
                 f"CALL table_info('{table_name}') RETURN *;"
             )
             while query_result.has_next(): # pyright: ignore[reportAttributeAccessIssue]
@@ -140,7 +314,7 @@ class KuzuGraph:
                 current_table_schema["properties"].append((prop_name, prop_type))
             rel_properties.append(current_table_schema)
 
-        self._schema = (
+        return (
             "## 图数据库结构:\n"
             f"节点：{node_properties}\n"
             f"关联: {rel_properties}\n"
@@ -149,5 +323,7 @@ class KuzuGraph:
     
     @property
     def schema(self) -> str:
-        """Returns the schema of the Graph"""
+        """Returns the schema of the Graph, computed on first use"""
+        if self._schema is None:
+            self._schema = self._load_schema()
         return self._schema
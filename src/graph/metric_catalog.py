@@ -0,0 +1,155 @@
+"""
+指标目录快照
+运行期间指标图是只读的，启动时一次性读入内存并建立索引，
+MetricTool 在进程内完成指标/维度匹配，不再逐次查询 Kuzu
+"""
+from __future__ import annotations
+
+from typing import Any, Iterable
+
+from fingerprint import recent_fingerprint
+
+from .kuzu_graph import KuzuGraph
+from .name_index import NameIndex
+
+
+class MetricRecord:
+    """指标节点及其维度、数据源"""
+    __slots__ = ('id', 'alias', 'node', 'dimension_ids', 'dimension_mask', 'table_name')
+
+    def __init__(self, node: dict[str, Any]) -> None:
+        self.id: str = node['id']
+        self.alias: str | None = node.get('alias')
+        self.node = node
+        self.dimension_ids: tuple[str, ...] = ()
+        self.dimension_mask = 0
+        self.table_name: str | None = None
+
+
+class DimensionRecord:
+    """维度节点 (Dimension 或 MetricDimension)"""
+    __slots__ = ('id', 'name', 'label', 'node', 'bit')
+
+    def __init__(self, node: dict[str, Any], bit: int) -> None:
+        self.id: str = node['id']
+        self.name: str = node['name']
+        self.label: str = node['_label']
+        self.node = node
+        self.bit = bit
+
+
+class MetricCatalog:
+    """
+    指标图的内存快照
+
+    索引:
+        by_alias: 别名 -> 指标 id
+        metrics[id].dimension_ids: 指标 -> 维度
+        metrics[id].table_name: 指标 -> 数据源
+        metrics[id].dimension_mask: 指标支持的维度名称位图
+        names: 指标/维度名称模糊索引
+    """
+
+    def __init__(self, db_path: str, version: str) -> None:
+        self.db_path = db_path
+        self.version = version
+        self.metrics: dict[str, MetricRecord] = {}
+        self.dimensions: dict[str, DimensionRecord] = {}
+        self.datasources: dict[str, dict[str, Any]] = {}
+        self.by_alias: dict[str, tuple[str, ...]] = {}
+        self.name_bits: dict[str, int] = {}
+        self.names = NameIndex()
+
+    @classmethod
+    def load(cls, graph: KuzuGraph) -> MetricCatalog:
+        """
+        读取整个指标图
+        Args:
+            graph: 指标图数据库
+        """
+        # 重新计算并刷新复查缓存，stale() 与加载时的版本比较
+        catalog = cls(graph.db_path, recent_fingerprint([graph.db_path], max_age=0))
+        for row in graph.query("MATCH (m:Metric) RETURN m"):
+            record = MetricRecord(row['m'])
+            catalog.metrics[record.id] = record
+        for label in ('Dimension', 'MetricDimension'):
+            for row in graph.query(f"MATCH (d:{label}) RETURN d"):
+                catalog._add_dimension(row['d'])
+        for row in graph.query("MATCH (ds:DataSource) RETURN ds"):
+            catalog.datasources[row['ds']['table_name']] = row['ds']
+
+        aliases: dict[str, list[str]] = {}
+        for record in catalog.metrics.values():
+            if record.alias is not None:
+                aliases.setdefault(record.alias, []).append(record.id)
+        catalog.by_alias = {alias: tuple(ids) for alias, ids in aliases.items()}
+
+        uses: dict[str, list[str]] = {}
+        for label in ('Dimension', 'MetricDimension'):
+            for metric_id, dimension_id in graph.query(
+                    f"MATCH (m:Metric)-[:USES_DIMENSION]->(d:{label}) RETURN m.id, d.id", as_tuple=True):
+                uses.setdefault(metric_id, []).append(dimension_id)
+        for metric_id, dimension_ids in uses.items():
+            record = catalog.metrics[metric_id]
+            record.dimension_ids = tuple(dict.fromkeys(dimension_ids))
+            for dimension_id in record.dimension_ids:
+                record.dimension_mask |= catalog.dimensions[dimension_id].bit
+
+        for metric_id, table_name in graph.query(
+                "MATCH (m:Metric)-[:FROM_TABLE]->(ds:DataSource) RETURN m.id, ds.table_name", as_tuple=True):
+            catalog.metrics[metric_id].table_name = table_name
+        catalog.names = NameIndex.from_catalog(catalog)
+        return catalog
+
+    def _add_dimension(self, node: dict[str, Any]) -> None:
+        bit = self.name_bits.get(node['name'])
+        if bit is None:
+            bit = self.name_bits[node['name']] = 1 << len(self.name_bits)
+        record = DimensionRecord(node, bit)
+        self.dimensions[record.id] = record
+
+    def stale(self) -> bool:
+        """图数据库文件是否已不同于加载时的版本"""
+        return recent_fingerprint([self.db_path]) != self.version
+
+    def resolve(self, metric_names: Iterable[str], dimension_names: Iterable[str]) -> list[str]:
+        """
+        找出支持全部维度的指标，只保留维度数最少的那些
+        Args:
+            metric_names: 指标别名列表
+            dimension_names: 维度名称列表
+        Returns:
+            指标 id 列表
+        """
+        required = 0
+        for name in dimension_names:
+            bit = self.name_bits.get(name)
+            if bit is None:
+                return []
+            required |= bit
+
+        candidates = [
+            self.metrics[metric_id]
+            for alias in dict.fromkeys(metric_names)
+            for metric_id in self.by_alias.get(alias, ())
+            if self.metrics[metric_id].dimension_mask & required == required
+        ]
+        if not candidates:
+            return []
+        fewest = min(len(m.dimension_ids) for m in candidates)
+        return [m.id for m in candidates if len(m.dimension_ids) == fewest]
+
+    def fetch(self, metric_id: str) -> tuple[dict[str, Any] | None, list[dict[str, Any]], dict[str, Any] | None]:
+        """
+        与 MetricTool.fetch_metric 相同的返回结构: (指标, 维度列表, 数据源)
+        维度列表只包含 Dimension 节点
+        """
+        record = self.metrics.get(metric_id)
+        if record is None:
+            return (None, [], None)
+        dimensions = [
+            self.dimensions[d].node for d in record.dimension_ids
+            if self.dimensions[d].label == 'Dimension'
+        ]
+        datasource = self.datasources.get(record.table_name) if record.table_name else None
+        return (record.node, dimensions, datasource)
@@ -0,0 +1,136 @@
+"""
+指标/维度名称模糊索引
+在加载指标目录时预先计算字符 n-gram 和维度层级路径，
+把模型给出的近似名称对齐到图中的标准名称，减少因名称不符导致的重试
+"""
+from __future__ import annotations
+
+import re
+from typing import Any, Iterable
+
+METRIC = 'metric'
+DIMENSION = 'dimension'
+
+_SEPARATORS_RE = re.compile(r"[\s\-_/\\>·、,，.。:：'\"“”‘’()（）\[\]【】]+")
+
+
+def normalize(text: str) -> str:
+    """去掉空白、分隔符和引号并转为小写"""
+    return _SEPARATORS_RE.sub('', text).lower()
+
+
+def ngrams(text: str) -> frozenset[str]:
+    """单字和相邻双字"""
+    return frozenset(text) | frozenset(text[i:i + 2] for i in range(len(text) - 1))
+
+
+def _close(text: str, key: str) -> int:
+    """
+    两个名称的公共字符数，不够接近时为 0
+    text 是 key 的子序列 (简称、省略)、key 连续出现在 text 中且 text 只多一个字 (后缀、符号)，
+    或等长 (不少于 4 个字) 且只有一个字不同 (错别字)；
+    中间插入或替换了字的名称 (营业外收入、利润率) 通常是另一个指标，不算接近
+    """
+    if len(text) <= len(key):
+        chars = iter(key)
+        if all(c in chars for c in text):
+            return len(text)
+        if len(text) == len(key) >= 4 and sum(a != b for a, b in zip(text, key)) == 1:
+            return len(text) - 1
+        return 0
+    if len(text) - len(key) == 1 and key in text:
+        return len(key)
+    return 0
+
+
+class NameIndex:
+    """
+    名称模糊索引
+
+    每个标准名称对应若干别名键 (名称、别名、层级路径、层级字段等)，
+    查询先尝试精确键，再在共享 n-gram 的别名键中找足够接近的，按公共字符的 Dice 系数排序；
+    得分低于 min_score 或领先第二名不足 margin 时不对齐
+    """
+
+    def __init__(self, min_score: float = 0.5, margin: float = 0.1) -> None:
+        self.min_score = min_score
+        self.margin = margin
+        self._exact: dict[str, dict[str, dict[str, float]]] = {METRIC: {}, DIMENSION: {}}
+        self._grams: dict[str, dict[str, set[int]]] = {METRIC: {}, DIMENSION: {}}
+        self._keys: dict[str, list[tuple[str, str]]] = {METRIC: [], DIMENSION: []}
+
+    @classmethod
+    def from_catalog(cls, catalog: Any, min_score: float = 0.5, margin: float = 0.1) -> NameIndex:
+        """
+        由指标目录快照构建
+        Args:
+            catalog: graph.metric_catalog.MetricCatalog
+        """
+        index = cls(min_score, margin)
+        for record in catalog.metrics.values():
+            if record.alias:
+                index.add(METRIC, record.alias, [record.alias, record.node.get('name') or ''])
+        for record in catalog.dimensions.values():
+            hierarchy = record.node.get('hierarchy') or []
+            index.add(DIMENSION, record.name, [record.name, ''.join(hierarchy)])
+            index.add(DIMENSION, record.name, hierarchy, weight=0.95)
+        return index
+
+    def add(self, kind: str, canonical: str, names: Iterable[str], weight: float = 1.0) -> None:
+        """
+        登记标准名称及其别名键
+        Args:
+            kind: METRIC 或 DIMENSION
+            canonical: 标准名称
+            names: 可匹配到该标准名称的名称
+            weight: 精确命中别名键时的得分
+        """
+        exact = self._exact[kind]
+        for name in names:
+            key = normalize(name)
+            if not key:
+                continue
+            scores = exact.setdefault(key, {})
+            scores[canonical] = max(scores.get(canonical, 0.0), 1.0 if name == canonical else weight)
+            position = len(self._keys[kind])
+            self._keys[kind].append((canonical, key))
+            for gram in ngrams(key):
+                self._grams[kind].setdefault(gram, set()).add(position)
+
+    def candidates(self, kind: str, text: str, limit: int = 5) -> list[tuple[str, float]]:
+        """
+        按得分从高到低排列的候选标准名称
+        Args:
+            kind: METRIC 或 DIMENSION
+            text: 待匹配的名称
+            limit: 最多返回的候选数
+        """
+        key = normalize(text)
+        if not key:
+            return []
+        scores: dict[str, float] = dict(self._exact[kind].get(key, {}))
+
+        positions: set[int] = set()
+        for gram in ngrams(key):
+            positions.update(self._grams[kind].get(gram, ()))
+        for position in positions:
+            canonical, name = self._keys[kind][position]
+            common = _close(key, name)
+            if not common:
+                continue
+            score = 0.85 * 2 * common / (len(key) + len(name))
+            if score > scores.get(canonical, 0.0):
+                scores[canonical] = score
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        return ranked[:limit]
+
+    def snap(self, kind: str, text: str) -> str:
+        """
+        对齐到得分最高且明显领先的标准名称，找不到足够接近的候选时原样返回，由模型重试
+        """
+        ranked = self.candidates(kind, text, limit=2)
+        if not ranked or ranked[0][1] < self.min_score:
+            return text
+        if len(ranked) > 1 and ranked[0][1] - ranked[1][1] < self.margin:
+            return text
+        return ranked[0][0]
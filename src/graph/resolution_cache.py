@@ -0,0 +1,107 @@
+"""
+指标解析结果缓存
+按 (指标名称集合, 维度名称集合) 缓存 MetricTool 解析出的 {m, d, ds}，
+图数据库目录指纹变化时整体失效，指纹按间隔复查而不是每次查找都遍历目录
+"""
+from __future__ import annotations
+
+from collections import OrderedDict
+import threading
+from typing import Any, Iterable
+
+from fingerprint import recent_fingerprint
+
+ResolutionKey = tuple[str, frozenset[str], frozenset[str]]
+
+
+class ResolutionCache:
+    """
+    进程内的指标解析 LRU 缓存
+    """
+
+    def __init__(self, max_entries: int = 256, recheck: float | None = None) -> None:
+        """
+        Args:
+            max_entries: 最多缓存的条数
+            recheck: 图数据库指纹的复查间隔秒数，默认 fingerprint.RECHECK_SECONDS
+        """
+        self.max_entries = max_entries
+        self.recheck = recheck
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._entries: OrderedDict[ResolutionKey, dict[str, Any]] = OrderedDict()
+        self._versions: dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    @staticmethod
+    def key(db_path: str, metric_names: Iterable[str], dimension_names: Iterable[str]) -> ResolutionKey:
+        """与顺序、重复无关的缓存键"""
+        return (db_path, frozenset(metric_names), frozenset(dimension_names))
+
+    def _check_version(self, db_path: str) -> None:
+        version = recent_fingerprint([db_path], self.recheck)
+        with self._lock:
+            old = self._versions.get(db_path)
+            self._versions[db_path] = version
+            if old is None or old == version:
+                return
+            stale = [k for k in self._entries if k[0] == db_path]
+            for k in stale:
+                del self._entries[k]
+            self.invalidations += 1
+
+    def get(self, db_path: str, metric_names: Iterable[str],
+            dimension_names: Iterable[str]) -> dict[str, Any] | None:
+        """
+        查找缓存
+        Args:
+            db_path: 图数据库路径
+            metric_names: 指标名称列表
+            dimension_names: 维度名称列表
+        """
+        if not self.enabled:
+            return None
+        self._check_version(db_path)
+        key = self.key(db_path, metric_names, dimension_names)
+        with self._lock:
+            payload = self._entries.get(key)
+            if payload is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return payload
+
+    def put(self, db_path: str, metric_names: Iterable[str],
+            dimension_names: Iterable[str], payload: dict[str, Any]) -> None:
+        """写入缓存，超出条数上限时淘汰最久未用的结果"""
+        if not self.enabled:
+            return
+        key = self.key(db_path, metric_names, dimension_names)
+        with self._lock:
+            self._entries[key] = payload
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._versions.clear()
+
+    def stats(self) -> dict[str, int | float]:
+        """命中统计"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'invalidations': self.invalidations,
+                'entries': len(self._entries),
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
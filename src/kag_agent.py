@@ -1,13 +1,23 @@
-from dataclasses import dataclass
+import asyncio
+from dataclasses import dataclass, field
 import os
+from typing import Callable
 
 from dotenv import load_dotenv
 from pydantic_ai import Agent, ModelRetry, RunContext
+from pydantic_ai.messages import ModelResponse, TextPart, ToolCallPart
 from pydantic_ai.mcp import MCPServerStreamableHTTP
 from pydantic_ai.models.openai import OpenAIModel, OpenAIModelSettings
 from pydantic_ai.providers.openai import OpenAIProvider
 
+from answer_cache import AnswerCache
+from fingerprint import recent_fingerprint
 from graph.kuzu_graph import KuzuGraph
+from graph.metric_catalog import MetricCatalog
+from graph.name_index import DIMENSION, METRIC
+from graph.resolution_cache import ResolutionCache
+from sql_compiler import QuerySpec, SpecError, compile_sql
+from timings import StageTimings
 
 bert_server = MCPServerStreamableHTTP(url='http://localhost:8000/mcp')
 
@@ -21,21 +31,58 @@ _settings = OpenAIModelSettings(
     temperature=0.0
 )
 
+_SQL_INSTRUCTIONS = """## 3.生成SQL查询语句
+    根据获得的指标、维度、维度关联的数据源、数据源信息生成SQL查询语句。
+    ** 注意** :
+    - 请严格按照获得的信息生成SQL查询语句。
+    - 需要替换其中的 {Metric.DataSource} 为数据源的名称。
+    - 如果Dimension的required标识为true那么条件必须在输出的SQL中体现。
+    - "本年累计数"不可以做多月累加。
+    ## 输出格式:
+    ```sql
+    SELECT * FROM table_name WHERE condition;
+    ```
+    仅输出SQL查询语句,不要包含任何其他信息。"""
+
+_SPEC_INSTRUCTIONS = """## 3.输出查询规格
+    根据获得的指标、维度信息输出查询规格, SQL由程序根据指标公式和维度字段生成。
+    ** 注意** :
+    - metrics、dimensions 使用调用 metric_query 时的指标名称和维度名称。
+    - group_by、filters 使用维度的层级字段(hierarchy), 例如 财务期间、外服机构。
+    - 如果Dimension的required标识为true那么 filters 中必须包含该维度的条件。
+    - 财务期间格式为YYYYMM; 排名类问题用 order_by 和 limit 表示。"""
+
+# 进程内共享的指标解析结果缓存
+resolution_cache = ResolutionCache(int(os.environ.get("METRIC_CACHE_SIZE", "256")))
+# 问题 -> SQL 缓存，年月/机构作为槽位代入
+answer_cache = AnswerCache(int(os.environ.get("ANSWER_CACHE_SIZE", "512")),
+                           ttl=float(os.environ.get("ANSWER_CACHE_TTL", "86400")))
+
 @dataclass
 class SupportDependencies:
     """指标图数据库"""
     graph: KuzuGraph
+    catalog: MetricCatalog | None = None
+    # 图数据库查询等阶段的耗时
+    timings: StageTimings = field(default_factory=StageTimings)
 
 class MetricTool:
     """
     指标查询工具，用于查询指标信息
     """
 
-    def __init__(self, graph: KuzuGraph):
+    def __init__(self, graph: KuzuGraph, catalog: MetricCatalog | None = None):
         self.graph = graph
+        self.catalog = catalog
         self.metrics = []
         self.dimensions = {}
         self.datasources = {}
+        # 同一次请求内已查询过的指标，以及派生指标的依赖关系
+        self._fetched = {}
+        self._dependencies = None
+        self._visited = set()
+        # 模糊对齐过的名称: 原名称 -> 标准名称
+        self.snapped = {}
     
     @property
     def Metrics(self):
@@ -48,6 +95,11 @@ class MetricTool:
     @property
     def DataSources(self):
         return list(self.datasources.values())
+
+    @property
+    def Resolved(self):
+        """依赖在前的 (指标, 维度列表, 数据源)，供 sql_compiler 使用"""
+        return [self._fetched[m['id']] for m in self.metrics]
     
     def fetch_metric(self, metric_id: str):
         """
@@ -57,37 +109,86 @@ class MetricTool:
         Returns:
             指标信息
         """
-        metric = None
-        dimensions = []
-        datasource = None
-        # print(f"metrics: {metric_ids}")
-        cypher = f"""
-        MATCH (m:Metric)-[:USES_DIMENSION]->(d:Dimension) 
-        WHERE m.id = '{metric_id}'
-        RETURN m,  collect(d) as dimensions
+        return self.fetch_metrics([metric_id])[metric_id]
+
+    def fetch_metrics(self, metric_ids: list[str]):
         """
-        result = self.graph.query(cypher)
-        if result:
-            metric = result[0]['m']
-            dimensions = result[0]['dimensions']
-        
-        cypher = f"""
-        MATCH (m:Metric)-[:FROM_TABLE]->(ds:DataSource)
-        WHERE m.id = '{metric_id}'
-        RETURN ds
+        一次查询多个指标的指标、维度、数据源信息，已查询过的指标直接复用
+        Args:
+            metric_ids: 指标id列表
+        Returns:
+            指标id -> (指标, 维度列表, 数据源)
         """
-        result_ds = self.graph.query(cypher)
-        if result_ds:
-            datasource = result_ds[0]['ds']
+        missing = [i for i in dict.fromkeys(metric_ids) if i not in self._fetched]
+        if missing and self.catalog is not None:
+            for metric_id in missing:
+                self._fetched[metric_id] = self.catalog.fetch(metric_id)
+        elif missing:
+            cypher = """
+            UNWIND $metric_ids AS metric_id
+            MATCH (m:Metric) WHERE m.id = metric_id
+            OPTIONAL MATCH (m)-[:USES_DIMENSION]->(d:Dimension)
+            WITH m, collect(d) AS dimensions
+            OPTIONAL MATCH (m)-[:FROM_TABLE]->(ds:DataSource)
+            RETURN m, dimensions, ds
+            """
+            for row in self.graph.query(cypher, {'metric_ids': missing}):
+                self._fetched[row['m']['id']] = (row['m'], row['dimensions'], row['ds'])
+            for metric_id in missing:
+                self._fetched.setdefault(metric_id, (None, [], None))
+        return {i: self._fetched[i] for i in metric_ids}
+
+    def dependencies(self):
+        """
+        派生指标 -> 依赖指标
+        依赖关系保存在 Metric.dependent_metrics 属性上而不是关系边，
+        因此一次取出全部派生指标后在内存中展开
+        """
+        if self._dependencies is None:
+            if self.catalog is not None:
+                self._dependencies = {
+                    m.id: list(m.node['dependent_metrics'])
+                    for m in self.catalog.metrics.values() if m.node.get('dependent_metrics')
+                }
+            else:
+                cypher = """
+                MATCH (m:Metric) WHERE size(m.dependent_metrics) > 0
+                RETURN m.id, m.dependent_metrics
+                """
+                self._dependencies = dict(self.graph.query(cypher, as_tuple=True))
+        return self._dependencies
+
+    def dependency_closure(self, metric_ids: list[str]):
+        """
+        指标及其全部依赖，依赖排在被依赖的指标之前，重复和循环依赖只保留一次
+        """
+        dependencies = self.dependencies()
+        order = []
+        done = set()
+        for root in metric_ids:
+            if root in done:
+                continue
+            done.add(root)
+            stack = [(root, iter(dependencies.get(root, ())))]
+            while stack:
+                metric_id, pending = stack[-1]
+                for dependent in pending:
+                    if dependent not in done:
+                        done.add(dependent)
+                        stack.append((dependent, iter(dependencies.get(dependent, ()))))
+                        break
+                else:
+                    stack.pop()
+                    order.append(metric_id)
+        return order
 
-        return (metric, dimensions, datasource)
-    
     def fetch_all_metrics(self, metric_ids: list[str]):
-        for metric_id in metric_ids:
-            metric, dimensions, datasource = self.fetch_metric(metric_id)
+        closure = [i for i in self.dependency_closure(metric_ids) if i not in self._visited]
+        fetched = self.fetch_metrics(closure)
+        for metric_id in closure:
+            self._visited.add(metric_id)
+            metric, dimensions, datasource = fetched[metric_id]
             if metric:
-                if metric['dependent_metrics']:
-                    self.fetch_all_metrics(metric['dependent_metrics'])
                 self.metrics.append(metric)
             if dimensions:
                 for d in dimensions:
@@ -96,22 +197,41 @@ class MetricTool:
             if datasource:
                 self.datasources[datasource['table_name']] = datasource
 
+    def snap(self, kind: str, name: str):
+        """将近似的指标/维度名称对齐到图中的标准名称"""
+        canonical = self.catalog.names.snap(kind, name)
+        if canonical != name:
+            self.snapped[name] = canonical
+        return canonical
+
     def query(self, metric_names: list[str], dimension_names: list[str]):
-        metrics = ", ".join([f"'{name}'" for name in metric_names])
-        dimensions = ", ".join([f"'{name}'" for name in dimension_names])
-        
+        # 快照与图数据库版本一致时在进程内匹配，否则回退到 Kuzu 查询
+        if self.catalog is not None and self.catalog.stale():
+            self.catalog = None
+        if self.catalog is not None:
+            metric_names = [self.snap(METRIC, name) for name in metric_names]
+            dimension_names = [self.snap(DIMENSION, name) for name in dimension_names]
+            self.fetch_all_metrics(self.catalog.resolve(metric_names, dimension_names))
+            return
         # 获得能够支持所有维度的指标列表
-        cypher = f"""
-        MATCH (m:Metric)
-        WHERE m.alias IN [{metrics}] 
-        AND COUNT {{ 
-            MATCH (m)-[:USES_DIMENSION]->(d:Dimension:MetricDimension) 
-            WHERE d.name IN [{dimensions}]
-        }} = {len(dimension_names)}  
-        RETURN m.id, COUNT {{ MATCH (m)-[:USES_DIMENSION]->(d:Dimension:MetricDimension) }} as dimension_count
-        """
+        if dimension_names:
+            cypher = """
+            MATCH (m:Metric)-[:USES_DIMENSION]->(d:Dimension:MetricDimension)
+            WHERE m.alias IN $metrics AND d.name IN $dimensions
+            WITH m, count(DISTINCT d.name) AS matched
+            WHERE matched = size($dimensions)
+            RETURN m.id, COUNT { MATCH (m)-[:USES_DIMENSION]->(:Dimension:MetricDimension) } as dimension_count
+            """
+            params = {'metrics': metric_names, 'dimensions': list(dict.fromkeys(dimension_names))}
+        else:
+            cypher = """
+            MATCH (m:Metric)
+            WHERE m.alias IN $metrics
+            RETURN m.id, COUNT { MATCH (m)-[:USES_DIMENSION]->(:Dimension:MetricDimension) } as dimension_count
+            """
+            params = {'metrics': metric_names}
         try:
-            metric_ids = self.graph.query(cypher)
+            metric_ids = self.graph.query(cypher, params)
         except Exception as e:
             raise ModelRetry('未找到相关结果，请重新查询。')
         # 筛选出 metric_ids 中 dimension_count 最小的指标
@@ -123,12 +243,87 @@ class MetricTool:
             self.fetch_all_metrics(min_available_metric_ids)
 
 
-def make_agent():
+def resolve_metrics(deps: SupportDependencies, metric_names: list[str], dimension_names: list[str]):
+    """
+    解析指标、维度、数据源，相同的指标/维度集合直接返回缓存结果
+    Args:
+        deps: 指标图数据库
+        metric_names: 指标名称列表
+        dimension_names: 维度名称列表
+    Returns:
+        dict(m=指标列表, d=维度列表, ds=数据源列表)
+    """
+    db_path = deps.graph.db_path
+    payload = resolution_cache.get(db_path, metric_names, dimension_names)
+    if payload is None:
+        tool = MetricTool(deps.graph, deps.catalog)
+        tool.query(metric_names, dimension_names)
+        payload = dict(m=tool.Metrics, 
+                       d=tool.Dimensions, 
+                       ds=tool.DataSources)
+        resolution_cache.put(db_path, metric_names, dimension_names, payload)
+    return payload
+
+
+async def aresolve_metrics(deps: SupportDependencies, metric_names: list[str], dimension_names: list[str]):
+    """
+    resolve_metrics 的异步版本，各指标在图数据库线程池中并发解析后合并，不阻塞事件循环
+    每个指标名称各自选出维度最少的指标
+    """
+    db_path = deps.graph.db_path
+    payload = resolution_cache.get(db_path, metric_names, dimension_names)
+    if payload is not None:
+        return payload
+    parts = await asyncio.gather(*(
+        deps.graph.arun(resolve_metrics, deps, [name], dimension_names)
+        for name in dict.fromkeys(metric_names)
+    ))
+    metrics, dimensions, datasources = {}, {}, {}
+    for part in parts:
+        metrics.update((m['id'], m) for m in part['m'])
+        dimensions.update((d['id'], d) for d in part['d'])
+        datasources.update((ds['table_name'], ds) for ds in part['ds'])
+    payload = dict(m=list(metrics.values()), 
+                   d=list(dimensions.values()), 
+                   ds=list(datasources.values()))
+    resolution_cache.put(db_path, metric_names, dimension_names, payload)
+    return payload
+
+
+def compile_spec(deps: SupportDependencies, spec: QuerySpec) -> str:
+    """
+    解析查询规格中的指标、维度并编译为SQL
+    与 aresolve_metrics 相同，每个指标名称各自选出维度最少的指标后合并
+    Raises:
+        SpecError: 规格与指标元数据不符
+    """
+    tool = MetricTool(deps.graph, deps.catalog)
+    for name in dict.fromkeys(spec.metrics):
+        tool.query([name], spec.dimensions)
+    return compile_sql(spec, tool.Resolved, tool.snapped)
+
+
+async def validate_spec(ctx: RunContext[SupportDependencies], spec: QuerySpec) -> QuerySpec:
+    """查询规格无法编译时让模型按错误信息重新输出"""
+    try:
+        with ctx.deps.timings.stage('graph'):
+            await ctx.deps.graph.arun(compile_spec, ctx.deps, spec)
+    except SpecError as e:
+        raise ModelRetry(str(e))
+    return spec
+
+
+def make_agent(structured: bool = False):
+    """
+    Args:
+        structured: 为 True 时模型只输出查询规格 (QuerySpec)，SQL 由 sql_compiler 生成
+    """
     agent = Agent(
         _model,
         deps_type=SupportDependencies,
         model_settings=_settings,
-        mcp_servers=[bert_server]
+        mcp_servers=[bert_server],
+        output_type=QuerySpec if structured else str,
     )
 
     def get_graph_schema(ctx: RunContext[SupportDependencies]) -> str:
@@ -145,21 +340,10 @@ def make_agent():
             ... 
         ]
 
-    ## 3.生成SQL查询语句
-    根据获得的指标、维度、维度关联的数据源、数据源信息生成SQL查询语句。
-    ** 注意** :
-    - 请严格按照获得的信息生成SQL查询语句。
-    - 需要替换其中的 {{Metric.DataSource}} 为数据源的名称。
-    - 如果Dimension的required标识为true那么条件必须在输出的SQL中体现。
-    - "本年累计数"不可以做多月累加。
-    ## 输出格式:
-    ```sql
-    SELECT * FROM table_name WHERE condition;
-    ```
-    仅输出SQL查询语句,不要包含任何其他信息。
+    {_SPEC_INSTRUCTIONS if structured else _SQL_INSTRUCTIONS}
     """
 
-    def metric_query(ctx: RunContext[SupportDependencies], metric_names: list[str], dimension_names: list[str]):
+    async def metric_query(ctx: RunContext[SupportDependencies], metric_names: list[str], dimension_names: list[str]):
         """
         指标查询
         Args:
@@ -170,15 +354,85 @@ def make_agent():
         """
         print(f"metric_names: {metric_names}")
         print(f"dimensions: {dimension_names}")
-        tool = MetricTool(ctx.deps.graph)
-        tool.query(metric_names, dimension_names)
-
-        return dict(m=tool.Metrics, 
-                    d=tool.Dimensions, 
-                    ds=tool.DataSources)
+        with ctx.deps.timings.stage('graph'):
+            return await aresolve_metrics(ctx.deps, metric_names, dimension_names)
 
 
     agent.system_prompt(get_graph_schema)
     agent.tool(metric_query)
+    if structured:
+        agent.output_validator(validate_spec)
     
-    return agent
\ No newline at end of file
+    return agent
+
+
+async def ask(agent: Agent, prompt: str, deps: SupportDependencies, **kwargs) -> str:
+    """
+    生成问题对应的SQL，模板相同的问题由缓存代入槽位，不调用模型
+    Args:
+        agent: make_agent() 创建的智能体
+        prompt: 问题
+        deps: 指标图数据库
+        kwargs: 透传给 agent.run 的参数
+    Returns:
+        模型输出的SQL
+    """
+    version = recent_fingerprint([deps.graph.db_path])
+    sql = answer_cache.get(prompt, version)
+    if sql is not None:
+        return sql
+    result = await agent.run(prompt, deps=deps, **kwargs)
+    sql = result.output
+    if isinstance(sql, QuerySpec):
+        with deps.timings.stage('graph'):
+            sql = await deps.graph.arun(compile_spec, deps, sql)
+    answer_cache.put(prompt, version, sql)
+    return sql
+
+
+def _partial_output(message: ModelResponse) -> str:
+    """流式响应中已生成的文本或查询规格 JSON"""
+    parts = []
+    for part in message.parts:
+        if isinstance(part, TextPart):
+            parts.append(part.content)
+        elif isinstance(part, ToolCallPart):
+            parts.append(part.args_as_json_str())
+    return '\n'.join(parts)
+
+
+async def ask_stream(agent: Agent, prompt: str, deps: SupportDependencies,
+                     on_partial: Callable[[str], None] | None = None, **kwargs) -> str:
+    """
+    ask 的流式版本，模型输出过程中把已生成的 SQL 或查询规格交给 on_partial
+    流式输出无法让模型按校验错误重新输出，查询规格编译失败时改用 ask 重试
+    Args:
+        agent: make_agent() 创建的智能体
+        prompt: 问题
+        deps: 指标图数据库
+        on_partial: 接收截至当前已生成内容的回调
+        kwargs: 透传给 agent.run_stream 的参数
+    Returns:
+        SQL
+    """
+    version = recent_fingerprint([deps.graph.db_path])
+    sql = answer_cache.get(prompt, version)
+    if sql is not None:
+        return sql
+    async with agent.run_stream(prompt, deps=deps, **kwargs) as result:
+        message = None
+        async for message, _ in result.stream_structured(debounce_by=0.05):
+            if on_partial is not None:
+                on_partial(_partial_output(message))
+    calls = [p for p in message.parts if isinstance(p, ToolCallPart)] if message else []
+    if not calls:
+        sql = _partial_output(message) if message else ''
+    else:
+        try:
+            spec = QuerySpec.model_validate(calls[-1].args_as_dict())
+            with deps.timings.stage('graph'):
+                sql = await deps.graph.arun(compile_spec, deps, spec)
+        except (ValueError, SpecError):
+            return await ask(agent, prompt, deps, **kwargs)
+    answer_cache.put(prompt, version, sql)
+    return sql
@@ -1,18 +1,32 @@
 import asyncio
+import os
 
-import pandas as pd
 from rich.console import Console
 from rich.live import Live
 from rich.markdown import Markdown
-from rich.table import Table
 
 from graph.kuzu_graph import KuzuGraph
-from kag_agent import SupportDependencies, make_agent
-from util import do_query, prettier_code_blocks, wrap_sql
+from graph.metric_catalog import MetricCatalog
+from kag_agent import SupportDependencies, answer_cache, ask_stream, make_agent
+from util import do_query, iter_pages, prettier_code_blocks, registry, result_table, wrap_sql
+
+# 结果每页行数，首页立即显示，后续按回车继续
+PAGE_SIZE = int(os.environ.get("CLI_PAGE_SIZE", "50"))
+
+def _code_block(text: str) -> Markdown:
+    if text.lstrip().startswith('```'):
+        return Markdown(text)
+    # 查询规格模式下流式显示的是规格 JSON，最终显示编译出的 SQL
+    lang = 'json' if text.lstrip().startswith('{') else 'sql'
+    return Markdown(f"```{lang}\n{text}\n```")
 
 async def main():
     graph = KuzuGraph("./kuzudb")
-    agent = make_agent()
+    catalog = MetricCatalog.load(graph)
+    # AGENT_OUTPUT=sql 时由模型直接输出SQL
+    agent = make_agent(structured=os.environ.get("AGENT_OUTPUT", "spec") == "spec")
+    if 'companies' in registry.available():
+        answer_cache.add_orgs(registry.df('companies')['外服机构'].dropna().unique())
     # prettier_code_blocks()
     console = Console()
     async with agent.run_mcp_servers():
@@ -22,28 +36,35 @@ async def main():
             prompt = input("请输入问题（输入 '\\q' 退出）: ")
             if prompt == '\\q':
                 break
-            result = await agent.run(prompt, deps=SupportDependencies(graph=graph))
-            sql = result.output
-            console.log(Markdown(sql))
-            data = do_query(wrap_sql(sql))
-            if isinstance(data, pd.DataFrame):
-                data = data.round(2)            
-                with Live('', console=console, vertical_overflow='visible') as live:
-                    table = Table(
-                        title='Result',
-                        width=120,
-                    )
-                    for c, dtype in zip(data.columns, data.dtypes):
-                        _justify = "left"
-                        if dtype == 'float64' or dtype == 'int64':
-                            _justify = "right"
-                        table.add_column(c, justify=_justify)
-                    for _, row in data.iterrows():
-                        table.add_row(*[str(v) for v in row.values])
-                    live.update(table)
-                # console.log(result.usage())
-            else:
-                console.log(data, style='green')
+            deps = SupportDependencies(graph=graph, catalog=catalog)
+            timings = deps.timings
+            # 模型生成过程中逐步显示 SQL (或查询规格)
+            with Live('', console=console, vertical_overflow='visible') as live:
+                show = lambda text: live.update(_code_block(text))
+                with timings.stage('LLM', exclude=('graph',)):
+                    sql = await ask_stream(agent, prompt, deps=deps, on_partial=show)
+                show(sql)
+            try:
+                with timings.stage('SQL'):
+                    pages = iter_pages(do_query(wrap_sql(sql), arrow=True), PAGE_SIZE)
+                    page = next(pages, None)
+            except Exception:
+                answer_cache.discard(prompt)
+                raise
+            shown = 0
+            while page is not None:
+                with timings.stage('render'):
+                    console.print(result_table(page, title=f'Result {shown + 1}-{shown + page.num_rows}'))
+                shown += page.num_rows
+                # 预读下一页，判断是否还有更多结果
+                with timings.stage('SQL'):
+                    page = next(pages, None)
+                if page is None or input("回车显示更多，输入任意内容结束: ").strip():
+                    break
+            # 关闭结果流，归还连接池游标
+            pages.close()
+            console.log(timings.summary(), style='dim')
+            # console.log(result.usage())
 
 if __name__ == "__main__":
     asyncio.run(main())
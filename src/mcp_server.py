@@ -1,5 +1,6 @@
 """MCP Server"""
 import os
+import re
 import sys
 from pathlib import Path
 
@@ -10,10 +11,16 @@ from mcp import types
 from mcp.server.lowlevel import Server
 
 from mcp.server.sse import SseServerTransport 
+import httpx
 from starlette.applications import Starlette 
+from starlette.requests import Request
+from starlette.responses import Response
 from starlette.routing import Mount, Route
-from graph.kuzu_graph import KuzuGraph
-from util import do_query
+from result_cursors import CursorNotFound, CursorRegistry
+from result_format import FORMATS, encode_result, encode_rows
+from sql_guard import GuardError, SqlGuard
+from tool_executor import ToolBusy, ToolExecutor, ToolTimeout
+from util import do_query, registry
 
 MCP_DIR = Path(__file__).parent.parent
 sys.path.append(str(MCP_DIR))
@@ -21,20 +28,95 @@ sys.path.append(str(MCP_DIR))
 class MCPRetry(Exception):
     """Retry exception"""
 
+def _tool_timeouts() -> dict[str, float]:
+    """MCP_TOOL_TIMEOUTS=sql_query=60,metric_metadata_query=10"""
+    timeouts = {}
+    for item in os.environ.get("MCP_TOOL_TIMEOUTS", "").split(","):
+        if "=" in item:
+            name, seconds = item.split("=", 1)
+            timeouts[name.strip()] = float(seconds)
+    return timeouts
+
+# 每个工具独立的执行线程和排队上限，元数据查询不会排在大查询后面
+_timeouts = _tool_timeouts()
+_executors = {
+    name: ToolExecutor(name,
+                       max_workers=int(os.environ.get("MCP_TOOL_WORKERS", "4")),
+                       max_queue=int(os.environ.get("MCP_TOOL_QUEUE", "16")),
+                       timeout=_timeouts.get(name, float(os.environ.get("MCP_TOOL_TIMEOUT", "60"))))
+    for name in ("metric_metadata_query", "sql_query", "sql_fetch")
+}
+
+# sql_query 的结果分页游标
+cursors = CursorRegistry(page_size=int(os.environ.get("SQL_PAGE_SIZE", "200")),
+                         idle_timeout=float(os.environ.get("SQL_CURSOR_IDLE", "300")),
+                         max_per_session=int(os.environ.get("SQL_CURSORS_PER_SESSION", "4")))
+
+def _cursors() -> CursorRegistry:
+    """首次查询时按连接池大小确定可同时打开的游标数，导入模块时不创建连接池"""
+    if cursors.max_open is None:
+        # 未读完的游标各占用一个连接池游标，至少留一个给新的查询，否则后续查询一直等待空闲游标
+        cursors.max_open = registry.pool.size - 1
+        if cursors.max_open == 0:
+            print("sql_query: DuckDB 连接池只有一个游标，不保留分页游标，大结果只返回第一页；"
+                  "设置 DUCKDB_POOL_SIZE>=2 以启用分页")
+    return cursors
+
+# 连接池只有一个游标时结果只返回第一页，提示模型缩小结果
+_NO_PAGING = "结果超过一页，但服务未启用分页游标，只返回了第一页；请增加过滤条件、按维度汇总或加 LIMIT 后重新查询。"
+
+# sql_query 的准入检查: 默认 LIMIT、结果行数/字节数和中间结果行数的预算
+guard = SqlGuard(default_limit=int(os.environ.get("SQL_DEFAULT_LIMIT", "10000")),
+                 max_rows=int(os.environ.get("SQL_MAX_ROWS", "100000")),
+                 max_bytes=int(os.environ.get("SQL_MAX_BYTES", str(256 << 20))),
+                 max_plan_rows=int(os.environ.get("SQL_MAX_PLAN_ROWS", "100000000")))
+
+# 结果编码的默认格式、浮点位数和响应字节上限
+RESULT_FORMAT = os.environ.get("MCP_RESULT_FORMAT", "columnar")
+RESULT_DIGITS = int(os.environ.get("MCP_RESULT_DIGITS", "2"))
+RESULT_MAX_BYTES = int(os.environ.get("MCP_RESULT_MAX_BYTES", "65536"))
+
+_format_properties = {
+    "format": {"type": "string", "enum": list(FORMATS),
+               "description": "结果编码: columnar 列式 JSON(默认), csv, arrow(base64 Arrow IPC), records"},
+    "digits": {"type": "integer", "description": "浮点数保留的小数位数，默认 2"},
+}
+
+_graph = None
+
+def _shared_graph():
+    """进程内所有 SSE 会话共用一个只读 KuzuGraph"""
+    global _graph
+    if _graph is None:
+        # kuzu 延迟到服务启动时再导入
+        from graph.kuzu_graph import KuzuGraph
+        db_path = os.environ.get("KUZU_DB_PATH") or str((MCP_DIR / "./kuzudb").absolute())
+        print("kuzu:", db_path)
+        _graph = KuzuGraph(db_path,
+                           pool_size=int(os.environ.get("KUZU_POOL_SIZE", "4")),
+                           buffer_pool_size=int(os.environ.get("KUZU_BUFFER_POOL_SIZE", "0")))
+    return _graph
+
 @asynccontextmanager
 async def app_lifespan(_server: Server) -> AsyncIterator[Dict[str, Any]]:
     """Manage application lifecycle with type-safe context"""
-    # 资源初始化
-    print("kuzu:", str((MCP_DIR / "./kuzudb").absolute()))
-    graph = KuzuGraph(str((MCP_DIR / "./kuzudb").absolute()))
+    # 每个 SSE 会话各自运行一次 lifespan，以此作为游标所属的会话
+    session = object()
+    try:
+        yield {
+            'graph': _shared_graph(),
+            'session': session,
+        }
+    finally:
+        cursors.close_session(session)
 
-   
-    yield {
-        'graph': graph
-    }
+# 多进程模式 (mcp_workers.py) 下的工作进程编号和各进程 Unix socket 所在目录，
+# SSE 会话只存在于建立连接的进程中，消息路径带上进程编号以便转发
+WORKER = os.environ.get("MCP_WORKER")
+WORKER_DIR = os.environ.get("MCP_WORKER_DIR")
 
 # Pass lifespan to server
-sse = SseServerTransport("/messages/")
+sse = SseServerTransport(f"/messages/{WORKER}/" if WORKER else "/messages/")
 server = Server("data_governance", lifespan=app_lifespan)
 
 def _wrap_cypher(cypher: str) -> str:
@@ -43,10 +125,20 @@ def _wrap_cypher(cypher: str) -> str:
         c = c[:-1]
     return c
 
+# 按图数据库 schema 版本预先构建的工具列表
+_tools_by_version: dict[str, list[types.Tool]] = {}
+
 @server.list_tools()
 async def list_tools() -> list[types.Tool]:
     """list tools"""
     _graph = server.request_context.lifespan_context["graph"]
+    version = _graph.schema_version
+    tools = _tools_by_version.get(version)
+    if tools is None:
+        tools = _tools_by_version[version] = _build_tools(_graph.schema)
+    return tools
+
+def _build_tools(schema: str) -> list[types.Tool]:
     return [
         types.Tool(
             name="metric_metadata_query",
@@ -66,7 +158,7 @@ f""""### 指标统计所需信息元数据
 - 获取所有相关的 Dimension 和 DataSource，不要做过滤。
 - 如果Dimension的required标识为true那么条件必须在输出的SQL中体现。
 
-{_graph.schema}
+{schema}
 """,
             inputSchema={
                 "type": "object",
@@ -81,14 +173,36 @@ f""""### 指标统计所需信息元数据
             description="""
             ### 执行SQL查询
 执行此前根据 metric_metadata_query 获得的指标、维度、维度关联的数据源、数据源信息生成SQL查询语句。
+只返回第一页结果，cursor 不为空时可用 sql_fetch 读取后续页；
+结果未读完时 row_count 为空，row_count_estimate 为按执行计划估计的行数，读到最后一页时 row_count 为实际行数。
+只能执行单条只读查询；未写 LIMIT 时自动补上默认 LIMIT，生效的行数在 limit 中返回。
+结果默认为列式 JSON: data.columns 为列名，data.data 为各列的值；
+超过响应大小上限时只返回前若干行，并在 truncated 中给出各列摘要。
 """,
             inputSchema={
                 "type": "object",
                 "properties": {
                     "sql": {"type": "string", "description": "SQL query"},
+                    **_format_properties,
                 },
                 "required": ["sql"]
             }
+        ),
+        types.Tool(
+            name="sql_fetch",
+            description="""
+            ### 读取SQL查询的后续结果
+根据 sql_query 返回的 cursor 读取下一页，cursor 为空表示已读完。
+""",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "cursor": {"type": "string", "description": "sql_query 返回的 cursor"},
+                    "page_size": {"type": "integer", "description": "每页行数"},
+                    **_format_properties,
+                },
+                "required": ["cursor"]
+            }
         )
     ]
 
@@ -96,47 +210,99 @@ f""""### 指标统计所需信息元数据
 async def call_tool(name: str, arguments: dict) -> list[types.TextContent | types.EmbeddedResource]:
     """Call tool"""
     if name == "metric_metadata_query":
-        resp = metric_metadata_query(arguments["cypher"])
-        return [types.TextContent(type="text", text=str(resp))]
+        _graph = server.request_context.lifespan_context["graph"]
+        call = (metric_metadata_query, arguments["cypher"], _graph)
     elif name == "sql_query":
-        resp = sql_query(arguments["sql"])
-        return [types.TextContent(type="text", text=str(resp))]
+        # DuckDB 查询在线程中执行，并发请求由连接池分配游标
+        call = (sql_query, arguments["sql"], server.request_context.lifespan_context["session"],
+                arguments.get("format"), arguments.get("digits"))
+    elif name == "sql_fetch":
+        call = (sql_fetch, arguments["cursor"], server.request_context.lifespan_context["session"],
+                arguments.get("page_size"), arguments.get("format"), arguments.get("digits"))
+    else:
+        raise MCPRetry(f"Unknown tool name: {name}")
 
-    raise MCPRetry(f"Unknown tool name: {name}")
+    try:
+        resp = await _executors[name].run(*call)
+    except (ToolBusy, ToolTimeout) as e:
+        raise MCPRetry(str(e)) from e
+    return [types.TextContent(type="text", text=resp)]
 
 
 
-def metric_metadata_query(cypher: str):
+def metric_metadata_query(cypher: str, _graph):
     """Do cypher query       
     Args:
         query: cypher from agent to execute
+        _graph: 指标图数据库
     """
-    _graph = server.request_context.lifespan_context["graph"]
     # vaildate cypher
     if not cypher.upper().startswith('MATCH'):
         raise MCPRetry('请编写一个MATCH的查询。')
 
     try:
         _wraped_cypher = _wrap_cypher(cypher)
-        return _graph.query(_wraped_cypher)
+        return encode_rows(_graph.query(_wraped_cypher), RESULT_MAX_BYTES)
     except Exception as e:
         raise e
 
-def sql_query(sql: str):
+def _format(fmt: str | None) -> str:
+    """校验结果编码格式，在执行查询、打开或读取游标之前调用"""
+    fmt = fmt or RESULT_FORMAT
+    if fmt not in FORMATS:
+        raise MCPRetry(f'format 只能是 {", ".join(FORMATS)} 之一。')
+    return fmt
+
+def _page(resp: dict[str, Any], fmt: str, digits: int | None = None) -> str:
+    rows = resp.pop('rows')
+    return encode_result(rows, fmt, RESULT_DIGITS if digits is None else digits, RESULT_MAX_BYTES, **resp)
+
+def sql_query(sql: str, session: Any = None, fmt: str | None = None, digits: int | None = None):
     """Do sql query
     Args:
         query: sql from agent to execute
+        session: 游标所属的会话
+        fmt: 结果编码格式
+        digits: 浮点数保留的小数位数
+    Returns:
+        第一页结果、(估计的) 总行数和游标的 JSON
     """
+    fmt = _format(fmt)
+
+    # vaildate sql: 只读单条查询，按执行计划估算的规模准入
+    try:
+        with registry.pool.acquire() as cursor:
+            admission = guard.check(registry.resolve(sql), cursor)
+    except GuardError as e:
+        raise MCPRetry(str(e)) from e
+    sql = admission.sql
 
-    # vaildate sql
-    if not sql.upper().startswith('SELECT'):
-        raise MCPRetry('请编写一个SELECT的查询。')
+    # 不再单独执行 count(*)，未读完时给出准入检查的估计行数，实际行数在读完结果流时得到
+    resp = _cursors().open(session, do_query(sql, arrow=True))
+    more = resp.pop('more', False)
+    if resp['row_count'] is None:
+        resp['row_count_estimate'] = admission.rows
+    if more:
+        resp['message'] = _NO_PAGING
+    return _page({**resp, 'limit': admission.limit}, fmt, digits)
 
+def sql_fetch(cursor: str, session: Any = None, page_size: int | None = None,
+              fmt: str | None = None, digits: int | None = None):
+    """
+    读取 sql_query 游标的下一页
+    Args:
+        cursor: 游标 id
+        session: 游标所属的会话
+        page_size: 每页行数
+        fmt: 结果编码格式
+        digits: 浮点数保留的小数位数
+    """
+    fmt = _format(fmt)
     try:
-        df = do_query(sql)
-        return df.to_dict(orient='records')
-    except Exception as e:
-        raise e
+        resp = cursors.fetch(session, cursor, page_size)
+    except CursorNotFound:
+        raise MCPRetry(f'游标 {cursor} 不存在或已过期，请重新执行 sql_query。')
+    return _page(resp, fmt, digits)
 
 
 async def handle_sse(request):
@@ -150,12 +316,40 @@ async def handle_sse(request):
         await server.run(
             streams[0], streams[1], server.create_initialization_options()
         )  # 运行MCP应用，处理SSE连接
+    return Response()  # 连接断开后返回空响应
+
+_peers: dict[str, httpx.AsyncClient] = {}
+
+def _owner(scope) -> str | None:
+    """消息路径 /messages/<worker>/ 中的工作进程编号"""
+    match = re.search(r"messages/([^/]+)/?$", scope.get("root_path", "") + scope["path"])
+    return match.group(1) if match else None
+
+async def handle_message(scope, receive, send):
+    """处理 POST 消息，会话属于其他工作进程时经其 Unix socket 转发"""
+    owner = _owner(scope)
+    if not WORKER or owner in (None, WORKER):
+        await sse.handle_post_message(scope, receive, send)
+        return
+    peer = _peers.get(owner)
+    if peer is None:
+        transport = httpx.AsyncHTTPTransport(uds=os.path.join(WORKER_DIR, f"{owner}.sock"))
+        peer = _peers[owner] = httpx.AsyncClient(transport=transport, base_url="http://mcp-worker")
+    request = Request(scope, receive)
+    try:
+        forwarded = await peer.post(f"/messages/{owner}/", params=request.query_params,
+                                    content=await request.body(),
+                                    headers={"content-type": request.headers.get("content-type", "application/json")})
+        response = Response(forwarded.content, status_code=forwarded.status_code)
+    except httpx.TransportError:
+        response = Response("Could not find session", status_code=404)
+    await response(scope, receive, send)
 
 starlette_app = Starlette(
     debug=True,  # 启用调试模式
     routes=[
         Route("/sse", endpoint=handle_sse),  # 设置/sse路由，处理函数为handle_sse
-        Mount("/messages/", app=sse.handle_post_message),  # 挂载/messages/路径，处理POST消息
+        Mount("/messages/", app=handle_message),  # 挂载/messages/路径，处理POST消息
     ],
 )  # 创建Starlette应用实例，配置路由
 
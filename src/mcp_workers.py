@@ -0,0 +1,112 @@
+"""
+MCP 多进程服务
+主进程绑定监听端口后启动多个工作进程共享该端口，每个工作进程另外监听自己的 Unix socket。
+SSE 会话只存在于建立连接的进程中，POST 消息落到其他进程时按消息路径中的进程编号转发。
+kuzudb 以只读方式打开，参考数据经 DuckDB 视图直接读取 parquet，
+各进程通过操作系统页缓存共享数据文件，不各自持有 DataFrame 副本
+"""
+from __future__ import annotations
+
+import multiprocessing as mp
+import os
+from pathlib import Path
+import shutil
+import signal
+import socket
+import tempfile
+import time
+
+# 多进程模式下每个进程的默认资源，环境变量已设置时不覆盖
+_DEFAULT_CACHE_BYTES = 256 << 20
+_DEFAULT_BUFFER_POOL = 64 << 20
+
+
+def worker_env(index: int, workers: int, run_dir: str) -> dict[str, str]:
+    """
+    工作进程的环境变量
+    DuckDB 线程数、结果缓存按进程数均分，Kuzu 缓冲池限制为较小的值
+    Args:
+        index: 进程编号
+        workers: 进程数
+        run_dir: 各进程 Unix socket 所在目录
+    """
+    env = {
+        'MCP_WORKER': f"w{index}",
+        'MCP_WORKER_DIR': run_dir,
+    }
+    defaults = {
+        'DUCKDB_THREADS': str(max(1, (os.cpu_count() or 1) // workers)),
+        'SQL_CACHE_BYTES': str(_DEFAULT_CACHE_BYTES // workers),
+        'KUZU_BUFFER_POOL_SIZE': str(_DEFAULT_BUFFER_POOL),
+    }
+    for name, value in defaults.items():
+        if not os.environ.get(name):
+            env[name] = value
+    return env
+
+
+def _run_worker(index: int, sock: socket.socket, env: dict[str, str], log_level: str) -> None:
+    os.environ.update(env)
+    # 环境变量设置后再导入，各进程按自己的配置创建连接池
+    import uvicorn
+    from mcp_server import starlette_app
+
+    path = Path(env['MCP_WORKER_DIR']) / f"{env['MCP_WORKER']}.sock"
+    path.unlink(missing_ok=True)
+    local = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    local.bind(str(path))
+    config = uvicorn.Config(starlette_app, log_level=log_level)
+    uvicorn.Server(config).run(sockets=[sock, local])
+
+
+def serve(host: str, port: int, workers: int, log_level: str = 'info') -> None:
+    """
+    启动多进程服务，工作进程异常退出时以相同编号重启
+    Args:
+        host: 监听地址
+        port: 监听端口
+        workers: 工作进程数
+    """
+    sock = socket.socket(socket.AF_INET6 if ':' in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.set_inheritable(True)
+    run_dir = tempfile.mkdtemp(prefix='mcp-workers-')
+    # 工作进程内有 DuckDB / Kuzu 线程池，用 spawn 而不是 fork 启动
+    context = mp.get_context('spawn')
+    stopping = False
+
+    def start(index: int) -> mp.process.BaseProcess:
+        process = context.Process(target=_run_worker, name=f"mcp-worker-{index}",
+                                  args=(index, sock, worker_env(index, workers, run_dir), log_level))
+        process.start()
+        return process
+
+    def stop(*_) -> None:
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    processes = [start(i) for i in range(workers)]
+    print(f"mcp: {workers} workers on {host}:{port}")
+    try:
+        while not stopping:
+            time.sleep(0.5)
+            for i, process in enumerate(processes):
+                if not process.is_alive() and not stopping:
+                    print(f"mcp: worker {i} exited with {process.exitcode}, restarting")
+                    processes[i] = start(i)
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join(10)
+        sock.close()
+        shutil.rmtree(run_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    serve(os.environ.get("MCP_HOST", "127.0.0.1"),
+          int(os.environ.get("MCP_PORT", "8001")),
+          int(os.environ.get("MCP_WORKERS", str(os.cpu_count() or 1))))
@@ -0,0 +1,127 @@
+"""
+参考事实表分区转换
+将单个 parquet 文件改写为按 财务期间 (可选 地区) 分区的 Hive 目录，
+分区内按常用过滤字段排序，使行组的 min/max 统计信息可用于跳过数据
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+from pathlib import Path
+import shutil
+
+import duckdb
+
+LAYOUT = '_layout.json'
+PARTITIONED_TABLES = ('dm_incm_cost_dtl_rpt', 'dm_finance_mon_balance_sheet_manual_slice')
+SORT_KEYS = ('地区', '所属大区', '外服机构', '指标', '取数类型')
+
+
+def _quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _literal(value: str) -> str:
+    return "'" + value.replace("'", "''") + "'"
+
+
+def partition_table(registry, name: str,
+                    partition_by: tuple[str, ...] = ('财务期间',),
+                    sort_by: tuple[str, ...] = SORT_KEYS,
+                    row_group_size: int = 122_880,
+                    file_size: str = '256MB') -> Path:
+    """
+    将参考表改写为 Hive 分区数据集
+    Args:
+        registry: 参考表注册表 (util.TableRegistry)
+        name: 表名
+        partition_by: 分区字段
+        sort_by: 分区内排序字段，不存在的字段忽略
+        row_group_size: 行组行数
+        file_size: 单个文件大小上限，超过时拆分为多个文件
+    Returns:
+        数据集目录
+    """
+    source = registry.ref_dir / registry.tables[name]
+    target = registry.dataset_dir(name)
+    staging = target.with_name(target.name + '.tmp')
+    shutil.rmtree(staging, ignore_errors=True)
+    staging.mkdir(parents=True)
+
+    conn = duckdb.connect()
+    try:
+        conn.execute(f"CREATE TABLE src AS SELECT * FROM read_parquet({_literal(str(source))})")
+        columns = conn.execute("DESCRIBE src").fetchall()
+        names = [c[0] for c in columns]
+        missing = [p for p in partition_by if p not in names]
+        if missing:
+            raise ValueError(f"{name}: missing partition columns {missing}")
+        sort_keys = [s for s in sort_by if s in names and s not in partition_by]
+        order = f"ORDER BY {', '.join(_quote(s) for s in sort_keys)}" if sort_keys else ""
+        excluded = ", ".join(_quote(p) for p in partition_by)
+        keys = ", ".join(_quote(p) for p in partition_by)
+
+        for values in conn.execute(f"SELECT DISTINCT {keys} FROM src ORDER BY {keys}").fetchall():
+            directory = staging
+            conditions = []
+            for column, value in zip(partition_by, values):
+                if value is None:
+                    conditions.append(f"{_quote(column)} IS NULL")
+                    value = 'NULL'
+                else:
+                    value = str(value)
+                    if '/' in value or '=' in value:
+                        raise ValueError(f"{name}: invalid partition value {column}={value}")
+                    conditions.append(f"CAST({_quote(column)} AS VARCHAR) = {_literal(value)}")
+                directory = directory / f"{column}={value}"
+            directory.parent.mkdir(parents=True, exist_ok=True)
+            conn.execute(f"""
+            COPY (
+                SELECT * EXCLUDE ({excluded}) FROM src
+                WHERE {' AND '.join(conditions)}
+                {order}
+            ) TO {_literal(str(directory))}
+            (FORMAT parquet, COMPRESSION zstd, ROW_GROUP_SIZE {row_group_size}, FILE_SIZE_BYTES '{file_size}')
+            """)
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    finally:
+        conn.close()
+
+    layout = {
+        'columns': [[c[0], c[1]] for c in columns],
+        'partition_by': list(partition_by),
+        'sort_by': sort_keys,
+    }
+    (staging / LAYOUT).write_text(json.dumps(layout, ensure_ascii=False, indent=2), encoding='utf-8')
+    if target.exists():
+        shutil.rmtree(target)
+    os.replace(staging, target)
+    return target
+
+
+def main():
+    from util import registry
+
+    parser = argparse.ArgumentParser(description="将参考事实表改写为按财务期间分区的数据集")
+    parser.add_argument('--by-region', action='store_true', help="同时按 地区 分区")
+    parser.add_argument('--row-group-size', type=int, default=122_880)
+    args = parser.parse_args()
+
+    partition_by = ('财务期间', '地区') if args.by_region else ('财务期间',)
+    for name in PARTITIONED_TABLES:
+        if not (registry.ref_dir / registry.tables[name]).exists():
+            print(f"skip {name}: source not found")
+            continue
+        try:
+            target = partition_table(registry, name, partition_by, row_group_size=args.row_group_size)
+        except ValueError as e:
+            print(f"skip {e}")
+            continue
+        print(f"{name} -> {target}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+"""
+SQL 结果缓存
+以规范化的 SQL 文本和所读 parquet 文件的指纹为键，
+内存中按字节预算做 LRU 淘汰，可选地溢出到 Arrow IPC 文件
+"""
+from __future__ import annotations
+
+from collections import OrderedDict
+import hashlib
+import os
+from pathlib import Path
+import re
+import threading
+from typing import Iterable, Iterator
+
+import pyarrow as pa
+
+from fingerprint import paths_fingerprint
+
+_TOKEN_RE = re.compile(r"('(?:[^']|'')*'|\"(?:[^\"]|\"\")*\")|\s+")
+_VOLATILE_RE = re.compile(
+    r"\b(random|now|today|uuid|gen_random_uuid|current_date|current_time|current_timestamp|"
+    r"get_current_time|get_current_timestamp|setseed|nextval)\b",
+    re.IGNORECASE,
+)
+
+
+def normalize_sql(sql: str) -> str:
+    """合并引号外的空白并去掉结尾分号"""
+    sql = _TOKEN_RE.sub(lambda m: m.group(1) or ' ', sql).strip()
+    return sql.rstrip(';').strip()
+
+
+def is_cacheable(sql: str) -> bool:
+    """含随机数、当前时间等易变函数的查询不缓存"""
+    return _VOLATILE_RE.search(_TOKEN_RE.sub(lambda m: "''" if m.group(1) else ' ', sql)) is None
+
+
+class QueryCache:
+    """
+    查询结果缓存
+    """
+
+    def __init__(self,
+                 max_bytes: int = 256 << 20,
+                 spill_dir: str | Path | None = None,
+                 max_spill_bytes: int | None = None,
+                 max_entry_bytes: int | None = None,
+                 hash_files: bool = False) -> None:
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes or max_bytes // 4
+        self.spill_dir = Path(spill_dir) if spill_dir else None
+        self.max_spill_bytes = max_spill_bytes or max_bytes * 4
+        self.hash_files = hash_files
+        self.hits = 0
+        self.misses = 0
+        self.spill_hits = 0
+        self.evictions = 0
+        self._entries: OrderedDict[str, pa.Table] = OrderedDict()
+        self._bytes = 0
+        self._spilled: OrderedDict[str, int] = OrderedDict()
+        self._spill_bytes = 0
+        self._lock = threading.Lock()
+        if self.spill_dir is not None:
+            self.spill_dir.mkdir(parents=True, exist_ok=True)
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def key(self, sql: str, files: Iterable[str | Path] = ()) -> str:
+        """
+        缓存键
+        Args:
+            sql: SQL 语句
+            files: 查询读取的数据文件或目录
+        """
+        h = hashlib.sha256(normalize_sql(sql).encode('utf-8'))
+        h.update(paths_fingerprint(files, self.hash_files).encode('utf-8'))
+        return h.hexdigest()
+
+    def get(self, key: str) -> pa.Table | None:
+        """查找缓存，内存未命中时再查溢出文件"""
+        with self._lock:
+            table = self._entries.get(key)
+            if table is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return table
+        table = self._load_spilled(key)
+        with self._lock:
+            if table is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.spill_hits += 1
+        self.put(key, table)
+        return table
+
+    def put(self, key: str, table: pa.Table) -> None:
+        """写入缓存，超出字节预算时淘汰最久未用的结果"""
+        size = table.nbytes
+        if not self.enabled or size > self.max_entry_bytes:
+            return
+        evicted = []
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old.nbytes
+            self._entries[key] = table
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                old_key, old_table = self._entries.popitem(last=False)
+                self._bytes -= old_table.nbytes
+                self.evictions += 1
+                evicted.append((old_key, old_table))
+        for old_key, old_table in evicted:
+            self._spill(old_key, old_table)
+
+    def tee(self, key: str, reader: pa.RecordBatchReader) -> pa.RecordBatchReader:
+        """
+        透传流式结果，读完后写入缓存
+        结果超过单条上限时放弃缓存，不影响读取
+        """
+        def batches() -> Iterator[pa.RecordBatch]:
+            kept: list[pa.RecordBatch] | None = []
+            size = 0
+            for batch in reader:
+                if kept is not None:
+                    size += batch.nbytes
+                    if size > self.max_entry_bytes:
+                        kept = None
+                    else:
+                        kept.append(batch)
+                yield batch
+            if kept is not None:
+                self.put(key, pa.Table.from_batches(kept, schema=reader.schema))
+
+        return pa.RecordBatchReader.from_batches(reader.schema, batches())
+
+    def clear(self) -> None:
+        """清空内存和溢出文件"""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            spilled = list(self._spilled)
+            self._spilled.clear()
+            self._spill_bytes = 0
+        for key in spilled:
+            self._spill_path(key).unlink(missing_ok=True)
+
+    def stats(self) -> dict[str, int | float]:
+        """命中统计"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'spill_hits': self.spill_hits,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'spill_bytes': self._spill_bytes,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+    def _spill_path(self, key: str) -> Path:
+        assert self.spill_dir is not None
+        return self.spill_dir / f"{key}.arrow"
+
+    def _spill(self, key: str, table: pa.Table) -> None:
+        if self.spill_dir is None:
+            return
+        path = self._spill_path(key)
+        tmp = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        with pa.OSFile(str(tmp), 'wb') as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(tmp, path)
+        size = path.stat().st_size
+        removed = []
+        with self._lock:
+            self._spill_bytes += size - self._spilled.pop(key, 0)
+            self._spilled[key] = size
+            while self._spill_bytes > self.max_spill_bytes and len(self._spilled) > 1:
+                old_key, old_size = self._spilled.popitem(last=False)
+                self._spill_bytes -= old_size
+                removed.append(old_key)
+        for old_key in removed:
+            self._spill_path(old_key).unlink(missing_ok=True)
+
+    def _load_spilled(self, key: str) -> pa.Table | None:
+        if self.spill_dir is None:
+            return None
+        path = self._spill_path(key)
+        try:
+            with pa.memory_map(str(path), 'r') as source:
+                return pa.ipc.open_file(source).read_all()
+        except (FileNotFoundError, pa.ArrowInvalid):
+            return None
@@ -0,0 +1,178 @@
+"""
+服务端结果游标
+大结果只返回第一页，剩余部分保留在 DuckDB 结果流中按游标分页读取，
+游标空闲超时或超过每个会话的上限时关闭，释放占用的连接池游标
+"""
+from __future__ import annotations
+
+from collections import OrderedDict
+import threading
+import time
+from typing import Any, Callable, Hashable
+import uuid
+
+import pyarrow as pa
+
+
+class CursorNotFound(KeyError):
+    """游标不存在、已读完或已过期"""
+
+
+class _Cursor:
+    __slots__ = ('id', 'session', 'reader', 'pending', 'offset', 'row_count', 'last_used', 'lock')
+
+    def __init__(self, session: Hashable, reader: pa.RecordBatchReader, now: float) -> None:
+        self.id = uuid.uuid4().hex[:12]
+        self.session = session
+        self.reader: pa.RecordBatchReader | None = reader
+        self.pending: pa.RecordBatch | None = None
+        self.offset = 0
+        self.row_count: int | None = None
+        self.last_used = now
+        self.lock = threading.Lock()
+
+    def read(self, size: int) -> tuple[pa.Table, bool]:
+        """读取最多 size 行，返回 (数据, 是否已读完)"""
+        assert self.reader is not None
+        batches = []
+        remaining = size
+        while remaining > 0:
+            batch = self.pending
+            self.pending = None
+            if batch is None:
+                try:
+                    batch = self.reader.read_next_batch()
+                except StopIteration:
+                    return pa.Table.from_batches(batches, schema=self.reader.schema), True
+            if batch.num_rows > remaining:
+                self.pending = batch.slice(remaining)
+                batch = batch.slice(0, remaining)
+            batches.append(batch)
+            remaining -= batch.num_rows
+        return pa.Table.from_batches(batches, schema=self.reader.schema), False
+
+    def close(self) -> None:
+        # 释放读取器引用后连接池游标随之归还
+        with self.lock:
+            self.reader = None
+            self.pending = None
+
+
+class CursorRegistry:
+    """
+    结果游标注册表
+    """
+
+    def __init__(self, page_size: int = 200, idle_timeout: float = 300, max_per_session: int = 4,
+                 max_open: int | None = None, clock: Callable[[], float] = time.monotonic) -> None:
+        """
+        Args:
+            page_size: 默认每页行数
+            idle_timeout: 游标空闲多少秒后关闭
+            max_per_session: 每个会话同时打开的游标数，超过时关闭最久未用的
+            max_open: 所有会话同时打开的游标数，超过时关闭最久未用的，为 0 时不保留游标
+        """
+        self.page_size = page_size
+        self.idle_timeout = idle_timeout
+        self.max_per_session = max_per_session
+        self.max_open = max_open
+        self.clock = clock
+        self.expired = 0
+        self.evicted = 0
+        self._cursors: OrderedDict[str, _Cursor] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def open(self, session: Hashable, reader: pa.RecordBatchReader,
+             count: Callable[[], int] | None = None, page_size: int | None = None) -> dict[str, Any]:
+        """
+        读取第一页，未读完时登记游标
+        Args:
+            session: 会话标识
+            reader: 查询结果流
+            count: 未读完时计算总行数的函数，不传时 row_count 为 None，读到最后一页时为实际行数
+            page_size: 每页行数
+        Returns:
+            {'rows': 第一页 (pa.Table), 'offset': 0, 'row_count': 总行数, 'cursor': 游标 id 或 None}，
+            max_open 为 0 时不登记游标，未读完的结果带 'more': True
+        """
+        self.sweep()
+        cursor = _Cursor(session, reader, self.clock())
+        page, done = cursor.read(page_size or self.page_size)
+        if done:
+            cursor.close()
+            return {'rows': page, 'offset': 0, 'row_count': page.num_rows, 'cursor': None}
+        cursor.offset = page.num_rows
+        cursor.row_count = count() if count is not None else None
+        if self.max_open == 0:
+            cursor.close()
+            return {'rows': page, 'offset': 0, 'row_count': cursor.row_count, 'cursor': None, 'more': True}
+        evicted = []
+        with self._lock:
+            self._cursors[cursor.id] = cursor
+            mine = [c for c in self._cursors.values() if c.session == session]
+            for old in mine[:max(0, len(mine) - self.max_per_session)]:
+                evicted.append(self._cursors.pop(old.id))
+            if self.max_open is not None:
+                for old in list(self._cursors.values())[:max(0, len(self._cursors) - self.max_open)]:
+                    evicted.append(self._cursors.pop(old.id))
+            self.evicted += len(evicted)
+        for old in evicted:
+            old.close()
+        return {'rows': page, 'offset': 0, 'row_count': cursor.row_count, 'cursor': cursor.id}
+
+    def fetch(self, session: Hashable, cursor_id: str, page_size: int | None = None) -> dict[str, Any]:
+        """
+        读取下一页，读完后关闭游标
+        Raises:
+            CursorNotFound: 游标不存在、属于其他会话或已过期
+        """
+        self.sweep()
+        with self._lock:
+            cursor = self._cursors.get(cursor_id)
+            if cursor is None or cursor.session != session:
+                raise CursorNotFound(cursor_id)
+            self._cursors.move_to_end(cursor_id)
+            cursor.last_used = self.clock()
+        with cursor.lock:
+            if cursor.reader is None:
+                raise CursorNotFound(cursor_id)
+            offset = cursor.offset
+            page, done = cursor.read(page_size or self.page_size)
+            cursor.offset += page.num_rows
+            if done:
+                # 读完结果流时得到实际行数
+                cursor.row_count = cursor.offset
+        if done:
+            self.close(cursor_id)
+        return {'rows': page, 'offset': offset, 'row_count': cursor.row_count,
+                'cursor': None if done else cursor_id}
+
+    def close(self, cursor_id: str) -> None:
+        with self._lock:
+            cursor = self._cursors.pop(cursor_id, None)
+        if cursor is not None:
+            cursor.close()
+
+    def close_session(self, session: Hashable) -> None:
+        """会话结束时关闭其全部游标"""
+        with self._lock:
+            closing = [c for c in self._cursors.values() if c.session == session]
+            for cursor in closing:
+                del self._cursors[cursor.id]
+        for cursor in closing:
+            cursor.close()
+
+    def sweep(self) -> None:
+        """关闭空闲超时的游标"""
+        deadline = self.clock() - self.idle_timeout
+        with self._lock:
+            expired = [c for c in self._cursors.values() if c.last_used < deadline and not c.lock.locked()]
+            for cursor in expired:
+                del self._cursors[cursor.id]
+            self.expired += len(expired)
+        for cursor in expired:
+            cursor.close()
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {'open': len(self._cursors), 'expired': self.expired, 'evicted': self.evicted}
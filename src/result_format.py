@@ -0,0 +1,169 @@
+"""
+MCP 工具结果编码
+列式 JSON (列名只出现一次)、按位数取整的 CSV、base64 Arrow IPC，
+超过大小上限时截断并附带整页的列摘要
+"""
+from __future__ import annotations
+
+import base64
+import io
+import json
+from typing import Any, Iterable
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+
+COLUMNAR = 'columnar'
+CSV = 'csv'
+ARROW = 'arrow'
+RECORDS = 'records'
+FORMATS = (COLUMNAR, CSV, ARROW, RECORDS)
+
+
+def round_table(table: pa.Table, digits: int | None) -> pa.Table:
+    """浮点和小数列按位数取整"""
+    if digits is None:
+        return table
+    columns = []
+    for column, field in zip(table.columns, table.schema):
+        if pa.types.is_floating(field.type) or pa.types.is_decimal(field.type):
+            column = pc.round(column, digits)
+        columns.append(column)
+    return pa.Table.from_arrays(columns, schema=table.schema)
+
+
+def _csv(table: pa.Table) -> str:
+    sink = io.BytesIO()
+    pa_csv.write_csv(table, sink)
+    return sink.getvalue().decode('utf-8')
+
+
+def _arrow(table: pa.Table) -> str:
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return base64.b64encode(sink.getvalue().to_pybytes()).decode('ascii')
+
+
+def encode_table(table: pa.Table, fmt: str = COLUMNAR, digits: int | None = 2) -> Any:
+    """
+    编码结果表
+    Args:
+        table: 结果
+        fmt: columnar / csv / arrow / records
+        digits: 浮点取整位数，arrow 格式保持原值
+    Returns:
+        可 JSON 序列化的对象 (columnar / records) 或字符串 (csv / arrow)
+    """
+    if fmt == ARROW:
+        return _arrow(table)
+    table = round_table(table, digits)
+    if fmt == COLUMNAR:
+        return {'columns': table.column_names, 'data': [c.to_pylist() for c in table.columns]}
+    if fmt == CSV:
+        return _csv(table)
+    if fmt == RECORDS:
+        return table.to_pylist()
+    raise ValueError(f"unknown format {fmt!r}, expected one of {FORMATS}")
+
+
+def summarize(table: pa.Table) -> dict[str, Any]:
+    """各列的空值数与最小/最大值或不同值个数"""
+    summary = {}
+    for name, column in zip(table.column_names, table.columns):
+        info: dict[str, Any] = {'nulls': column.null_count}
+        kind = column.type
+        if pa.types.is_integer(kind) or pa.types.is_floating(kind) or pa.types.is_decimal(kind) \
+                or pa.types.is_temporal(kind):
+            bounds = pc.min_max(column)
+            info['min'], info['max'] = bounds['min'].as_py(), bounds['max'].as_py()
+        else:
+            info['distinct'] = pc.count_distinct(column).as_py()
+        summary[name] = info
+    return summary
+
+
+def _dumps(payload: dict[str, Any]) -> str:
+    return json.dumps(payload, ensure_ascii=False, default=str, separators=(',', ':'))
+
+
+def encode_result(table: pa.Table, fmt: str = COLUMNAR, digits: int | None = 2,
+                  max_bytes: int | None = None, **meta: Any) -> str:
+    """
+    编码为 JSON 响应，超过 max_bytes 时只保留能放下的前若干行
+    Args:
+        table: 结果
+        fmt: 编码格式
+        digits: 浮点取整位数
+        max_bytes: 响应字节上限
+        meta: 附加到响应中的字段，如 row_count、cursor
+    """
+    payload = {'format': fmt, **meta, 'data': encode_table(table, fmt, digits)}
+    text = _dumps(payload)
+    if not max_bytes or len(text.encode('utf-8')) <= max_bytes:
+        return text
+
+    # 摘要和取整只在整页上计算一次，二分查找时只重新编码前若干行
+    summary = summarize(table)
+    rounded = table if fmt == ARROW else round_table(table, digits)
+
+    def build(rows: int) -> str:
+        truncated = {
+            'rows_returned': rows,
+            'rows_in_page': table.num_rows,
+            'summary': summary,
+        }
+        return _dumps({'format': fmt, **meta, 'truncated': truncated,
+                       'data': encode_table(rounded.slice(0, rows), fmt, None)})
+
+    lo, hi = 0, table.num_rows - 1
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if len(build(mid).encode('utf-8')) <= max_bytes:
+            lo = mid
+        else:
+            hi = mid - 1
+    return build(lo)
+
+
+def _compact(value: Any) -> Any:
+    """去掉节点的内部 _id 和空属性"""
+    if isinstance(value, dict):
+        return {k: _compact(v) for k, v in value.items() if k != '_id' and v is not None}
+    if isinstance(value, list):
+        return [_compact(v) for v in value]
+    return value
+
+
+def encode_rows(rows: Iterable[dict[str, Any]], max_bytes: int | None = None) -> str:
+    """
+    图查询结果编码为列式 JSON
+    Args:
+        rows: [{列名: 值}]
+        max_bytes: 响应字节上限，超过时只保留前若干行
+    """
+    rows = [_compact(row) for row in rows]
+    columns = list(rows[0]) if rows else []
+
+    def build(count: int) -> str:
+        payload: dict[str, Any] = {
+            'format': COLUMNAR,
+            'row_count': len(rows),
+            'data': {'columns': columns, 'data': [[r.get(c) for r in rows[:count]] for c in columns]},
+        }
+        if count < len(rows):
+            payload['truncated'] = {'rows_returned': count}
+        return _dumps(payload)
+
+    text = build(len(rows))
+    if not max_bytes or len(text.encode('utf-8')) <= max_bytes:
+        return text
+    lo, hi = 0, len(rows) - 1
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if len(build(mid).encode('utf-8')) <= max_bytes:
+            lo = mid
+        else:
+            hi = mid - 1
+    return build(lo)
@@ -0,0 +1,378 @@
+"""
+汇总表 (rollup)
+将收入成本明细按常用维度预聚合为 parquet，
+并把能由汇总表回答的聚合查询改写到行数最少的汇总表上
+"""
+from __future__ import annotations
+
+import copy
+from dataclasses import dataclass
+import json
+import logging
+import os
+from pathlib import Path
+import threading
+from typing import Any
+
+import duckdb
+import pandas as pd
+
+from fingerprint import paths_fingerprint
+
+logger = logging.getLogger(__name__)
+
+ROW_COUNT = '__rows'
+MANIFEST = 'manifest.json'
+
+
+@dataclass(frozen=True)
+class RollupSpec:
+    """汇总表定义"""
+    name: str
+    source: str
+    dimensions: tuple[str, ...]
+
+
+DEFAULT_ROLLUPS = (
+    RollupSpec('rollup_incm_cost_org', 'dm_incm_cost_dtl_rpt',
+               ('财务期间', '地区', '所属大区', '外服机构', '指标', '取数类型')),
+    RollupSpec('rollup_incm_cost_region', 'dm_incm_cost_dtl_rpt',
+               ('财务期间', '地区', '所属大区', '指标', '取数类型')),
+    RollupSpec('rollup_incm_cost_area', 'dm_incm_cost_dtl_rpt',
+               ('财务期间', '地区', '指标', '取数类型')),
+)
+
+_NUMERIC_TYPES = ('TINYINT', 'SMALLINT', 'INTEGER', 'BIGINT', 'HUGEINT', 'UTINYINT', 'USMALLINT',
+                  'UINTEGER', 'UBIGINT', 'FLOAT', 'DOUBLE', 'DECIMAL')
+# 在汇总表上结果不变的维度聚合
+_DIMENSION_AGGREGATES = {'min', 'max', 'any_value', 'arbitrary', 'first'}
+_EXPRESSION_CLASSES = {'COLUMN_REF', 'CONSTANT', 'FUNCTION', 'COMPARISON', 'CONJUNCTION',
+                       'OPERATOR', 'CAST', 'BETWEEN', 'CASE'}
+
+
+def _quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def build_rollups(registry, directory: str | Path | None = None,
+                  specs: tuple[RollupSpec, ...] = DEFAULT_ROLLUPS) -> dict[str, Any]:
+    """
+    物化汇总表并写入清单
+    Args:
+        registry: 参考表注册表 (util.TableRegistry)
+        directory: 输出目录，默认为参考数据下的 rollup 目录
+        specs: 汇总表定义
+    Returns:
+        汇总表清单
+    """
+    directory = Path(directory or registry.ref_dir / 'rollup')
+    directory.mkdir(parents=True, exist_ok=True)
+    conn = duckdb.connect()
+    registry.register(conn)
+    manifest: dict[str, Any] = {}
+    for spec in specs:
+        if spec.source not in registry.available():
+            print(f"skip {spec.name}: {spec.source} not found")
+            continue
+        columns = {row[0]: row[1] for row in conn.execute(f"DESCRIBE {_quote(spec.source)}").fetchall()}
+        missing = [d for d in spec.dimensions if d not in columns]
+        if missing:
+            print(f"skip {spec.name}: missing columns {missing}")
+            continue
+        measures = [c for c, t in columns.items()
+                    if c not in spec.dimensions and t.split('(')[0] in _NUMERIC_TYPES]
+        dims = ", ".join(_quote(d) for d in spec.dimensions)
+        sums = "".join(f", SUM({_quote(m)}) AS {_quote(m)}" for m in measures)
+        path = directory / f"{spec.name}.parquet"
+        conn.execute(f"""
+        COPY (
+            SELECT {dims}{sums}, COUNT(*) AS {ROW_COUNT}
+            FROM {_quote(spec.source)}
+            GROUP BY {dims}
+            ORDER BY {dims}
+        ) TO '{path}' (FORMAT parquet, COMPRESSION zstd)
+        """)
+        rows = conn.execute(f"SELECT count(*) FROM read_parquet('{path}')").fetchone()[0]
+        source_files = [str(registry.path(spec.source))]
+        manifest[spec.name] = {
+            'source': spec.source,
+            'dimensions': list(spec.dimensions),
+            'measures': measures,
+            'rows': rows,
+            'file': str(path),
+            'source_files': source_files,
+            'source_fingerprint': paths_fingerprint(source_files),
+        }
+        print(f"{spec.name}: {rows} rows")
+    conn.close()
+    tmp = directory / f"{MANIFEST}.tmp"
+    tmp.write_text(json.dumps(manifest, ensure_ascii=False, indent=2), encoding='utf-8')
+    os.replace(tmp, directory / MANIFEST)
+    return manifest
+
+
+def frames_match(expected: pd.DataFrame, actual: pd.DataFrame) -> bool:
+    """两个查询结果在忽略行序和浮点误差时是否一致"""
+    if list(expected.columns) != list(actual.columns) or len(expected) != len(actual):
+        return False
+    columns = list(expected.columns)
+    expected = expected.sort_values(columns, ignore_index=True)
+    actual = actual.sort_values(columns, ignore_index=True)
+    try:
+        pd.testing.assert_frame_equal(expected, actual, check_dtype=False, rtol=1e-9)
+    except AssertionError:
+        return False
+    return True
+
+
+class _Scope:
+    """一次改写检查中收集的列引用"""
+
+    def __init__(self, qualifiers: set[str], aliases: set[str], aggregates: set[str]) -> None:
+        self.qualifiers = qualifiers
+        self.aliases = aliases
+        self.aggregates = aggregates
+        self.dimensions: set[str] = set()
+        self.measures: set[str] = set()
+        self.count_stars: list[dict] = []
+        # SUM 中的非零常量，改写为 常量 * 行数
+        self.constants: list[dict] = []
+        self.aggregated = False
+
+
+class RollupCatalog:
+    """
+    汇总表清单与查询改写
+    """
+
+    def __init__(self, directory: str | Path, verify: bool = False) -> None:
+        self.directory = Path(directory)
+        self.verify = verify
+        self._manifest: dict[str, Any] = {}
+        self._manifest_mtime: int | None = None
+        self._conn: duckdb.DuckDBPyConnection | None = None
+        self._aggregates: set[str] = set()
+        self._lock = threading.Lock()
+
+    @property
+    def manifest(self) -> dict[str, Any]:
+        """汇总表清单，文件变化时重新加载"""
+        path = self.directory / MANIFEST
+        try:
+            mtime = path.stat().st_mtime_ns
+        except FileNotFoundError:
+            self._manifest, self._manifest_mtime = {}, None
+            return self._manifest
+        if mtime != self._manifest_mtime:
+            self._manifest = json.loads(path.read_text(encoding='utf-8'))
+            self._manifest_mtime = mtime
+        return self._manifest
+
+    def rewrite(self, sql: str) -> str | None:
+        """
+        将可由汇总表回答的查询改写到最小的汇总表
+        Args:
+            sql: SQL 语句
+        Returns:
+            改写后的 SQL，无法改写时返回 None
+        """
+        manifest = self.manifest
+        sources = {entry['source'] for entry in manifest.values()}
+        if not any(source in sql for source in sources):
+            return None
+        with self._lock:
+            node = self._parse(sql)
+            if node is None:
+                return None
+            table = node['from_table']
+            source = table.get('table_name', '').removeprefix('df_')
+            scope = self._analyze(node, source)
+            if scope is None:
+                return None
+            entry = self._choose(source, scope)
+            if entry is None:
+                return None
+            self._apply(node, scope, entry)
+            return self._conn.execute("SELECT json_deserialize_sql(?)",  # type: ignore[union-attr]
+                                      [json.dumps({'error': False, 'statements': [{'node': node, 'named_param_map': []}]})]
+                                      ).fetchone()[0]
+
+    def _parse(self, sql: str) -> dict | None:
+        if self._conn is None:
+            self._conn = duckdb.connect()
+            self._aggregates = {row[0] for row in self._conn.execute(
+                "SELECT DISTINCT function_name FROM duckdb_functions() WHERE function_type = 'aggregate'"
+            ).fetchall()}
+        try:
+            parsed = json.loads(self._conn.execute("SELECT json_serialize_sql(?)", [sql]).fetchone()[0])
+        except duckdb.Error:
+            return None
+        if parsed.get('error') or len(parsed['statements']) != 1:
+            return None
+        return parsed['statements'][0]['node']
+
+    def _analyze(self, node: dict, source: str) -> _Scope | None:
+        table = node['from_table']
+        if node['type'] != 'SELECT_NODE' or node['cte_map']['map'] or table['type'] != 'BASE_TABLE' \
+                or table['schema_name'] not in ('', 'main') or table['sample'] is not None \
+                or node.get('sample') is not None or node.get('qualify') is not None \
+                or node['aggregate_handling'] not in ('STANDARD_HANDLING', 'FORCE_AGGREGATES'):
+            return None
+        entries = [e for e in self.manifest.values() if e['source'] == source]
+        if not entries:
+            return None
+        aliases = {expr['alias'] for expr in node['select_list'] if expr.get('alias')}
+        qualifiers = {table['table_name'], table['alias']} - {''}
+        scope = _Scope(qualifiers, aliases, self._aggregates)
+        columns = set().union(*(set(e['dimensions']) | set(e['measures']) for e in entries))
+        ok = all(self._check(expr, scope, columns, in_aggregate=False, alias_ok=False)
+                 for expr in node['select_list'])
+        ok = ok and all(self._check(expr, scope, columns, in_aggregate=False, alias_ok=False)
+                        for expr in node['group_expressions'])
+        for clause in ('where_clause', 'having'):
+            if ok and node[clause] is not None:
+                ok = self._check(node[clause], scope, columns, in_aggregate=False,
+                                 alias_ok=clause == 'having')
+        for modifier in node['modifiers']:
+            if ok:
+                ok = all(self._check(expr, scope, columns, in_aggregate=False, alias_ok=True)
+                         for expr in _expressions(modifier))
+        distinct = any(m['type'] == 'DISTINCT_MODIFIER' for m in node['modifiers'])
+        grouped = bool(node['group_expressions']) or node['aggregate_handling'] == 'FORCE_AGGREGATES'
+        if not ok or not (grouped or distinct or scope.aggregated):
+            return None
+        return scope
+
+    def _check(self, expr: dict, scope: _Scope, columns: set[str], in_aggregate: bool, alias_ok: bool,
+               measure_ok: bool = False) -> bool:
+        cls = expr.get('class')
+        if cls not in _EXPRESSION_CLASSES:
+            return False
+        if cls == 'COLUMN_REF':
+            names = expr['column_names']
+            if len(names) == 2 and names[0] in scope.qualifiers:
+                name = names[1]
+            elif len(names) == 1:
+                name = names[0]
+            else:
+                return False
+            if alias_ok and not in_aggregate and len(names) == 1 and name in scope.aliases:
+                return True
+            if name not in columns:
+                return False
+            if measure_ok:
+                scope.measures.add(name)
+            else:
+                scope.dimensions.add(name)
+            return True
+        if cls == 'FUNCTION' and expr['function_name'] in scope.aggregates | {'count_star'}:
+            name = expr['function_name']
+            if in_aggregate or expr['filter'] is not None or expr['order_bys']['orders']:
+                return False
+            scope.aggregated = True
+            if name == 'count_star':
+                scope.count_stars.append(expr)
+                return True
+            if name == 'sum' and not expr['distinct'] and len(expr['children']) == 1:
+                return self._check_measure(expr['children'][0], scope, columns)
+            if name in _DIMENSION_AGGREGATES or (name == 'count' and expr['distinct']):
+                return all(self._check(child, scope, columns, in_aggregate=True, alias_ok=False)
+                           for child in expr['children'])
+            return False
+        return all(self._check(child, scope, columns, in_aggregate, alias_ok)
+                   for child in _expressions(expr))
+
+    def _check_measure(self, expr: dict, scope: _Scope, columns: set[str]) -> bool:
+        """SUM 的参数只能是度量列、常量，或按维度条件取度量列或常量的 CASE"""
+        if expr.get('class') == 'COLUMN_REF':
+            return self._check(expr, scope, columns, in_aggregate=True, alias_ok=False, measure_ok=True)
+        if expr.get('class') == 'CONSTANT':
+            value = expr['value']
+            # 明细每行加一次常量，汇总表上要乘以该行代表的明细行数
+            if not value['is_null'] and value.get('value') != 0:
+                scope.constants.append(expr)
+            return True
+        if expr.get('class') == 'CASE':
+            return all(self._check(check['when_expr'], scope, columns, in_aggregate=True, alias_ok=False)
+                       and self._check_measure(check['then_expr'], scope, columns)
+                       for check in expr['case_checks']) \
+                and self._check_measure(expr['else_expr'], scope, columns)
+        return False
+
+    def _choose(self, source: str, scope: _Scope) -> dict | None:
+        candidates = []
+        for name, entry in self.manifest.items():
+            if entry['source'] != source \
+                    or not scope.dimensions <= set(entry['dimensions']) \
+                    or not scope.measures <= set(entry['measures']):
+                continue
+            if paths_fingerprint(entry['source_files']) != entry['source_fingerprint']:
+                logger.info("rollup %s is stale", name)
+                continue
+            candidates.append(entry)
+        return min(candidates, key=lambda e: (e['rows'], len(e['dimensions'])), default=None)
+
+    def _apply(self, node: dict, scope: _Scope, entry: dict) -> None:
+        assert self._conn is not None
+        # 改写前记下含改写部分的结果列的默认列名
+        rewritten = {id(expr) for expr in scope.count_stars + scope.constants}
+        for expr in node['select_list']:
+            if not expr['alias'] and (id(expr) in rewritten
+                                      or any(id(e) in rewritten for e in _walk(expr))):
+                expr['alias'] = self._render(expr)
+        template = json.loads(self._conn.execute(
+            "SELECT json_serialize_sql(?)",
+            [f"SELECT CAST(COALESCE(sum({ROW_COUNT}), 0) AS BIGINT), NULL * {ROW_COUNT} FROM read_parquet('{entry['file']}')"]
+        ).fetchone()[0])['statements'][0]['node']
+        for expr in scope.count_stars:
+            replacement = copy.deepcopy(template['select_list'][0])
+            replacement['alias'] = expr['alias']
+            expr.clear()
+            expr.update(replacement)
+        for expr in scope.constants:
+            replacement = copy.deepcopy(template['select_list'][1])
+            replacement['children'][0] = copy.deepcopy(expr)
+            replacement['alias'] = expr['alias']
+            expr.clear()
+            expr.update(replacement)
+        table = node['from_table']
+        from_table = template['from_table']
+        from_table['alias'] = table['alias'] or table['table_name']
+        node['from_table'] = from_table
+
+    def _render(self, expr: dict) -> str:
+        """表达式的 SQL 文本，即 DuckDB 的默认列名"""
+        node = self._parse("SELECT NULL")
+        node['select_list'] = [expr]  # type: ignore[index]
+        sql = self._conn.execute("SELECT json_deserialize_sql(?)",  # type: ignore[union-attr]
+                                 [json.dumps({'error': False, 'statements': [{'node': node, 'named_param_map': []}]})]
+                                 ).fetchone()[0]
+        return sql.removeprefix('SELECT ')
+
+
+def _expressions(value: Any):
+    """子表达式"""
+    if isinstance(value, dict):
+        for child in value.values():
+            if isinstance(child, dict) and 'class' in child:
+                yield child
+            elif isinstance(child, (dict, list)):
+                yield from _expressions(child)
+    elif isinstance(value, list):
+        for child in value:
+            if isinstance(child, dict) and 'class' in child:
+                yield child
+            else:
+                yield from _expressions(child)
+
+
+def _walk(expr: dict):
+    """全部后代表达式"""
+    for child in _expressions(expr):
+        yield child
+        yield from _walk(child)
+
+
+if __name__ == "__main__":
+    from util import registry
+    build_rollups(registry)
@@ -3,23 +3,15 @@ import os
 from pathlib import Path
 
 from dotenv import load_dotenv
-import duckdb
-import pandas as pd
 from pydantic_ai.models.openai import OpenAIModel, OpenAIModelSettings
 from pydantic_ai.providers.openai import OpenAIProvider
 from rich.console import Console
 from rich.live import Live
 from rich.markdown import Markdown
-from rich.table import Table
 
+from base_view import income_cost_view
 from single_view_agent import make_agent
-from util import (
-    df_companies,
-    df_dm_incm_cost_dtl_rpt,
-    do_query,
-    prettier_code_blocks,
-    wrap_sql,
-)
+from util import prettier_code_blocks, result_table, wrap_sql
 
 SRC_DIR = Path(__file__).parent.parent
 
@@ -33,9 +25,10 @@ _settings = OpenAIModelSettings(
 )
 
 async def main():
-    with open(SRC_DIR / "reference/income_cost.sql", "r", encoding="utf-8") as f:
-        base_sql = f.read()
-    df = duckdb.query(base_sql).df()
+    # 基础表物化在磁盘上，SQL 或 parquet 变化时才重建
+    view = income_cost_view()
+    conn = view.connect()
+    df = view.schema(conn)
     agent = make_agent(df)
 
     prettier_code_blocks()
@@ -50,25 +43,10 @@ async def main():
         result = await agent.run(prompt, deps=df)
         sql = result.output
         console.log(Markdown(sql))
-        data = do_query(wrap_sql(sql), df)
-        if isinstance(data, pd.DataFrame):
-            data = data.round(2)            
-            with Live('', console=console, vertical_overflow='visible') as live:
-                table = Table(
-                    title='Result',
-                    width=120,
-                )
-                for c, dtype in zip(data.columns, data.dtypes):
-                    _justify = "left"
-                    if dtype == 'float64' or dtype == 'int64':
-                        _justify = "right"
-                    table.add_column(c, justify=_justify)
-                for _, row in data.iterrows():
-                    table.add_row(*[str(v) for v in row.values])
-                live.update(table)
-            # console.log(result.usage())
-        else:
-            console.log(data, style='green')
+        data = conn.execute(wrap_sql(sql)).fetch_record_batch()
+        with Live('', console=console, vertical_overflow='visible') as live:
+            live.update(result_table(data))
+        # console.log(result.usage())
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -4,7 +4,7 @@ from dotenv import load_dotenv
 from pydantic_ai import Agent, RunContext
 from pydantic_ai.models.openai import OpenAIModel, OpenAIModelSettings
 from pydantic_ai.providers.openai import OpenAIProvider
-import pandas as pd
+import pyarrow as pa
 
 load_dotenv()
 _model = OpenAIModel('qwen3-1.7b', provider=OpenAIProvider(
@@ -19,20 +19,20 @@ _settings = OpenAIModelSettings(
     }
 )
 
-def show_df_info(df: pd.DataFrame):
+def show_df_info(df: pa.Table):
     info = []
-    for c, dtype in zip(df.columns, df.dtypes):
-        info.append(f"\"{c}\": {dtype}")
+    for field in df.schema:
+        info.append(f"\"{field.name}\": {field.type}")
     return "\n".join(info)
 
-def make_agent(df: pd.DataFrame):
+def make_agent(df: pa.Table):
     agent = Agent(
         _model,
-        deps_type=pd.DataFrame,
+        deps_type=pa.Table,
         model_settings=_settings,
     )
 
-    def get_graph_schema(ctx: RunContext[pd.DataFrame]) -> str:
+    def get_graph_schema(ctx: RunContext[pa.Table]) -> str:
         return f"""
         你是一个数据分析师，能够熟练的使用sql完成分析，你需要根据提供的表格数据来回答问题。
             这对 ** df ** 表生成SQL
@@ -0,0 +1,304 @@
+"""
+指标 SQL 编译器
+由 MetricTool 解析出的指标公式、维度物理字段/关联表/必选标识和数据源，
+把 (指标, 维度, 过滤条件, 排序/Top-N) 查询规格确定性地编译为 DuckDB SQL
+"""
+from __future__ import annotations
+
+import re
+from typing import Any, Iterable, Literal
+
+from pydantic import BaseModel, Field
+
+YTD = '本年累计数'
+_METRIC_REF_RE = re.compile(r"\{(\w+)\}")
+_CODE_RE = re.compile(r"'([^']*)'\s*" + YTD)
+
+Value = str | int | float
+
+
+class SpecError(ValueError):
+    """查询规格与指标元数据不符"""
+
+
+class Filter(BaseModel):
+    """过滤条件"""
+    field: str = Field(description="维度层级字段或维度名称，如 财务期间、外服机构、取数类型")
+    op: Literal['=', '!=', '>', '>=', '<', '<=', 'in', 'not in', 'between', 'like'] = '='
+    value: Value | list[Value] = Field(description="比较值，in/not in 为列表，between 为 [起, 止]")
+
+
+class OrderBy(BaseModel):
+    """排序"""
+    key: str = Field(description="指标名称或分组字段")
+    desc: bool = True
+
+
+class QuerySpec(BaseModel):
+    """指标查询规格"""
+    metrics: list[str] = Field(description="指标名称，与 metric_query 的 metric_names 相同")
+    dimensions: list[str] = Field(default_factory=list,
+                                  description="维度名称，与 metric_query 的 dimension_names 相同")
+    group_by: list[str] = Field(default_factory=list, description="分组输出的维度层级字段，如 外服机构、财务期间")
+    filters: list[Filter] = Field(default_factory=list)
+    order_by: list[OrderBy] = Field(default_factory=list)
+    limit: int | None = Field(default=None, description="Top-N 的行数")
+
+
+def _quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _literal(value: Value) -> str:
+    if isinstance(value, bool):
+        return 'TRUE' if value else 'FALSE'
+    if isinstance(value, (int, float)):
+        return repr(value)
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def _column(physical: str, table: str) -> str:
+    """物理字段，未带表名时以数据源表名限定"""
+    if '.' in physical:
+        owner, column = physical.split('.', 1)
+        return f"{_quote(owner)}.{_quote(column)}"
+    return f"{_quote(table)}.{_quote(physical)}"
+
+
+def _values(f: Filter) -> list[Value]:
+    return f.value if isinstance(f.value, list) else [f.value]
+
+
+def _condition(column: str, f: Filter) -> str:
+    values = _values(f)
+    if f.op in ('in', 'not in'):
+        return f"{column} {f.op.upper()} ({', '.join(_literal(v) for v in values)})"
+    if f.op == 'between':
+        if len(values) != 2:
+            raise SpecError(f"{f.field} between 需要两个值")
+        return f"{column} BETWEEN {_literal(values[0])} AND {_literal(values[1])}"
+    if len(values) != 1:
+        raise SpecError(f"{f.field} {f.op} 只能有一个值")
+    return f"{column} {f.op.upper()} {_literal(values[0])}"
+
+
+class _Source:
+    """单个数据源上的基础指标、维度字段"""
+
+    def __init__(self, alias: str, datasource: dict[str, Any]) -> None:
+        self.alias = alias
+        self.table: str = datasource['table_name']
+        self.columns: set[str] = set(datasource.get('columns') or ())
+        self.metrics: list[dict[str, Any]] = []
+        self.dimensions: dict[str, dict[str, Any]] = {}
+
+    def field(self, name: str) -> tuple[str, dict[str, Any] | None] | None:
+        """
+        字段 -> (限定后的物理字段, 所属维度)
+        依次匹配维度层级字段、物理字段映射和数据源原始列
+        """
+        for dimension in self.dimensions.values():
+            hierarchy = dimension.get('hierarchy') or []
+            physical = dimension.get('physical_fields') or {}
+            if name in hierarchy or name in physical:
+                return _column(physical.get(name, name), self.table), dimension
+        if name in self.columns:
+            return _column(name, self.table), None
+        return None
+
+    def fields(self, name: str) -> list[tuple[str, str, dict[str, Any] | None]]:
+        """字段或维度名称展开为 [(输出名, 物理字段, 维度)]"""
+        for dimension in self.dimensions.values():
+            if dimension.get('name') == name and dimension.get('hierarchy'):
+                return [(level, *self.field(level)) for level in dimension['hierarchy']]  # type: ignore[misc]
+        found = self.field(name)
+        return [(name, *found)] if found else []
+
+
+def compile_sql(spec: QuerySpec,
+                resolved: Iterable[tuple[dict[str, Any] | None, list[dict[str, Any]], dict[str, Any] | None]],
+                aliases: dict[str, str] | None = None) -> str:
+    """
+    编译查询规格
+    Args:
+        spec: 查询规格
+        resolved: MetricTool.Resolved，依赖在前的 (指标, 维度列表, 数据源)
+        aliases: 规格中的指标名称 -> 标准名称 (MetricTool.snapped)
+    Returns:
+        DuckDB SQL
+    Raises:
+        SpecError: 指标、字段找不到，缺少必选维度条件，或本年累计数会被跨月累加
+    """
+    aliases = aliases or {}
+    metrics: dict[str, dict[str, Any]] = {}
+    sources: dict[str, _Source] = {}
+    source_of: dict[str, _Source] = {}
+    for metric, dimensions, datasource in resolved:
+        if metric is None:
+            continue
+        metrics[metric['id']] = metric
+        if metric.get('dependent_metrics'):
+            continue
+        if datasource is None:
+            raise SpecError(f"指标 {metric['name']} 没有数据源")
+        source = sources.get(datasource['table_name'])
+        if source is None:
+            source = sources[datasource['table_name']] = _Source(f"s{len(sources)}", datasource)
+        source.metrics.append(metric)
+        for dimension in dimensions:
+            source.dimensions[dimension['id']] = dimension
+        source_of[metric['id']] = source
+
+    targets = []
+    for name in spec.metrics:
+        name = aliases.get(name, name)
+        found = [m for m in metrics.values() if name in (m['id'], m.get('alias'), m.get('name'))]
+        if not found:
+            raise SpecError(f"未找到指标 {name}")
+        targets.extend(m for m in found if m not in targets)
+    if not sources:
+        raise SpecError("没有可用的数据源")
+    for f in spec.filters:
+        if not any(source.fields(f.field) for source in sources.values()):
+            raise SpecError(f"未找到过滤字段 {f.field}")
+
+    group: list[str] = []
+    ctes = []
+    for source in sources.values():
+        selects, keys = [], []
+        for name in spec.group_by:
+            expanded = source.fields(name)
+            if not expanded:
+                raise SpecError(f"数据源 {source.table} 没有分组字段 {name}")
+            for output, column, _ in expanded:
+                if output not in keys:
+                    keys.append(output)
+                    selects.append(f"{column} AS {_quote(output)}")
+        if not group:
+            group = keys
+        elif keys != group:
+            raise SpecError("多个数据源的分组字段不一致")
+        ctes.append(_compile_source(source, spec, selects, keys))
+
+    exprs: dict[str, str] = {}
+
+    def expression(metric_id: str, stack: tuple[str, ...] = ()) -> str:
+        if metric_id in exprs:
+            return exprs[metric_id]
+        if metric_id in stack:
+            raise SpecError(f"指标 {metric_id} 循环依赖")
+        metric = metrics.get(metric_id)
+        if metric is None:
+            raise SpecError(f"未找到依赖指标 {metric_id}")
+        if metric_id in source_of:
+            expr = f"{source_of[metric_id].alias}.{_quote(metric_id)}"
+        else:
+            expr = _METRIC_REF_RE.sub(lambda m: f"({expression(m.group(1), stack + (metric_id,))})",
+                                      metric['formula'])
+        exprs[metric_id] = expr
+        return expr
+
+    outputs = {m['name']: expression(m['id']) for m in targets}
+    columns = [_quote(key) for key in group] + [f"{expr} AS {_quote(name)}" for name, expr in outputs.items()]
+    aliases_list = [s.alias for s in sources.values()]
+    joined = aliases_list[0]
+    for alias in aliases_list[1:]:
+        if group:
+            joined += f" FULL JOIN {alias} USING ({', '.join(_quote(k) for k in group)})"
+        else:
+            joined += f" CROSS JOIN {alias}"
+
+    sql = "WITH " + ",\n".join(ctes) + f"\nSELECT {', '.join(columns)}\nFROM {joined}"
+    if spec.order_by:
+        orders = []
+        for order in spec.order_by:
+            key = aliases.get(order.key, order.key)
+            target = next((m['name'] for m in targets if key in (m['id'], m.get('alias'), m['name'])), None)
+            if target is None and key not in group:
+                raise SpecError(f"排序字段 {order.key} 不在输出中")
+            orders.append(f"{_quote(target or key)} {'DESC' if order.desc else 'ASC'}")
+        sql += f"\nORDER BY {', '.join(orders)}"
+    if spec.limit is not None:
+        sql += f"\nLIMIT {int(spec.limit)}"
+    return sql
+
+
+def _compile_source(source: _Source, spec: QuerySpec, selects: list[str], keys: list[str]) -> str:
+    joins: dict[str, str] = {}
+    conditions: list[str] = []
+    # 只涉及数据源本表的条件，用于本年累计数取最后一期
+    local: list[str] = []
+    filtered: dict[str, list[Filter]] = {}
+
+    for output, _, dimension in (x for name in spec.group_by for x in source.fields(name)):
+        if dimension and dimension.get('with_table'):
+            joins[dimension['with_table']] = dimension.get('join_condition') or ''
+
+    for f in spec.filters:
+        expanded = source.fields(f.field)
+        if not expanded:
+            continue
+        _, column, dimension = expanded[-1]
+        condition = _condition(column, f)
+        conditions.append(condition)
+        if dimension is not None:
+            filtered.setdefault(dimension['id'], []).append(f)
+            if dimension.get('with_table'):
+                joins[dimension['with_table']] = dimension.get('join_condition') or ''
+                continue
+        local.append(condition)
+
+    for dimension in source.dimensions.values():
+        if dimension.get('required') and dimension['id'] not in filtered:
+            raise SpecError(f"维度 {dimension['name']} 为必选条件，请在 filters 中指定"
+                            + (f" ({dimension['annotations']})" if dimension.get('annotations') else ""))
+
+    conditions.extend(_year_to_date(source, spec, filtered, local))
+
+    sql = f"{source.alias} AS (\n    SELECT {', '.join(selects + _metric_columns(source))}\n    FROM {_quote(source.table)}"
+    for table, condition in joins.items():
+        if not condition:
+            raise SpecError(f"关联表 {table} 缺少关联条件")
+        sql += f"\n    JOIN {_quote(table)} ON {condition}"
+    if conditions:
+        sql += "\n    WHERE " + "\n      AND ".join(conditions)
+    if keys:
+        sql += "\n    GROUP BY " + ", ".join(str(i + 1) for i in range(len(keys)))
+    return sql + "\n)"
+
+
+def _metric_columns(source: _Source) -> list[str]:
+    return [
+        f"{m['formula'].replace('{Metric.DataSource}', _quote(source.table))} AS {_quote(m['id'])}"
+        for m in source.metrics
+    ]
+
+
+def _year_to_date(source: _Source, spec: QuerySpec,
+                  filtered: dict[str, list[Filter]], local: list[str]) -> list[str]:
+    """
+    本年累计数是截至当期的累计值，不能跨月相加:
+    没有按时间分组且时间条件不是单月时，只取条件范围内的最后一期
+    """
+    time = next((d for d in source.dimensions.values() if d.get('type') == 'time' and d.get('hierarchy')), None)
+    if time is None:
+        return []
+    for dimension in source.dimensions.values():
+        match = _CODE_RE.search(dimension.get('annotations') or '')
+        if match is None or dimension['id'] not in filtered:
+            continue
+        selected = {str(v) for f in filtered[dimension['id']] if f.op in ('=', 'in') for v in _values(f)}
+        if match.group(1) not in selected:
+            continue
+        if any(level in spec.group_by for level in time['hierarchy']) or time['name'] in spec.group_by:
+            return []
+        periods = filtered.get(time['id'], [])
+        if len(periods) == 1 and periods[0].op == '=':
+            return []
+        if len(selected) > 1:
+            raise SpecError(f"{YTD}与其他取数类型不能在未按时间分组时一起汇总")
+        column = _column((time.get('physical_fields') or {}).get(time['hierarchy'][0], time['hierarchy'][0]),
+                         source.table)
+        where = f" WHERE {' AND '.join(local)}" if local else ""
+        return [f"{column} = (SELECT max({column}) FROM {_quote(source.table)}{where})"]
+    return []
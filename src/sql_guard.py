@@ -0,0 +1,140 @@
+"""
+SQL 准入检查
+用 DuckDB 自身的解析器确认是单条只读查询，未指定 LIMIT 时补上默认 LIMIT，
+再按 EXPLAIN 的基数估计拒绝结果或中间结果超出预算的查询
+"""
+from __future__ import annotations
+
+import json
+from dataclasses import dataclass
+from typing import Any
+
+import duckdb
+
+# 估算结果字节数时各类型的平均宽度，未列出的按 8 字节
+_TYPE_WIDTH = {
+    'BOOLEAN': 1, 'TINYINT': 1, 'SMALLINT': 2, 'INTEGER': 4, 'DATE': 4, 'FLOAT': 4,
+    'HUGEINT': 16, 'UUID': 16, 'VARCHAR': 24, 'BLOB': 64,
+}
+
+
+class GuardError(ValueError):
+    """查询未通过准入检查，修改 SQL 后可重试"""
+
+
+@dataclass
+class Admission:
+    """通过检查的查询"""
+    sql: str
+    # 估算的结果行数、字节数和计划中最大的中间结果行数
+    rows: int
+    bytes: int
+    plan_rows: int
+    # 补上或收紧了 LIMIT 时为生效的行数
+    limit: int | None = None
+
+
+def _limit(node: dict[str, Any]) -> int | None:
+    """最外层查询的常量 LIMIT，没有时为 None，非常量时为 -1"""
+    for modifier in node.get('modifiers', []):
+        if modifier['type'] != 'LIMIT_MODIFIER' or modifier.get('limit') is None:
+            continue
+        value = modifier['limit']
+        if value.get('type') == 'VALUE_CONSTANT' and not value['value'].get('is_null'):
+            return int(value['value']['value'])
+        return -1
+    return None
+
+
+def _estimate(node: dict[str, Any], peak: list[int]) -> int:
+    """
+    节点的估计基数，缺失或为 0 (延迟物化改写后的投影) 时由子节点推算；
+    peak[0] 记录最大值
+    """
+    children = [_estimate(child, peak) for child in node.get('children', [])]
+    value = int((node.get('extra_info') or {}).get('Estimated Cardinality') or 0)
+    if value:
+        rows = value
+    elif node.get('name', '').strip() == 'CROSS_PRODUCT':
+        rows = 1
+        for child in children:
+            rows *= child
+    else:
+        rows = max(children, default=1)
+    peak[0] = max(peak[0], rows)
+    return rows
+
+
+def _width(types: list[Any]) -> int:
+    return sum(_TYPE_WIDTH.get(str(t).split('(')[0], 8) for t in types) or 1
+
+
+class SqlGuard:
+    """
+    SQL 准入检查
+    """
+
+    def __init__(self, default_limit: int = 10000, max_rows: int = 100000,
+                 max_bytes: int = 256 << 20, max_plan_rows: int = 100_000_000) -> None:
+        """
+        Args:
+            default_limit: 未指定 LIMIT 时补上的行数
+            max_rows: 结果行数上限，显式 LIMIT 超过或不是常量时收紧到该值
+            max_bytes: 估算的结果字节数上限
+            max_plan_rows: 计划中任一算子估算行数的上限，拦截无条件的笛卡尔积等
+        """
+        self.default_limit = default_limit
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.max_plan_rows = max_plan_rows
+
+    def check(self, sql: str, cursor: duckdb.DuckDBPyConnection) -> Admission:
+        """
+        检查并改写查询
+        Args:
+            sql: 待执行的 SQL
+            cursor: 已注册参考表视图的 DuckDB 游标，用于绑定和 EXPLAIN
+        Returns:
+            Admission，sql 为补上 LIMIT 后的语句
+        Raises:
+            GuardError: 解析失败、非单条只读查询或超出预算
+        """
+        sql = sql.strip().rstrip(';').strip()
+        try:
+            statements = duckdb.extract_statements(sql)
+        except duckdb.Error as e:
+            raise GuardError(f"SQL 解析失败: {e}") from None
+        if len(statements) != 1:
+            raise GuardError("一次只能执行一条 SQL 语句。")
+        if statements[0].type != duckdb.StatementType.SELECT:
+            raise GuardError(f"只允许只读的 SELECT 查询，不能执行 {statements[0].type.name}。")
+
+        tree = json.loads(cursor.execute("SELECT json_serialize_sql(?)", [sql]).fetchone()[0])
+        if tree.get('error'):
+            raise GuardError(f"SQL 解析失败: {tree.get('error_message')}")
+        limit = _limit(tree['statements'][0]['node'])
+        applied = None
+        if limit is None:
+            applied = self.default_limit
+            sql = f"{sql}\nLIMIT {applied}"
+        elif limit < 0 or limit > self.max_rows:
+            # 非常量 LIMIT 无法确定行数，同样在外层限制到上限
+            applied = self.max_rows
+            sql = f"SELECT * FROM (\n{sql}\n) LIMIT {applied}"
+
+        try:
+            types = cursor.sql(sql).types
+            plan = json.loads(cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}").fetchall()[0][1])
+        except duckdb.Error as e:
+            raise GuardError(f"SQL 执行计划生成失败: {e}") from None
+        peak = [0]
+        rows = max((_estimate(node, peak) for node in plan), default=0)
+        if peak[0] > self.max_plan_rows:
+            raise GuardError(f"查询估计需要处理约 {peak[0]:,} 行，超过上限 {self.max_plan_rows:,}，"
+                             "请检查关联条件是否缺失或增加过滤条件。")
+        rows = min(rows, applied if applied is not None else limit)
+        size = rows * _width(types)
+        if size > self.max_bytes:
+            raise GuardError(f"查询结果估计约 {size >> 20} MB，超过上限 {self.max_bytes >> 20} MB，"
+                             "请减少输出列、按维度汇总或增加过滤条件。")
+        return Admission(sql, rows, size, peak[0], applied)
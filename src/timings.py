@@ -0,0 +1,53 @@
+"""
+阶段耗时
+一次问答中 LLM、图数据库、SQL、渲染各阶段的累计耗时
+"""
+from __future__ import annotations
+
+from contextlib import contextmanager
+import threading
+import time
+from typing import Iterable, Iterator
+
+# summary 中的显示顺序，其他阶段排在后面
+STAGES = ('LLM', 'graph', 'SQL', 'render')
+
+
+class StageTimings:
+    """
+    各阶段累计耗时 (秒)
+    """
+
+    def __init__(self) -> None:
+        self.seconds: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def add(self, name: str, seconds: float) -> None:
+        with self._lock:
+            self.seconds[name] = self.seconds.get(name, 0.0) + seconds
+
+    @contextmanager
+    def stage(self, name: str, exclude: Iterable[str] = ()) -> Iterator[None]:
+        """
+        计时一个阶段
+        Args:
+            name: 阶段名称
+            exclude: 期间发生、需要从本阶段扣除的其他阶段，如 LLM 调用期间的图数据库查询
+        """
+        exclude = tuple(exclude)
+        before = sum(self.seconds.get(n, 0.0) for n in exclude)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            nested = sum(self.seconds.get(n, 0.0) for n in exclude) - before
+            self.add(name, max(0.0, time.perf_counter() - start - nested))
+
+    def reset(self) -> None:
+        with self._lock:
+            self.seconds.clear()
+
+    def summary(self) -> str:
+        with self._lock:
+            names = [n for n in STAGES if n in self.seconds] + [n for n in self.seconds if n not in STAGES]
+            return ' | '.join(f"{name} {self.seconds[name]:.2f}s" for name in names)
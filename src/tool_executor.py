@@ -0,0 +1,100 @@
+"""
+工具执行器
+把阻塞的工具调用放到有界线程池中执行，支持超时、取消和排队上限
+"""
+from __future__ import annotations
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+import threading
+from typing import Any, Callable, TypeVar
+
+from cancellation import Cancelled, CancelScope
+
+T = TypeVar('T')
+
+
+class ToolBusy(Exception):
+    """排队的调用超过上限"""
+
+
+class ToolTimeout(Exception):
+    """调用超时"""
+
+
+class ToolExecutor:
+    """
+    单个工具的执行器
+    """
+
+    def __init__(self, name: str, max_workers: int = 4, max_queue: int = 16,
+                 timeout: float | None = None) -> None:
+        """
+        Args:
+            name: 工具名称
+            max_workers: 并发执行的线程数
+            max_queue: 线程都在忙时允许排队的调用数
+            timeout: 超时秒数，为空时不限
+        """
+        self.name = name
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.rejected = 0
+        self.timeouts = 0
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f'tool-{name}')
+
+    @property
+    def pending(self) -> int:
+        """执行中和排队中的调用数"""
+        return self._pending
+
+    async def run(self, func: Callable[..., T], *args: Any) -> T:
+        """
+        执行工具调用
+        超时或协程被取消时中断其借出的 DuckDB 游标 / Kuzu 连接
+        Raises:
+            ToolBusy: 排队已满
+            ToolTimeout: 超时
+        """
+        with self._lock:
+            if self._pending >= self.max_workers + self.max_queue:
+                self.rejected += 1
+                raise ToolBusy(f"{self.name} 当前排队的请求过多，请稍后重试。")
+            self._pending += 1
+        scope = CancelScope()
+        context = contextvars.copy_context()
+        future = self._pool.submit(context.run, scope.run, func, *args)
+        future.add_done_callback(lambda _: self._done())
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), self.timeout)
+        except asyncio.TimeoutError:
+            scope.cancel()
+            future.cancel()
+            with self._lock:
+                self.timeouts += 1
+            raise ToolTimeout(f"{self.name} 执行超过 {self.timeout:g} 秒已取消，请缩小查询范围后重试。") from None
+        except asyncio.CancelledError:
+            scope.cancel()
+            future.cancel()
+            raise
+        except Cancelled:
+            raise ToolTimeout(f"{self.name} 已取消。") from None
+
+    def _done(self) -> None:
+        with self._lock:
+            self._pending -= 1
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {
+                'pending': self._pending,
+                'rejected': self.rejected,
+                'timeouts': self.timeouts,
+            }
+
+    def shutdown(self) -> None:
+        self._pool.shutdown(wait=False, cancel_futures=True)
@@ -1,33 +1,297 @@
+import json
+import logging
+import os
 from pathlib import Path
+import re
+import threading
 
 import duckdb
-from rich.console import Console, ConsoleOptions, RenderResult
-from rich.markdown import CodeBlock, Markdown
-from rich.syntax import Syntax
-from rich.text import Text
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from duckdb_pool import DuckDBPool
+
+logger = logging.getLogger(__name__)
 
 REF = Path(__file__).parent.parent / 'reference'
 ref_abs = REF.absolute()
 
-df_companies = \
-    duckdb.query(f"SELECT * FROM read_parquet('{ref_abs}/companies.parquet')").df()
-df_dm_finance_mon_balance_sheet_manual_slice = \
-    duckdb.query(f"SELECT * FROM read_parquet('{ref_abs}/dm_finance_mon_balance_sheet_manual_slice.parquet')").df()
-df_dm_incm_cost_dtl_rpt = \
-    duckdb.query(f"SELECT * FROM read_parquet('{ref_abs}/dm_incm_cost_dtl_rpt.parquet')").df()
+# 参考数据表: 视图名 -> parquet 文件
+REF_TABLES = {
+    'companies': 'companies.parquet',
+    'dm_finance_mon_balance_sheet_manual_slice': 'dm_finance_mon_balance_sheet_manual_slice.parquet',
+    'dm_incm_cost_dtl_rpt': 'dm_incm_cost_dtl_rpt.parquet',
+}
+
+# 读取文件的表函数和直接查询的文件路径，用于判断结果缓存能否确定所读文件
+_FILE_SCAN_RE = re.compile(r"\b(?:read_\w+|\w+_scan|glob)\s*\(|\bFROM\s+'", re.IGNORECASE)
+_GLOB_RE = re.compile(r"[*?\[{]")
+
+
+class TableRegistry:
+    """
+    参考数据表注册表
+    parquet 以 DuckDB 视图暴露，DataFrame 仅在首次访问时物化。
+    表存在分区数据集 (partition_data.py 生成) 时优先读取分区目录
+    """
+
+    def __init__(self, ref_dir: Path, tables: dict[str, str] | None = None, **pool_options) -> None:
+        self.ref_dir = Path(ref_dir).absolute()
+        self.tables = dict(REF_TABLES if tables is None else tables)
+        self.pool_options = pool_options
+        self._frames: dict[str, pd.DataFrame] = {}
+        self._pool: DuckDBPool | None = None
+        self._lock = threading.Lock()
+
+    def dataset_dir(self, name: str) -> Path:
+        """表的分区数据集目录"""
+        return self.ref_dir / Path(self.tables[name]).stem
+
+    def partitioned(self, name: str) -> bool:
+        from partition_data import LAYOUT
+
+        return (self.dataset_dir(name) / LAYOUT).exists()
+
+    def path(self, name: str) -> Path:
+        """表对应的 parquet 文件或分区数据集目录"""
+        if self.partitioned(name):
+            return self.dataset_dir(name)
+        return self.ref_dir / self.tables[name]
+
+    def source(self, name: str) -> str:
+        """表的读取语句，分区数据集开启 Hive 分区裁剪"""
+        if not self.partitioned(name):
+            return f"SELECT * FROM read_parquet('{self.path(name)}')"
+        from partition_data import LAYOUT
+
+        directory = self.dataset_dir(name)
+        layout = json.loads((directory / LAYOUT).read_text(encoding='utf-8'))
+        types = dict(layout['columns'])
+        hive_types = ", ".join(f"'{p}': {types[p]}" for p in layout['partition_by'])
+        columns = ", ".join(f'"{c}"' for c, _ in layout['columns'])
+        return (
+            f"SELECT {columns} FROM read_parquet('{directory}/**/*.parquet', "
+            f"hive_partitioning = true, hive_types = {{{hive_types}}})"
+        )
+
+    def resolve(self, sql: str) -> str:
+        """
+        将直接读取参考表文件的 read_parquet 调用替换为对应视图
+        只替换解析后的绝对路径 (相对路径按当前目录，与 DuckDB 一致) 就是参考表文件的调用，
+        其他目录下的同名文件保持原样
+        """
+        files = {(self.ref_dir / file).resolve(): name for name, file in self.tables.items()}
+
+        def replace(match: re.Match) -> str:
+            name = files.get(Path(match.group(1)).resolve())
+            return f'"{name}"' if name in self.available() else match.group(0)
+
+        return re.sub(r"read_parquet\(\s*'([^']+)'\s*\)", replace, sql)
+
+    def files_for(self, sql: str) -> list[Path]:
+        """SQL 中引用到的参考表及 read_parquet 文件"""
+        files = [Path(p) for p in re.findall(r"read_parquet\(\s*'([^']+)'", sql)]
+        for name in self.tables:
+            if re.search(rf'(?<!\w)(df_)?{re.escape(name)}(?!\w)', sql):
+                files.append(self.path(name))
+        return files
+
+    def cache_files(self, sql: str) -> list[Path] | None:
+        """
+        结果缓存失效所依据的文件，无法确定 SQL 读取的全部文件时为 None:
+        没有引用参考表或文件、读取 parquet 以外的文件、路径含通配符或不是字符串常量
+        """
+        paths = re.findall(r"read_parquet\(\s*'([^']+)'", sql)
+        if len(_FILE_SCAN_RE.findall(sql)) > len(paths) or any(_GLOB_RE.search(p) for p in paths):
+            return None
+        return self.files_for(sql) or None
+
+    def available(self) -> list[str]:
+        """已存在数据文件的表"""
+        return [name for name in self.tables if self.path(name).exists()]
+
+    def register(self, conn: duckdb.DuckDBPyConnection) -> None:
+        """
+        在连接上创建参考表视图，同时注册 df_ 前缀的别名
+        Args:
+            conn: DuckDB 连接
+        """
+        for name in self.available():
+            conn.execute(f'CREATE OR REPLACE VIEW "{name}" AS {self.source(name)}')
+            conn.execute(f'CREATE OR REPLACE VIEW "df_{name}" AS SELECT * FROM "{name}"')
+
+    @property
+    def pool(self) -> DuckDBPool:
+        """已注册参考表视图的连接池，首次使用时创建"""
+        with self._lock:
+            if self._pool is None:
+                self._pool = DuckDBPool(setup=self.register, **self.pool_options)
+            return self._pool
+
+    def df(self, name: str) -> pd.DataFrame:
+        """
+        物化参考表为 DataFrame，结果缓存
+        Args:
+            name: 表名
+        """
+        if name not in self._frames:
+            frame = self.pool.query(f'SELECT * FROM "{name}"')
+            self._frames.setdefault(name, frame)
+        return self._frames[name]
+
+
+registry = TableRegistry(
+    REF,
+    size=int(os.environ.get('DUCKDB_POOL_SIZE', '0')) or None,
+    threads=int(os.environ.get('DUCKDB_THREADS', '0')) or None,
+    memory_limit=os.environ.get('DUCKDB_MEMORY_LIMIT') or None,
+)
+
+
+def _query_cache():
+    from query_cache import QueryCache
+
+    return QueryCache(
+        max_bytes=int(os.environ.get('SQL_CACHE_BYTES', str(256 << 20))),
+        spill_dir=os.environ.get('SQL_CACHE_SPILL_DIR') or None,
+    )
+
+
+def _rollups():
+    from rollup import RollupCatalog
+
+    return RollupCatalog(REF / 'rollup', verify=os.environ.get('ROLLUP_VERIFY') == '1')
+
+
+# 结果缓存和汇总表在首次查询时才导入、创建，导入 util 不加载这些模块
+_SHARED = {'query_cache': _query_cache, 'rollups': _rollups}
+_shared_lock = threading.Lock()
+
+
+def _shared(name: str):
+    with _shared_lock:
+        if name not in globals():
+            globals()[name] = _SHARED[name]()
+        return globals()[name]
+
+
+def __getattr__(name: str):
+    if name in _SHARED:
+        return _shared(name)
+    # 兼容旧的 df_<table> 模块属性，按需物化
+    if name.startswith('df_') and name[3:] in registry.tables:
+        return registry.df(name[3:])
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 def wrap_sql(sql: str):
     return sql.replace('```sql', '').replace('```', '')
 
-def do_query(sql: str, df: pd.DataFrame | None = None):
-    return duckdb.query(sql).df()
+def do_query(sql: str, df: pd.DataFrame | pa.Table | None = None, slot: int | None = None,
+             arrow: bool = False):
+    """
+    执行 SQL 查询
+    Args:
+        sql: SQL 语句
+        df: 注册为 df 的数据表
+        slot: 指定连接池槽位
+        arrow: 为 True 时返回 Arrow RecordBatchReader，避免转换为 pandas
+    未传入 df 的查询会尝试改写到汇总表，确定性查询会经过结果缓存
+    """
+    if df is None:
+        from query_cache import is_cacheable
+
+        sql = _route_rollup(registry.resolve(sql))
+        query_cache = _shared('query_cache')
+        # 无法确定所读文件的查询没有可用于失效的指纹，不缓存
+        files = registry.cache_files(sql) if query_cache.enabled and is_cacheable(sql) else None
+        if files is not None:
+            key = query_cache.key(sql, files)
+            table = query_cache.get(key)
+            if table is None:
+                if arrow:
+                    return query_cache.tee(key, registry.pool.stream(sql, slot=slot))
+                with registry.pool.acquire(slot) as cursor:
+                    table = cursor.execute(sql).arrow()
+                query_cache.put(key, table)
+            return table.to_reader() if arrow else table.to_pandas()
+    if arrow:
+        return registry.pool.stream(sql, df, slot)
+    return registry.pool.query(sql, df, slot)
+
+def _route_rollup(sql: str) -> str:
+    from rollup import frames_match
+
+    rollups = _shared('rollups')
+    rewritten = rollups.rewrite(sql)
+    if rewritten is None or not rollups.verify:
+        return rewritten or sql
+    # 校验模式: 汇总表与明细表结果一致时才使用改写后的 SQL
+    with registry.pool.acquire() as cursor:
+        expected = cursor.execute(sql).df()
+        actual = cursor.execute(rewritten).df()
+    if frames_match(expected, actual):
+        return rewritten
+    logger.warning("rollup result mismatch, fallback to base table: %s", sql)
+    return sql
+
+def _format_column(column: pa.Array, digits: int) -> list[str]:
+    if pa.types.is_floating(column.type) or pa.types.is_decimal(column.type):
+        column = pc.round(column, digits)
+    return pc.fill_null(pc.cast(column, pa.string()), '').to_pylist()
+
+def result_table(reader: pa.RecordBatchReader | pa.Table, title: str = 'Result', width: int = 120, digits: int = 2):
+    """
+    将 Arrow 查询结果按批次渲染为 rich Table，每列整批格式化
+    Args:
+        reader: 查询结果或其中一页
+        digits: 浮点数保留的小数位
+    """
+    from rich.table import Table
+
+    table = Table(title=title, width=width)
+    for field in reader.schema:
+        numeric = pa.types.is_integer(field.type) or pa.types.is_floating(field.type) \
+            or pa.types.is_decimal(field.type)
+        table.add_column(field.name, justify="right" if numeric else "left")
+    for batch in (reader.to_batches() if isinstance(reader, pa.Table) else reader):
+        columns = [_format_column(column, digits) for column in batch.columns]
+        for row in zip(*columns):
+            table.add_row(*row)
+    return table
+
+def iter_pages(reader: pa.RecordBatchReader, page_size: int):
+    """
+    按固定行数分页读取查询结果，只在需要下一页时继续读取
+    Args:
+        reader: 查询结果
+        page_size: 每页行数
+    Returns:
+        每页一个 pa.Table 的生成器
+    """
+    batches: list[pa.RecordBatch] = []
+    rows = 0
+    for batch in reader:
+        while batch.num_rows:
+            take = min(page_size - rows, batch.num_rows)
+            batches.append(batch.slice(0, take))
+            rows += take
+            batch = batch.slice(take)
+            if rows == page_size:
+                yield pa.Table.from_batches(batches, schema=reader.schema)
+                batches, rows = [], 0
+    if rows:
+        yield pa.Table.from_batches(batches, schema=reader.schema)
 
 def prettier_code_blocks():
     """Make rich code blocks prettier and easier to copy.
 
     From https://github.com/samuelcolvin/aicli/blob/v0.8.0/samuelcolvin_aicli.py#L22
     """
+    from rich.console import Console, ConsoleOptions, RenderResult
+    from rich.markdown import CodeBlock, Markdown
+    from rich.syntax import Syntax
+    from rich.text import Text
 
     class SimpleCodeBlock(CodeBlock):
         def __rich_console__(
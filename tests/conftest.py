@@ -3,3 +3,90 @@ import sys
 import os
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src')))
+
+import duckdb
+import pytest
+
+
+@pytest.fixture
+def ref_dir(tmp_path):
+    """小规模的参考数据 parquet"""
+    conn = duckdb.connect()
+    conn.execute(f"""
+    COPY (
+        SELECT * FROM (VALUES
+            ('上海外服', '上海地区', '长三角大区'),
+            ('北京外服', '区域', '北方中心'),
+            ('成都外服', '区域', '中西部中心')
+        ) t(外服机构, 地区, 所属大区)
+    ) TO '{tmp_path}/companies.parquet' (FORMAT parquet)
+    """)
+    conn.execute(f"""
+    COPY (
+        SELECT
+            strftime(DATE '2024-01-01' + INTERVAL (m) MONTH, '%Y%m') AS 财务期间,
+            c.地区, c.所属大区, c.外服机构,
+            k.指标,
+            t.取数类型,
+            CAST(m * 10 + length(c.外服机构) + length(k.指标) AS DOUBLE) AS 金额
+        FROM range(15) r(m)
+        CROSS JOIN read_parquet('{tmp_path}/companies.parquet') c
+        CROSS JOIN (VALUES ('营业收入'), ('营业成本')) k(指标)
+        CROSS JOIN (VALUES ('1'), ('2')) t(取数类型)
+    ) TO '{tmp_path}/dm_incm_cost_dtl_rpt.parquet' (FORMAT parquet)
+    """)
+    conn.close()
+    return tmp_path
+
+
+GRAPH_DATA = """
+CREATE (:Metric {id: 'M_REV', name: '营业收入', catalog: '利润', alias: '营业收入', formula: "SUM(CASE WHEN 指标 = '营业收入' THEN 金额 END)", description: '营业收入', dependent_metrics: []});
+CREATE (:Metric {id: 'M_REV_CUST', name: '客户营业收入', catalog: '利润', alias: '营业收入', formula: "SUM(CASE WHEN 指标 = '营业收入' THEN 金额 END)", description: '按客户的营业收入', dependent_metrics: []});
+CREATE (:Metric {id: 'M_COST', name: '营业成本', catalog: '利润', alias: '营业成本', formula: "SUM(CASE WHEN 指标 = '营业成本' THEN 金额 END)", description: '营业成本', dependent_metrics: []});
+CREATE (:Metric {id: 'M_GP', name: '毛利', catalog: '利润', alias: '毛利', formula: '{M_REV} - {M_COST}', description: '营业收入-营业成本', dependent_metrics: ['M_REV', 'M_COST']});
+CREATE (:Metric {id: 'M_GPR', name: '毛利率', catalog: '利润', alias: '毛利率', formula: '{M_GP} / {M_REV}', description: '毛利/营业收入', dependent_metrics: ['M_GP', 'M_REV']});
+CREATE (:Dimension {id: 'D_TIME', name: '时间', type: 'time', hierarchy: ['财务期间'], with_table: '', physical_fields: map(['财务期间'], ['财务期间']), join_condition: '', annotations: '财务期间格式为YYYYMM', required: false});
+CREATE (:Dimension {id: 'D_ORG', name: '地区-所属大区-外服机构', type: 'org', hierarchy: ['地区', '所属大区', '外服机构'], with_table: '', physical_fields: map(['地区', '所属大区', '外服机构'], ['地区', '所属大区', '外服机构']), join_condition: '', annotations: '', required: false});
+CREATE (:Dimension {id: 'D_TYPE', name: '取数类型', type: 'enum', hierarchy: ['取数类型'], with_table: '', physical_fields: map(['取数类型'], ['取数类型']), join_condition: '', annotations: "'1'本期发生数 '2'本年累计数", required: true});
+CREATE (:Dimension {id: 'D_CUST', name: '客户', type: 'enum', hierarchy: ['客户'], with_table: 'companies', physical_fields: map(['客户'], ['companies.外服机构']), join_condition: 'companies.外服机构 = dm_incm_cost_dtl_rpt.外服机构', annotations: '', required: false});
+CREATE (:MetricDimension {id: 'MD_REL', name: '是否关联方'});
+CREATE (:DataSource {table_name: 'dm_incm_cost_dtl_rpt', columns: ['财务期间', '地区', '所属大区', '外服机构', '指标', '取数类型', '金额']});
+"""
+
+GRAPH_EDGES = {
+    'M_REV': ['D_TIME', 'D_ORG', 'D_TYPE', 'MD_REL'],
+    'M_REV_CUST': ['D_TIME', 'D_ORG', 'D_TYPE', 'MD_REL', 'D_CUST'],
+    'M_COST': ['D_TIME', 'D_ORG', 'D_TYPE'],
+    'M_GP': ['D_TIME', 'D_ORG', 'D_TYPE'],
+    'M_GPR': ['D_TIME', 'D_ORG', 'D_TYPE'],
+}
+
+
+@pytest.fixture(scope='session')
+def graph_path(tmp_path_factory):
+    """小规模的指标图数据库"""
+    import kuzu
+
+    path = tmp_path_factory.mktemp('graph') / 'kuzudb'
+    db = kuzu.Database(str(path))
+    conn = kuzu.Connection(db)
+    with open(os.path.join(os.path.dirname(__file__), '..', 'data', 'schema.sql'), encoding='utf-8') as f:
+        conn.execute(f.read())
+    for statement in GRAPH_DATA.strip().splitlines():
+        conn.execute(statement)
+    for metric_id, dimension_ids in GRAPH_EDGES.items():
+        for dimension_id in dimension_ids:
+            label = 'MetricDimension' if dimension_id.startswith('MD_') else 'Dimension'
+            conn.execute(f"MATCH (m:Metric), (d:{label}) WHERE m.id = '{metric_id}' AND d.id = '{dimension_id}' "
+                         "CREATE (m)-[:USES_DIMENSION]->(d)")
+        conn.execute(f"MATCH (m:Metric), (ds:DataSource) WHERE m.id = '{metric_id}' CREATE (m)-[:FROM_TABLE]->(ds)")
+    conn.close()
+    db.close()
+    return str(path)
+
+
+@pytest.fixture(scope='session')
+def graph(graph_path):
+    from graph.kuzu_graph import KuzuGraph
+
+    return KuzuGraph(graph_path, pool_size=1)
@@ -0,0 +1,88 @@
+import asyncio
+
+from pydantic_ai import Agent
+from pydantic_ai.messages import ModelResponse, TextPart
+from pydantic_ai.models.function import FunctionModel
+
+from answer_cache import MONTH, ORG, YEAR, AnswerCache, bind, extract_slots, make_template
+import kag_agent
+from kag_agent import SupportDependencies, ask
+
+ORGS = ['上海外服', '北京外服']
+SQL = """```sql
+SELECT 外服机构, SUM(金额) FROM dm_incm_cost_dtl_rpt
+WHERE 财务期间 = '202503' AND 指标 = '营业收入' AND 取数类型 = '1'
+GROUP BY 外服机构 ORDER BY 2 DESC LIMIT 1;
+```"""
+
+
+def test_extract_slots():
+    template, slots = extract_slots('2025年3月营业收入最高的外服机构是哪家？', ORGS)
+    assert template == '<month0>营业收入最高的外服机构是哪家'
+    assert [(s.kind, s.value) for s in slots] == [(MONTH, '202503')]
+
+    template, slots = extract_slots('上海外服 2024-11 和 2023 年的营业成本', ORGS)
+    assert template == '<org0><month1>和<year2>的营业成本'
+    assert [(s.kind, s.value) for s in slots] == [(ORG, '上海外服'), (MONTH, '202411'), (YEAR, '2023')]
+
+
+def test_template_round_trip():
+    _, slots = extract_slots('2025年3月营业收入最高的外服机构是哪家？', ORGS)
+    template = make_template(SQL, slots)
+    assert '202503' not in template
+    _, new_slots = extract_slots('2024年12月营业收入最高的外服机构是哪家？', ORGS)
+    assert bind(template, new_slots) == SQL.replace('202503', '202412')
+
+
+def test_template_rejects_derived_literals():
+    _, slots = extract_slots('2025年3月本年累计营业收入', ORGS)
+    assert make_template("WHERE 财务期间 BETWEEN '202501' AND '202503'", slots) is None
+    assert make_template("WHERE 财务期间 = '202502'", slots) is None
+    _, slots = extract_slots('2025年3月营业收入同比增长率', ORGS)
+    assert make_template("WHERE 财务期间 IN ('202503', '202403')", slots) is None
+    assert make_template("WHERE 财务期间 IN ('2025-03', '2024-03')", slots) is None
+    _, slots = extract_slots('2025年1月营业收入环比增长率', ORGS)
+    assert make_template("WHERE 财务期间 IN ('202501', '202412')", slots) is None
+    _, slots = extract_slots('2025年营业收入', ORGS)
+    assert make_template("WHERE 年份 IN (2025, 2024)", slots) is None
+    assert make_template("WHERE 年份 = 2025 LIMIT 100", slots) == "WHERE 年份 = \x000:yyyy\x00 LIMIT 100"
+    _, slots = extract_slots('2025年3月和2025年3月', ORGS)
+    assert make_template("WHERE 财务期间 = '202503'", slots) is None
+
+
+def test_ttl_lru_and_version():
+    now = [0.0]
+    cache = AnswerCache(max_entries=2, ttl=10, orgs=ORGS, clock=lambda: now[0])
+    assert cache.put('上海外服2025年3月营业收入', 'v1', "外服机构 = '上海外服' AND 财务期间 = '202503'")
+    assert cache.get('北京外服2025年4月营业收入', 'v1') == "外服机构 = '北京外服' AND 财务期间 = '202504'"
+    assert cache.get('北京外服2025年4月营业收入', 'v2') is None
+
+    assert cache.put('上海外服2025年3月营业收入', 'v1', "外服机构 = '上海外服' AND 财务期间 = '202503'")
+    now[0] = 11
+    assert cache.get('上海外服2025年3月营业收入', 'v1') is None
+
+    assert not cache.put('今年营业收入', 'v1', "财务期间 LIKE '2025%'")
+    assert cache.get('今年营业收入', 'v1') is None
+    for i in range(3):
+        cache.put(f'问题{i} 2025年3月', 'v1', "'202503'")
+    assert cache.get('问题0 2024年1月', 'v1') is None
+    assert cache.get('问题2 2024年1月', 'v1') == "'202401'"
+    stats = cache.stats()
+    assert stats['entries'] == 2 and stats['expirations'] == 2 and stats['hits'] == 2
+
+
+def test_ask_skips_model_on_hit(graph, monkeypatch):
+    monkeypatch.setattr(kag_agent, 'answer_cache', AnswerCache(orgs=ORGS))
+    calls = []
+
+    def model(messages, info):
+        calls.append(messages)
+        return ModelResponse(parts=[TextPart(SQL)])
+
+    agent = Agent(FunctionModel(model), deps_type=SupportDependencies)
+    deps = SupportDependencies(graph=graph)
+    first = asyncio.run(ask(agent, '2025年3月营业收入最高的外服机构是哪家？', deps))
+    second = asyncio.run(ask(agent, '2024年7月 营业收入最高的外服机构是哪家?', deps))
+    assert first == SQL
+    assert second == SQL.replace('202503', '202407')
+    assert len(calls) == 1
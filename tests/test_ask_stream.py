@@ -0,0 +1,57 @@
+import asyncio
+import json
+import time
+
+from pydantic_ai import Agent
+from pydantic_ai.models.function import DeltaToolCall, FunctionModel
+
+from answer_cache import AnswerCache
+import kag_agent
+from kag_agent import SupportDependencies, ask_stream
+from sql_compiler import QuerySpec
+from timings import StageTimings
+
+SQL = "SELECT 外服机构 FROM dm_incm_cost_dtl_rpt WHERE 财务期间 = '202503' LIMIT 1"
+
+
+def test_stream_sql(graph, monkeypatch):
+    monkeypatch.setattr(kag_agent, 'answer_cache', AnswerCache(max_entries=0))
+
+    async def stream(messages, info):
+        for i in range(0, len(SQL), 8):
+            yield SQL[i:i + 8]
+
+    agent = Agent(FunctionModel(stream_function=stream), deps_type=SupportDependencies)
+    partials = []
+    sql = asyncio.run(ask_stream(agent, '2025年3月', SupportDependencies(graph=graph), on_partial=partials.append))
+    assert sql == SQL
+    assert len(partials) > 1 and all(SQL.startswith(p) for p in partials)
+
+
+def test_stream_spec(graph, monkeypatch):
+    monkeypatch.setattr(kag_agent, 'answer_cache', AnswerCache(max_entries=0))
+    args = json.dumps({'metrics': ['营业收入'], 'filters': [{'field': '财务期间', 'value': '202503'},
+                                                          {'field': '取数类型', 'value': '1'}]},
+                      ensure_ascii=False)
+
+    async def stream(messages, info):
+        name = info.output_tools[0].name
+        for i in range(0, len(args), 10):
+            yield {0: DeltaToolCall(name=name if i == 0 else None, json_args=args[i:i + 10])}
+
+    agent = Agent(FunctionModel(stream_function=stream), deps_type=SupportDependencies, output_type=QuerySpec)
+    deps = SupportDependencies(graph=graph)
+    partials = []
+    sql = asyncio.run(ask_stream(agent, '2025年3月营业收入', deps, on_partial=partials.append))
+    assert partials[-1] == args
+    assert "'202503'" in sql and 'SUM' in sql.upper()
+    assert deps.timings.seconds['graph'] > 0
+
+
+def test_stage_timings():
+    timings = StageTimings()
+    with timings.stage('LLM', exclude=('graph',)):
+        time.sleep(0.02)
+        timings.add('graph', 0.015)
+    assert 0 < timings.seconds['LLM'] < 0.02
+    assert timings.summary().startswith('LLM ') and ' | graph 0.01s' in timings.summary()
@@ -0,0 +1,52 @@
+import asyncio
+import threading
+import time
+
+from graph.kuzu_graph import KuzuGraph
+from graph.resolution_cache import ResolutionCache
+import kag_agent
+from kag_agent import SupportDependencies, aresolve_metrics
+
+
+def test_aresolve_merges_metrics(graph, monkeypatch):
+    monkeypatch.setattr(kag_agent, 'resolution_cache', ResolutionCache())
+    payload = asyncio.run(aresolve_metrics(SupportDependencies(graph=graph), ['营业收入', '营业成本', '营业收入'], ['时间']))
+    assert [m['id'] for m in payload['m']] == ['M_REV', 'M_COST']
+    assert {d['id'] for d in payload['d']} == {'D_TIME', 'D_ORG', 'D_TYPE'}
+    assert [ds['table_name'] for ds in payload['ds']] == ['dm_incm_cost_dtl_rpt']
+
+
+def test_aresolve_is_concurrent_and_off_loop(graph, monkeypatch):
+    monkeypatch.setattr(kag_agent, 'resolution_cache', ResolutionCache())
+    threads = set()
+
+    def slow_resolve(deps, metric_names, dimension_names):
+        threads.add(threading.get_ident())
+        time.sleep(0.2)
+        return dict(m=[{'id': metric_names[0]}], d=[], ds=[])
+
+    monkeypatch.setattr(kag_agent, 'resolve_metrics', slow_resolve)
+    # fixture 的连接池只有一个连接，线程池也只有一个线程
+    deps = SupportDependencies(graph=KuzuGraph(graph.db_path, pool_size=2))
+
+    async def main():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        task = asyncio.create_task(ticker())
+        start = time.perf_counter()
+        payload = await aresolve_metrics(deps, ['a', 'b'], [])
+        elapsed = time.perf_counter() - start
+        task.cancel()
+        return payload, elapsed, ticks
+
+    payload, elapsed, ticks = asyncio.run(main())
+    assert [m['id'] for m in payload['m']] == ['a', 'b']
+    assert elapsed < 0.35
+    assert ticks >= 10
+    assert threading.get_ident() not in threads
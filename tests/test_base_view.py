@@ -0,0 +1,53 @@
+import os
+
+import duckdb
+
+from base_view import BaseView
+from util import TableRegistry
+
+SQL = """
+SELECT d.财务期间, d.外服机构, c.所属大区, d.指标, d.取数类型, d.金额
+FROM dm_incm_cost_dtl_rpt d JOIN companies c USING (外服机构)
+"""
+
+
+def make_view(tmp_path, ref_dir):
+    sql_path = tmp_path / 'income_cost.sql'
+    if not sql_path.exists():
+        sql_path.write_text(SQL, encoding='utf-8')
+    return BaseView(sql_path, tmp_path / 'cache' / 'base.duckdb', registry=TableRegistry(ref_dir))
+
+
+def test_build_once_and_query(tmp_path, ref_dir):
+    view = make_view(tmp_path, ref_dir)
+    assert view.stale()
+    with view.connect() as conn:
+        assert conn.execute('SELECT count(*) FROM df').fetchone()[0] == 15 * 3 * 2 * 2
+        tables = {r[0] for r in conn.execute('SELECT table_name FROM information_schema.tables').fetchall()}
+        assert tables == {'df', '_base_view_meta'}
+        periods = [r[0] for r in conn.execute('SELECT 财务期间 FROM df').fetchall()]
+        assert periods == sorted(periods)
+        assert view.schema(conn).num_rows == 0
+        assert view.schema(conn).schema.field('金额').type == 'double'
+
+    mtime = os.stat(view.db_path).st_mtime_ns
+    again = make_view(tmp_path, ref_dir)
+    assert not again.stale()
+    again.connect().close()
+    assert os.stat(view.db_path).st_mtime_ns == mtime
+
+
+def test_rebuild_on_change(tmp_path, ref_dir):
+    view = make_view(tmp_path, ref_dir)
+    view.connect().close()
+
+    view.sql_path.write_text(SQL + " WHERE d.取数类型 = '1'", encoding='utf-8')
+    assert view.stale()
+    with view.connect() as conn:
+        assert conn.execute('SELECT count(*) FROM df').fetchone()[0] == 15 * 3 * 2
+
+    duckdb.execute(f"COPY (SELECT * FROM read_parquet('{ref_dir}/companies.parquet') LIMIT 1) "
+                   f"TO '{ref_dir}/companies.parquet' (FORMAT parquet)")
+    assert view.stale()
+    with view.connect() as conn:
+        assert conn.execute('SELECT count(*) FROM df').fetchone()[0] == 15 * 2
@@ -0,0 +1,61 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import pytest
+
+from duckdb_pool import DuckDBPool
+
+
+def test_views_shared_across_slots():
+    pool = DuckDBPool(size=3, threads=2, memory_limit='256MB',
+                      setup=lambda conn: conn.execute('CREATE VIEW v AS SELECT 42 AS x'))
+    for slot in range(pool.size):
+        assert pool.query('SELECT x FROM v', slot=slot)['x'][0] == 42
+    assert pool.query("SELECT current_setting('threads') AS t")['t'][0] == 2
+    with pytest.raises(ValueError):
+        pool.query('SELECT 1', slot=3)
+    pool.close()
+
+
+def test_concurrent_queries():
+    pool = DuckDBPool(size=4)
+    frames = [pd.DataFrame({'x': range(i + 1)}) for i in range(16)]
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(lambda df: pool.query('SELECT count(*) AS n FROM df', df)['n'][0], frames))
+    assert results == [i + 1 for i in range(16)]
+    assert pool._idle.qsize() == pool.size
+    pool.close()
+
+
+def test_stream_holds_cursor_until_read():
+    pool = DuckDBPool(size=1)
+    reader = pool.stream('SELECT * FROM range(250000) t(x)', batch_size=100_000)
+    assert pool._idle.qsize() == 0
+    assert sum(batch.num_rows for batch in reader) == 250_000
+    assert pool._idle.qsize() == 1
+
+    with pytest.raises(Exception):
+        pool.stream('SELECT * FROM missing_table')
+    assert pool._idle.qsize() == 1
+    pool.close()
+
+
+def test_pooled_checkout_skips_pinned_slot():
+    pool = DuckDBPool(size=2)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        with pool.acquire(0):
+            # 槽位 0 仍在空闲队列中，取任意槽位的查询不应等待它
+            future = executor.submit(lambda: pool.query('SELECT 1 AS x')['x'][0])
+            assert future.result(timeout=1) == 1
+        assert pool._idle.qsize() == 2
+    pool.close()
+
+    pool = DuckDBPool(size=1)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        with pool.acquire(0):
+            future = executor.submit(lambda: pool.query('SELECT 1 AS x')['x'][0])
+            with pytest.raises(TimeoutError):
+                future.result(timeout=0.3)
+        assert future.result(timeout=1) == 1
+    assert pool._idle.qsize() == 1
+    pool.close()
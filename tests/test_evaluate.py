@@ -0,0 +1,115 @@
+import asyncio
+import json
+
+from pydantic_ai import Agent
+from pydantic_ai.messages import ModelResponse, ToolCallPart
+from pydantic_ai.models.function import FunctionModel
+from pydantic_ai.models.test import TestModel
+import pytest
+
+from evaluate import agent_generator, evaluate, load_checkpoint, report
+from kag_agent import SupportDependencies
+from sql_compiler import QuerySpec
+import util
+from util import TableRegistry
+
+REVENUE = "SELECT sum(金额) FROM dm_incm_cost_dtl_rpt WHERE 指标 = '营业收入' AND 取数类型 = '1' AND 财务期间 = '{}'"
+
+QUESTIONS = [
+    {'id': 1, 'question': '2025年3月营业收入', 'category': '单指标', 'sql': REVENUE.format('202503')},
+    {'id': 2, 'question': '2024年5月营业收入', 'category': '单指标', 'sql': REVENUE.format('202405')},
+    {'id': 3, 'question': '2024年6月营业收入最高的机构', 'category': '排名',
+     'answer': {'外服机构': ['成都外服']}},
+    {'id': 4, 'question': '没有标准答案', 'category': '排名'},
+]
+
+
+@pytest.fixture(autouse=True)
+def registry(ref_dir, monkeypatch):
+    monkeypatch.setattr(util, 'registry', TableRegistry(ref_dir))
+
+
+def spec_model(messages, info):
+    question = messages[0].parts[-1].content
+    period = '20' + question[2:4] + question[5:].split('月')[0].zfill(2)
+    spec = {'metrics': ['营业收入'], 'filters': [{'field': '财务期间', 'value': period},
+                                               {'field': '取数类型', 'value': '1'}]}
+    if '机构' in question:
+        spec.update(group_by=['外服机构'], order_by=[{'key': '营业收入'}], limit=1)
+    return ModelResponse(parts=[ToolCallPart(info.output_tools[0].name, spec)])
+
+
+def test_evaluate_with_function_model(graph, tmp_path):
+    agent = Agent(FunctionModel(spec_model), deps_type=SupportDependencies, output_type=QuerySpec)
+    generate = agent_generator(agent, SupportDependencies(graph=graph))
+    checkpoint = tmp_path / 'eval.jsonl'
+    records = asyncio.run(evaluate(QUESTIONS, generate, checkpoint, concurrency=2))
+
+    assert [r['correct'] for r in records] == [True, True, False, None]
+    assert all(r['requests'] == 1 and r['input_tokens'] > 0 for r in records)
+    assert len(load_checkpoint(checkpoint)) == 4
+    summary = report(records)
+    assert summary.loc['单指标', 'accuracy'] == 1.0
+    assert summary.loc['排名', 'accuracy'] == 0.0
+    assert summary.loc['全部', 'questions'] == 4
+    assert summary.loc['全部', 'p95'] >= summary.loc['全部', 'p50'] > 0
+
+
+def test_resume_and_bounded_concurrency(tmp_path):
+    checkpoint = tmp_path / 'eval.jsonl'
+    checkpoint.write_text(json.dumps({'id': '1', 'question': 'done', 'category': '单指标', 'sql': '',
+                                      'error': '', 'correct': True, 'latency': 1.0, 'requests': 1,
+                                      'input_tokens': 1, 'output_tokens': 1}, ensure_ascii=False)
+                          + '\n{"id": "2", "quest', encoding='utf-8')
+    running = peak = 0
+    asked = []
+
+    async def generate(prompt):
+        nonlocal running, peak
+        asked.append(prompt)
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+        return REVENUE.format('202503'), None
+
+    questions = [{'id': i, 'question': f"q{i}", 'sql': REVENUE.format('202503')} for i in range(1, 9)]
+    records = asyncio.run(evaluate(questions, generate, checkpoint, concurrency=3))
+    assert len(asked) == 7 and 'q1' not in asked
+    assert peak == 3
+    assert all(r['correct'] for r in records) and len(records) == 8
+    assert asyncio.run(evaluate(questions, generate, checkpoint)) == records
+    assert len(asked) == 7
+
+
+def test_resume_retries_generate_errors(tmp_path):
+    checkpoint = tmp_path / 'eval.jsonl'
+    attempts = []
+
+    async def generate(prompt):
+        attempts.append(prompt)
+        if len(attempts) == 1:
+            raise TimeoutError('429 Too Many Requests')
+        return REVENUE.format('202503'), None
+
+    questions = [{'id': 1, 'question': 'q1', 'sql': REVENUE.format('202503')}]
+    records = asyncio.run(evaluate(questions, generate, checkpoint))
+    assert records[0]['error'].startswith('generate:') and records[0]['correct'] is None
+    assert asyncio.run(evaluate(questions, generate, checkpoint, retry_errors=False)) == records
+    assert len(attempts) == 1
+
+    records = asyncio.run(evaluate(questions, generate, checkpoint))
+    assert len(attempts) == 2
+    assert records[0]['error'] == '' and records[0]['correct'] is True
+    # 重试成功后不再重试
+    assert asyncio.run(evaluate(questions, generate, checkpoint)) == records
+    assert len(attempts) == 2 and load_checkpoint(checkpoint)['1']['correct'] is True
+
+
+def test_test_model_and_errors(graph, tmp_path):
+    agent = Agent(TestModel(custom_output_text="```sql\nSELECT * FROM missing_table\n```"),
+                  deps_type=SupportDependencies)
+    records = asyncio.run(evaluate(QUESTIONS[:1], agent_generator(agent, SupportDependencies(graph=graph)),
+                                   tmp_path / 'eval.jsonl'))
+    assert records[0]['sql'].strip() == 'SELECT * FROM missing_table'
+    assert records[0]['error'].startswith('execute:') and records[0]['correct'] is False
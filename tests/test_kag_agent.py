@@ -3,44 +3,26 @@ import asyncio
 from pathlib import Path
 
 from dotenv import load_dotenv
-import pandas as pd
 from pydantic_ai.usage import UsageLimits
 
+from evaluate import agent_generator, evaluate, report
 from graph.kuzu_graph import KuzuGraph
 from kag_agent import SupportDependencies, make_agent
-from tqdm import tqdm
 
 SCRIPT_DIR = Path(__file__).parent
 
 load_dotenv()
 graph = KuzuGraph("./kuzudb")
 agent = make_agent()
-doc = []
 
 agent_limits = UsageLimits(request_limit=3)
 
 async def run(questions: list[dict[str, str]]):
-    for question in questions:
-        prompt = question['question']
-        print("[Question]", prompt)
-        try:
-            result = await agent.run(prompt, 
-                                     deps=SupportDependencies(graph=graph), 
-                                     usage_limits=agent_limits)
-            doc.append({
-                'question': prompt,
-                'sql': result.output,
-                'error': ''
-            })
-            print("[SQL]", result.output)
-        except Exception as e:
-            doc.append({
-                'question': prompt,
-                'sql': 'error',
-                'error': str(e)
-            })
-    pd.DataFrame(doc).to_json(SCRIPT_DIR / '../reference' / 'question_with_sql.json', \
-        orient='records', force_ascii=False)
+    # 每题结果写入 JSONL，中断后重新运行会跳过已完成的题目
+    generate = agent_generator(agent, SupportDependencies(graph=graph), agent_limits)
+    records = await evaluate(questions, generate, SCRIPT_DIR / '../reference' / 'question_with_sql.jsonl',
+                             on_record=lambda r: print("[Question]", r['question'], "\n[SQL]", r['sql'] or r['error']))
+    print(report(records))
 
 def test_make_sql():
     with open('./reference/question.json', 'r', encoding='utf-8') as f:
@@ -0,0 +1,59 @@
+import pytest
+
+from graph.kuzu_graph import KuzuQueryException
+
+
+def test_query_rows(graph):
+    rows = graph.query("MATCH (m:Metric)-[:USES_DIMENSION]->(d:Dimension) WHERE m.id = 'M_COST' "
+                       "RETURN m, collect(d) AS dimensions")
+    assert len(rows) == 1
+    assert rows[0]['m']['name'] == '营业成本'
+    assert {d['id'] for d in rows[0]['dimensions']} == {'D_TIME', 'D_ORG', 'D_TYPE'}
+    assert rows[0]['dimensions'][0]['_label'] == 'Dimension'
+
+
+def test_query_iter(graph):
+    rows = graph.query_iter("MATCH (m:Metric) RETURN m.id, size(m.dependent_metrics) ORDER BY m.id", as_tuple=True)
+    assert next(rows) == ('M_COST', 0)
+    assert list(rows)[-1] == ('M_REV_CUST', 0)
+
+
+def test_query_error(graph):
+    with pytest.raises(KuzuQueryException):
+        graph.query("MATCH (m:Missing) RETURN m")
+
+
+def test_connection_pool(graph_path):
+    import asyncio
+    from concurrent.futures import ThreadPoolExecutor
+
+    from graph.kuzu_graph import KuzuGraph
+
+    pooled = KuzuGraph(graph_path, pool_size=2)
+    cypher = "MATCH (m:Metric) WHERE m.id = $id RETURN m.name"
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        names = list(executor.map(lambda i: pooled.query(cypher, {'id': i})[0]['m.name'],
+                                  ['M_REV', 'M_COST'] * 10))
+    assert names == ['营业收入', '营业成本'] * 10
+
+    async def run():
+        return await asyncio.gather(*(pooled.aquery(cypher, {'id': 'M_GP'}, as_tuple=True) for _ in range(4)))
+
+    assert asyncio.run(run()) == [[('毛利',)]] * 4
+    stats = pooled.pool_stats()
+    assert stats['size'] == stats['idle'] == 2
+    assert stats['checkouts'] >= 24 and stats['waiting'] == 0
+
+
+def test_schema_cache(graph_path, tmp_path):
+    from graph.kuzu_graph import KuzuGraph
+
+    first = KuzuGraph(graph_path, pool_size=1, schema_cache_dir=tmp_path)
+    assert first._schema is None
+    assert 'Metric' in first.schema and 'USES_DIMENSION' in first.schema
+    assert (tmp_path / f"{first.schema_version}.txt").exists()
+
+    (tmp_path / f"{first.schema_version}.txt").write_text('cached', encoding='utf-8')
+    second = KuzuGraph(graph_path, pool_size=1, schema_cache_dir=tmp_path)
+    assert second.schema_version == first.schema_version
+    assert second.schema == 'cached'
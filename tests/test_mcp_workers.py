@@ -0,0 +1,83 @@
+import asyncio
+import json
+import multiprocessing as mp
+import socket
+import uuid
+
+import httpx
+
+from mcp_workers import _run_worker, worker_env
+
+
+def test_worker_env(monkeypatch):
+    monkeypatch.delenv('SQL_CACHE_BYTES', raising=False)
+    monkeypatch.setenv('DUCKDB_THREADS', '3')
+    env = worker_env(1, 4, '/tmp/run')
+    assert env['MCP_WORKER'] == 'w1' and env['MCP_WORKER_DIR'] == '/tmp/run'
+    assert int(env['SQL_CACHE_BYTES']) == (256 << 20) // 4
+    assert 'DUCKDB_THREADS' not in env
+    assert int(env['KUZU_BUFFER_POOL_SIZE']) > 0
+
+
+def test_message_owner():
+    from mcp_server import _owner
+    assert _owner({'root_path': '', 'path': '/messages/w2/'}) == 'w2'
+    assert _owner({'root_path': '/messages', 'path': '/w0/'}) == 'w0'
+    assert _owner({'root_path': '/messages', 'path': '/'}) is None
+
+
+async def _event(lines, name):
+    """读取 SSE 流中下一个指定类型事件的数据"""
+    event = None
+    async for line in lines:
+        if line.startswith('event:'):
+            event = line.split(':', 1)[1].strip()
+        elif line.startswith('data:') and event == name:
+            return line.split(':', 1)[1].strip()
+
+
+def test_message_forwarded_to_owner(graph_path, tmp_path, monkeypatch):
+    monkeypatch.setenv('KUZU_DB_PATH', graph_path)
+    context = mp.get_context('spawn')
+    socks = [socket.create_server(('127.0.0.1', 0)) for _ in range(2)]
+    ports = [sock.getsockname()[1] for sock in socks]
+    processes = [context.Process(target=_run_worker, args=(i, sock, worker_env(i, 2, str(tmp_path)), 'warning'))
+                 for i, sock in enumerate(socks)]
+    for process in processes:
+        process.start()
+    initialize = {'jsonrpc': '2.0', 'id': 1, 'method': 'initialize',
+                  'params': {'protocolVersion': '2024-11-05', 'capabilities': {},
+                             'clientInfo': {'name': 'test', 'version': '0'}}}
+
+    async def main():
+        async with httpx.AsyncClient(timeout=10) as client:
+            for port in ports:
+                for _ in range(200):
+                    try:
+                        await client.get(f'http://127.0.0.1:{port}/messages/')
+                        break
+                    except httpx.TransportError:
+                        await asyncio.sleep(0.05)
+            async with client.stream('GET', f'http://127.0.0.1:{ports[0]}/sse') as stream:
+                lines = stream.aiter_lines()
+                endpoint = await _event(lines, 'endpoint')
+                assert endpoint.startswith('/messages/w0/')
+                # 消息发到不持有会话的 w1，由 w1 经 w0 的 Unix socket 转发
+                resp = await client.post(f'http://127.0.0.1:{ports[1]}{endpoint}', json=initialize)
+                assert resp.status_code == 202
+                message = json.loads(await _event(lines, 'message'))
+                assert message['id'] == 1 and message['result']['serverInfo']['name'] == 'data_governance'
+            unknown = await client.post(f'http://127.0.0.1:{ports[1]}/messages/w0/?session_id={uuid.uuid4().hex}',
+                                        json=initialize)
+            assert unknown.status_code == 404
+
+    try:
+        asyncio.run(asyncio.wait_for(main(), 60))
+        assert (tmp_path / 'w0.sock').exists() and (tmp_path / 'w1.sock').exists()
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join(10)
+        for sock in socks:
+            sock.close()
@@ -0,0 +1,51 @@
+import pytest
+
+from graph.metric_catalog import MetricCatalog
+from kag_agent import MetricTool
+
+
+@pytest.fixture(scope='module')
+def catalog(graph):
+    return MetricCatalog.load(graph)
+
+
+def test_indexes(catalog):
+    assert catalog.by_alias['营业收入'] == ('M_REV', 'M_REV_CUST')
+    assert catalog.metrics['M_REV'].dimension_ids == ('D_TIME', 'D_ORG', 'D_TYPE', 'MD_REL')
+    assert catalog.metrics['M_GP'].table_name == 'dm_incm_cost_dtl_rpt'
+    mask = catalog.metrics['M_COST'].dimension_mask
+    assert mask & catalog.name_bits['时间'] and not mask & catalog.name_bits['是否关联方']
+    assert not catalog.stale()
+
+
+def test_resolve(catalog):
+    assert catalog.resolve(['营业收入'], ['时间', '是否关联方']) == ['M_REV']
+    assert catalog.resolve(['营业收入'], ['客户']) == ['M_REV_CUST']
+    assert catalog.resolve(['营业收入', '营业成本'], []) == ['M_COST']
+    assert catalog.resolve(['营业收入'], ['不存在']) == []
+    assert catalog.resolve(['不存在'], ['时间']) == []
+
+
+@pytest.mark.parametrize('metric_names, dimension_names', [
+    (['营业收入'], ['时间', '地区-所属大区-外服机构', '是否关联方']),
+    (['毛利率'], ['时间']),
+    (['营业收入'], ['客户']),
+    (['营业收入', '营业成本'], []),
+    (['不存在'], ['时间']),
+])
+def test_matches_graph_queries(graph, catalog, metric_names, dimension_names):
+    expected = MetricTool(graph)
+    expected.query(metric_names, dimension_names)
+    tool = MetricTool(graph, catalog)
+    tool.query(metric_names, dimension_names)
+    assert tool.Metrics == expected.Metrics
+    assert tool.Dimensions == expected.Dimensions
+    assert tool.DataSources == expected.DataSources
+
+
+def test_stale_falls_back_to_graph(graph, catalog):
+    stale = MetricCatalog(catalog.db_path, 'old')
+    tool = MetricTool(graph, stale)
+    tool.query(['营业收入'], ['时间', '是否关联方'])
+    assert tool.catalog is None
+    assert [m['id'] for m in tool.Metrics] == ['M_REV']
@@ -0,0 +1,45 @@
+from kag_agent import MetricTool
+
+
+def test_query_prefers_fewest_dimensions(graph):
+    tool = MetricTool(graph)
+    tool.query(["营业收入"], ["时间", "地区-所属大区-外服机构", "是否关联方"])
+    assert [m['id'] for m in tool.Metrics] == ['M_REV']
+    assert {d['id'] for d in tool.Dimensions} == {'D_TIME', 'D_ORG', 'D_TYPE'}
+    assert [ds['table_name'] for ds in tool.DataSources] == ['dm_incm_cost_dtl_rpt']
+
+
+def test_query_dependent_metrics(graph):
+    tool = MetricTool(graph)
+    tool.query(["毛利率"], ["时间"])
+    ids = [m['id'] for m in tool.Metrics]
+    assert ids[-1] == 'M_GPR'
+    assert set(ids) == {'M_REV', 'M_COST', 'M_GP', 'M_GPR'}
+
+
+def test_query_quoted_names(graph):
+    tool = MetricTool(graph)
+    tool.query(["营业'收入"], ["时间'"])
+    assert tool.Metrics == []
+    with graph.connection() as pooled:
+        assert pooled.statements
+
+
+def test_dependency_closure_constant_graph_calls(graph, monkeypatch):
+    calls = []
+    query = graph.query
+    monkeypatch.setattr(graph, 'query', lambda *args, **kwargs: calls.append(args[0]) or query(*args, **kwargs))
+    tool = MetricTool(graph)
+    tool.fetch_all_metrics(['M_GPR', 'M_GP'])
+    assert [m['id'] for m in tool.Metrics] == ['M_REV', 'M_COST', 'M_GP', 'M_GPR']
+    assert len(calls) == 2
+
+    tool.fetch_all_metrics(['M_REV'])
+    assert len(tool.Metrics) == 4
+    assert len(calls) == 2
+
+
+def test_dependency_closure_cycles(graph):
+    tool = MetricTool(graph)
+    tool._dependencies = {'A': ['B', 'C'], 'B': ['A', 'C'], 'C': ['C']}
+    assert tool.dependency_closure(['A', 'C', 'A']) == ['C', 'B', 'A']
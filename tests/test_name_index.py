@@ -0,0 +1,70 @@
+import pytest
+
+from graph.metric_catalog import MetricCatalog
+from graph.name_index import DIMENSION, METRIC, NameIndex
+from kag_agent import MetricTool
+
+
+@pytest.fixture(scope='module')
+def catalog(graph):
+    return MetricCatalog.load(graph)
+
+
+@pytest.mark.parametrize('kind, text, expected', [
+    (METRIC, '营业收入', '营业收入'),
+    (METRIC, ' 营业 收入 ', '营业收入'),
+    (METRIC, '收入', '营业收入'),
+    (METRIC, '营收', '营业收入'),
+    (METRIC, '毛利润', '毛利'),
+    (METRIC, '毛利率%', '毛利率'),
+    (METRIC, '净利润率', '净利润率'),
+    (DIMENSION, '外服机构', '地区-所属大区-外服机构'),
+    (DIMENSION, '地区/所属大区/外服机构', '地区-所属大区-外服机构'),
+    (DIMENSION, '财务期间', '时间'),
+    (DIMENSION, '关联方', '是否关联方'),
+    (DIMENSION, '取数类型', '取数类型'),
+])
+def test_snap(catalog, kind, text, expected):
+    assert catalog.names.snap(kind, text) == expected
+
+
+@pytest.mark.parametrize('text', ['营业外收入', '利润率', '营业利润', '营业收入增长率'])
+def test_different_metrics_are_kept(catalog, text):
+    assert catalog.names.snap(METRIC, text) == text
+
+
+def test_no_runner_up_needed_to_reject():
+    index = NameIndex()
+    index.add(METRIC, '营业收入', ['营业收入'])
+    assert index.snap(METRIC, '营业利润') == '营业利润'
+    assert index.snap(METRIC, '营业收人') == '营业收入'
+
+
+def test_margin():
+    index = NameIndex()
+    index.add(METRIC, '营业收入', ['营业收入'])
+    index.add(METRIC, '营业外收入', ['营业外收入'])
+    assert index.snap(METRIC, '收入') == '收入'
+    assert index.snap(METRIC, '营业外收入') == '营业外收入'
+
+
+def test_candidates_ranked(catalog):
+    ranked = catalog.names.candidates(METRIC, '毛利')
+    assert ranked[0] == ('毛利', 1.0)
+    assert [score for _, score in ranked] == sorted((score for _, score in ranked), reverse=True)
+
+
+def test_ambiguous_names_are_kept():
+    index = NameIndex()
+    index.add(DIMENSION, '客户', ['客户'])
+    index.add(DIMENSION, '供应商', ['供应商'])
+    index.add(DIMENSION, '客户-地区', ['地区'], weight=0.95)
+    index.add(DIMENSION, '供应商-地区', ['地区'], weight=0.95)
+    assert index.snap(DIMENSION, '地区') == '地区'
+
+
+def test_metric_tool_snaps_names(graph, catalog):
+    tool = MetricTool(graph, catalog)
+    tool.query(['营收'], ['财务期间', '关联方'])
+    assert [m['id'] for m in tool.Metrics] == ['M_REV']
+    assert tool.snapped == {'营收': '营业收入', '财务期间': '时间', '关联方': '是否关联方'}
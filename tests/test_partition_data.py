@@ -0,0 +1,42 @@
+import json
+
+from partition_data import LAYOUT, partition_table
+from util import TableRegistry
+
+
+def test_partition_table(ref_dir):
+    flat = TableRegistry(ref_dir)
+    sql = ("SELECT 外服机构, SUM(金额) AS 金额 FROM dm_incm_cost_dtl_rpt "
+           "WHERE 财务期间 = '202403' AND 地区 = '区域' GROUP BY 1 ORDER BY 1")
+    expected = flat.pool.query(sql)
+    columns = list(flat.pool.query("SELECT * FROM dm_incm_cost_dtl_rpt LIMIT 0").columns)
+
+    target = partition_table(flat, 'dm_incm_cost_dtl_rpt', ('财务期间', '地区'))
+    layout = json.loads((target / LAYOUT).read_text(encoding='utf-8'))
+    assert layout['sort_by'] == ['所属大区', '外服机构', '指标', '取数类型']
+    assert (target / '财务期间=202403' / '地区=区域').is_dir()
+
+    registry = TableRegistry(ref_dir)
+    assert registry.path('dm_incm_cost_dtl_rpt') == target
+    assert list(registry.pool.query("SELECT * FROM dm_incm_cost_dtl_rpt LIMIT 0").columns) == columns
+    assert registry.pool.query(sql).equals(expected)
+
+    plan = registry.pool.query("EXPLAIN ANALYZE " + sql.replace('外服机构, ', '').replace(' GROUP BY 1 ORDER BY 1', ''))
+    assert 'Total Files Read: 1' in plan.iloc[0, 1]
+
+
+def test_resolve_read_parquet(ref_dir, monkeypatch):
+    registry = TableRegistry(ref_dir)
+    sql = f"SELECT * FROM read_parquet('{ref_dir}/dm_incm_cost_dtl_rpt.parquet') JOIN read_parquet('x.parquet') USING (a)"
+    assert registry.resolve(sql) == 'SELECT * FROM "dm_incm_cost_dtl_rpt" JOIN read_parquet(\'x.parquet\') USING (a)'
+    # 相对路径按当前目录解析
+    monkeypatch.chdir(ref_dir.parent)
+    sql = f"SELECT * FROM read_parquet('{ref_dir.name}/../{ref_dir.name}/companies.parquet')"
+    assert registry.resolve(sql) == 'SELECT * FROM "companies"'
+
+
+def test_resolve_keeps_other_files(ref_dir, tmp_path_factory):
+    registry = TableRegistry(ref_dir)
+    other = tmp_path_factory.mktemp('other') / 'companies.parquet'
+    for sql in (f"SELECT * FROM read_parquet('{other}')", "SELECT * FROM read_parquet('companies.parquet')"):
+        assert registry.resolve(sql) == sql
@@ -0,0 +1,64 @@
+import os
+
+import pyarrow as pa
+
+import util
+from query_cache import QueryCache, is_cacheable, normalize_sql
+from util import TableRegistry
+
+
+def test_normalize_sql():
+    assert normalize_sql("SELECT  a,\n\tb FROM t WHERE x = 'a  b';  ") == "SELECT a, b FROM t WHERE x = 'a  b'"
+    assert is_cacheable("SELECT * FROM t WHERE 财务期间 = '202503'")
+    assert is_cacheable("SELECT 'now()' AS s")
+    assert not is_cacheable("SELECT random() AS r")
+    assert not is_cacheable("SELECT * FROM t WHERE d < current_date")
+
+
+def test_lru_and_spill(tmp_path):
+    table = pa.table({'x': list(range(100))})
+    cache = QueryCache(max_bytes=table.nbytes, max_entry_bytes=table.nbytes, spill_dir=tmp_path)
+    cache.put('a', table)
+    cache.put('b', table)
+    assert cache.stats()['evictions'] == 1
+    assert (tmp_path / 'a.arrow').exists()
+
+    assert cache.get('a').equals(table)
+    assert cache.get('missing') is None
+    stats = cache.stats()
+    assert (stats['hits'], stats['spill_hits'], stats['misses']) == (1, 1, 1)
+
+    cache.clear()
+    assert not list(tmp_path.glob('*.arrow'))
+
+
+def test_do_query_cache_invalidation(ref_dir, monkeypatch):
+    cache = QueryCache()
+    monkeypatch.setattr(util, 'registry', TableRegistry(ref_dir))
+    monkeypatch.setattr(util, 'query_cache', cache)
+    sql = 'SELECT count(*) AS n FROM dm_incm_cost_dtl_rpt'
+    assert util.do_query(sql)['n'][0] == 180
+    assert util.do_query(sql + ';')['n'][0] == 180
+    assert util.do_query(sql, arrow=True).read_all()['n'][0].as_py() == 180
+    assert (cache.hits, cache.misses) == (2, 1)
+
+    path = ref_dir / 'dm_incm_cost_dtl_rpt.parquet'
+    os.utime(path, ns=(0, 0))
+    util.do_query(sql)
+    assert cache.misses == 2
+
+
+def test_do_query_skips_unknown_files(ref_dir, monkeypatch):
+    cache = QueryCache()
+    registry = TableRegistry(ref_dir)
+    monkeypatch.setattr(util, 'registry', registry)
+    monkeypatch.setattr(util, 'query_cache', cache)
+    for sql in ("SELECT 1 AS n",
+                f"SELECT count(*) AS n FROM read_parquet('{ref_dir}/*.parquet')",
+                f"SELECT count(*) AS n FROM read_parquet(['{ref_dir}/companies.parquet'])",
+                f"SELECT count(*) AS n FROM '{ref_dir}/companies.parquet'"):
+        assert registry.cache_files(sql) is None
+        util.do_query(sql)
+        util.do_query(sql)
+    assert (cache.hits, cache.misses) == (0, 0)
+    assert registry.cache_files(f"SELECT * FROM companies JOIN read_parquet('{ref_dir}/x.parquet') USING (a)")
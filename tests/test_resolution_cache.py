@@ -0,0 +1,58 @@
+import fingerprint
+from graph.resolution_cache import ResolutionCache
+from kag_agent import SupportDependencies, resolution_cache, resolve_metrics
+
+
+def test_key_ignores_order_and_duplicates():
+    assert ResolutionCache.key('db', ['a', 'b'], ['x', 'y', 'x']) == ResolutionCache.key('db', ['b', 'a'], ['y', 'x'])
+
+
+def test_lru_and_invalidation(tmp_path):
+    db = tmp_path / 'kuzudb'
+    db.mkdir()
+    (db / 'data.kz').write_bytes(b'1')
+    cache = ResolutionCache(max_entries=2, recheck=0)
+    assert cache.get(str(db), ['a'], []) is None
+    cache.put(str(db), ['a'], [], {'m': 1})
+    cache.put(str(db), ['b'], [], {'m': 2})
+    assert cache.get(str(db), ['a'], []) == {'m': 1}
+    cache.put(str(db), ['c'], [], {'m': 3})
+    assert cache.get(str(db), ['b'], []) is None
+    assert cache.stats()['entries'] == 2
+
+    (db / 'data.kz').write_bytes(b'22')
+    assert cache.get(str(db), ['a'], []) is None
+    stats = cache.stats()
+    assert stats['invalidations'] == 1 and stats['entries'] == 0
+    assert stats['hits'] == 1 and stats['misses'] == 3 and stats['hit_rate'] == 0.25
+
+
+def test_resolve_metrics_hot_path(graph, monkeypatch):
+    resolution_cache.clear()
+    hits = resolution_cache.stats()['hits']
+    deps = SupportDependencies(graph=graph)
+    first = resolve_metrics(deps, ['营业收入'], ['时间', '是否关联方'])
+    assert [m['id'] for m in first['m']] == ['M_REV']
+
+    monkeypatch.setattr(graph, 'query', lambda *args, **kwargs: (_ for _ in ()).throw(AssertionError('graph used')))
+    assert resolve_metrics(deps, ['营业收入'], ['是否关联方', '时间', '时间']) is first
+    assert resolution_cache.stats()['hits'] == hits + 1
+
+
+def test_version_rechecked_at_interval(tmp_path, monkeypatch):
+    db = tmp_path / 'kuzudb'
+    db.mkdir()
+    calls = []
+    walk = fingerprint.paths_fingerprint
+    monkeypatch.setattr(fingerprint, 'paths_fingerprint', lambda *args: calls.append(args) or walk(*args))
+    cache = ResolutionCache(recheck=60)
+    cache.put(str(db), ['a'], [], {'m': 1})
+    for _ in range(3):
+        assert cache.get(str(db), ['a'], []) == {'m': 1}
+    assert len(calls) == 1
+    (db / 'data.kz').write_bytes(b'1')
+    # 复查间隔内不遍历目录，仍返回缓存结果
+    assert cache.get(str(db), ['a'], []) == {'m': 1}
+    # 复查后失效
+    fingerprint.recent_fingerprint([str(db)], max_age=0)
+    assert cache.get(str(db), ['a'], []) is None
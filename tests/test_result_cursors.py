@@ -0,0 +1,136 @@
+import json
+
+import pytest
+
+from duckdb_pool import DuckDBPool
+from result_cursors import CursorNotFound, CursorRegistry
+
+
+@pytest.fixture
+def pool():
+    pool = DuckDBPool(size=2)
+    yield pool
+    pool.close()
+
+
+def stream(pool, n):
+    return pool.stream(f"SELECT i FROM range({n}) t(i)", batch_size=7)
+
+
+def test_pages(pool):
+    registry = CursorRegistry(page_size=10)
+    first = registry.open('s', stream(pool, 25), count=lambda: 25)
+    assert first['rows']['i'].to_pylist() == list(range(10))
+    assert first['row_count'] == 25 and first['cursor']
+
+    second = registry.fetch('s', first['cursor'])
+    assert second['offset'] == 10 and second['rows']['i'].to_pylist() == list(range(10, 20))
+    last = registry.fetch('s', first['cursor'], page_size=100)
+    assert last['rows']['i'].to_pylist() == list(range(20, 25))
+    assert last['cursor'] is None
+    assert pool._idle.qsize() == 2
+    with pytest.raises(CursorNotFound):
+        registry.fetch('s', first['cursor'])
+
+
+def test_small_result_has_no_cursor(pool):
+    registry = CursorRegistry(page_size=10)
+    resp = registry.open('s', stream(pool, 3), count=lambda: pytest.fail('count not needed'))
+    assert resp['cursor'] is None and resp['row_count'] == 3
+    assert pool._idle.qsize() == 2
+
+
+def test_row_count_from_stream(pool):
+    registry = CursorRegistry(page_size=10)
+    first = registry.open('s', stream(pool, 25))
+    assert first['row_count'] is None
+    assert registry.fetch('s', first['cursor'])['row_count'] is None
+    assert registry.fetch('s', first['cursor'])['row_count'] == 25
+
+
+def test_idle_expiry_releases_connection(pool):
+    now = [0.0]
+    registry = CursorRegistry(page_size=10, idle_timeout=60, clock=lambda: now[0])
+    resp = registry.open('s', stream(pool, 100))
+    assert pool._idle.qsize() == 1
+    now[0] = 61
+    registry.sweep()
+    assert pool._idle.qsize() == 2
+    assert registry.stats() == {'open': 0, 'expired': 1, 'evicted': 0}
+    with pytest.raises(CursorNotFound):
+        registry.fetch('s', resp['cursor'])
+
+
+def test_session_cap_and_isolation(pool):
+    registry = CursorRegistry(page_size=10, max_per_session=1)
+    first = registry.open('a', stream(pool, 100))
+    second = registry.open('a', stream(pool, 100))
+    assert registry.stats()['evicted'] == 1
+    with pytest.raises(CursorNotFound):
+        registry.fetch('a', first['cursor'])
+    with pytest.raises(CursorNotFound):
+        registry.fetch('b', second['cursor'])
+    registry.close_session('a')
+    assert registry.stats()['open'] == 0
+    assert pool._idle.qsize() == 2
+
+
+def test_max_open(pool):
+    registry = CursorRegistry(page_size=10, max_open=1)
+    first = registry.open('a', stream(pool, 25))
+    second = registry.open('b', stream(pool, 25))
+    assert registry.stats() == {'open': 1, 'expired': 0, 'evicted': 1}
+    with pytest.raises(CursorNotFound):
+        registry.fetch('a', first['cursor'])
+    assert registry.fetch('b', second['cursor'])['offset'] == 10
+
+    closed = CursorRegistry(page_size=10, max_open=0).open('a', stream(pool, 25), count=lambda: 25)
+    assert closed['cursor'] is None and closed['row_count'] == 25 and closed['more']
+    assert pool._idle.qsize() == 1
+
+
+@pytest.mark.parametrize('size', [1, 2])
+def test_sql_query_pool_size(ref_dir, monkeypatch, size):
+    import mcp_server
+    import util
+    from query_cache import QueryCache
+
+    registry = util.TableRegistry(ref_dir, size=size)
+    monkeypatch.setattr(util, 'registry', registry)
+    monkeypatch.setattr(util, 'query_cache', QueryCache(max_bytes=0))
+    monkeypatch.setattr(mcp_server, 'registry', registry)
+    monkeypatch.setattr(mcp_server, 'cursors', CursorRegistry(page_size=10))
+    resp = json.loads(mcp_server.sql_query("SELECT * FROM dm_incm_cost_dtl_rpt", session='s'))
+    assert mcp_server.cursors.max_open == size - 1
+    # 不另外执行 count(*)，未读完时只有估计行数
+    assert resp['row_count'] is None and resp['row_count_estimate'] > 0
+    if size == 1:
+        # 单游标连接池不保留结果流，后续查询不会等待
+        assert resp['cursor'] is None and resp['message'] == mcp_server._NO_PAGING
+        assert registry.pool._idle.qsize() == 1
+    else:
+        assert resp['cursor'] and 'message' not in resp
+        last = json.loads(mcp_server.sql_fetch(resp['cursor'], session='s', page_size=1000))
+        assert last['cursor'] is None and last['row_count'] == 180
+
+
+def test_invalid_format_opens_no_cursor(ref_dir, monkeypatch):
+    import mcp_server
+    import util
+    from query_cache import QueryCache
+
+    registry = util.TableRegistry(ref_dir, size=2)
+    monkeypatch.setattr(util, 'registry', registry)
+    monkeypatch.setattr(util, 'query_cache', QueryCache(max_bytes=0))
+    monkeypatch.setattr(mcp_server, 'registry', registry)
+    monkeypatch.setattr(mcp_server, 'cursors', CursorRegistry(page_size=10))
+    with pytest.raises(mcp_server.MCPRetry):
+        mcp_server.sql_query("SELECT * FROM dm_incm_cost_dtl_rpt", session='s', fmt='xml')
+    assert mcp_server.cursors.stats()['open'] == 0
+    assert registry.pool._idle.qsize() == 2
+
+    resp = json.loads(mcp_server.sql_query("SELECT * FROM dm_incm_cost_dtl_rpt", session='s'))
+    with pytest.raises(mcp_server.MCPRetry):
+        mcp_server.sql_fetch(resp['cursor'], session='s', fmt='xml')
+    # 格式错误时不读取，下一页仍从第 10 行开始
+    assert json.loads(mcp_server.sql_fetch(resp['cursor'], session='s'))['offset'] == 10
@@ -0,0 +1,60 @@
+import base64
+import json
+
+import pyarrow as pa
+import pytest
+
+import result_format
+from result_format import encode_result, encode_rows, encode_table, summarize
+
+
+@pytest.fixture
+def table():
+    return pa.table({
+        '外服机构': ['北京', '上海', '广州'] * 20,
+        '营业收入': [1234.56789, 2345.6789, None] * 20,
+        '人数': list(range(60)),
+    })
+
+
+def test_columnar(table):
+    resp = json.loads(encode_result(table, row_count=60, cursor=None))
+    assert resp['format'] == 'columnar' and resp['row_count'] == 60
+    assert resp['data']['columns'] == ['外服机构', '营业收入', '人数']
+    assert resp['data']['data'][1][:3] == [1234.57, 2345.68, None]
+    records = encode_result(table, 'records', digits=None)
+    assert len(encode_result(table).encode()) < len(records.encode())
+
+
+def test_csv_and_arrow(table):
+    csv = encode_table(table, 'csv', digits=1)
+    assert csv.splitlines()[1] == '"北京",1234.6,0'
+    data = base64.b64decode(encode_table(table, 'arrow'))
+    assert pa.ipc.open_stream(data).read_all().equals(table)
+    with pytest.raises(ValueError):
+        encode_table(table, 'xml')
+
+
+def test_truncate(table, monkeypatch):
+    calls = []
+    monkeypatch.setattr(result_format, 'summarize', lambda t: calls.append(t) or summarize(t))
+    text = encode_result(table, max_bytes=400, row_count=60)
+    # 摘要只计算一次
+    assert len(calls) == 1
+    resp = json.loads(text)
+    assert len(text.encode()) <= 400
+    truncated = resp['truncated']
+    assert 0 < truncated['rows_returned'] < 60 and truncated['rows_in_page'] == 60
+    assert len(resp['data']['data'][0]) == truncated['rows_returned']
+    assert truncated['summary']['人数'] == {'nulls': 0, 'min': 0, 'max': 59}
+    assert truncated['summary']['外服机构'] == {'nulls': 0, 'distinct': 3}
+
+
+def test_encode_rows():
+    rows = [{'m': {'_id': {'offset': i, 'table': 0}, '_label': 'Metric', 'id': f'M{i}', 'formula': None}}
+            for i in range(50)]
+    resp = json.loads(encode_rows(rows))
+    assert resp['data']['columns'] == ['m']
+    assert resp['data']['data'][0][0] == {'_label': 'Metric', 'id': 'M0'}
+    small = json.loads(encode_rows(rows, max_bytes=300))
+    assert small['truncated']['rows_returned'] < 50 and small['row_count'] == 50
@@ -0,0 +1,69 @@
+import duckdb
+import pytest
+
+import util
+from query_cache import QueryCache
+from rollup import RollupCatalog, build_rollups, frames_match
+from util import TableRegistry
+
+
+@pytest.fixture
+def catalog(ref_dir):
+    registry = TableRegistry(ref_dir)
+    manifest = build_rollups(registry)
+    assert manifest['rollup_incm_cost_area']['measures'] == ['金额']
+    return registry, RollupCatalog(ref_dir / 'rollup')
+
+
+@pytest.mark.parametrize('sql, target', [
+    ("SELECT 外服机构, SUM(金额) AS 收入 FROM dm_incm_cost_dtl_rpt "
+     "WHERE 财务期间 = '202403' AND 指标 = '营业收入' AND 取数类型 = '1' "
+     "GROUP BY 外服机构 ORDER BY 收入 DESC LIMIT 1", 'rollup_incm_cost_org'),
+    ("SELECT t.所属大区, count(*), SUM(CASE WHEN 指标 = '营业收入' THEN 金额 ELSE 0 END) "
+     "FROM df_dm_incm_cost_dtl_rpt t GROUP BY ALL", 'rollup_incm_cost_region'),
+    ("SELECT 地区, MAX(财务期间) FROM dm_incm_cost_dtl_rpt GROUP BY 地区", 'rollup_incm_cost_area'),
+    ("SELECT 地区, SUM(1), count(*) + 1 FROM dm_incm_cost_dtl_rpt GROUP BY 地区", 'rollup_incm_cost_area'),
+    ("SELECT 地区, SUM(CASE WHEN 指标 = '营业收入' THEN 1 ELSE 0 END) AS n, SUM(NULL) "
+     "FROM dm_incm_cost_dtl_rpt GROUP BY 地区", 'rollup_incm_cost_area'),
+    # 过滤后为空且无 GROUP BY 时 count(*) 为 0 而不是 NULL
+    ("SELECT count(*), SUM(1) FROM dm_incm_cost_dtl_rpt WHERE 地区 = 'nope'", 'rollup_incm_cost_area'),
+])
+def test_rewrite_matches_base(catalog, sql, target):
+    registry, rollups = catalog
+    rewritten = rollups.rewrite(sql)
+    assert rewritten is not None and target in rewritten
+    expected = registry.pool.query(sql)
+    assert frames_match(expected, registry.pool.query(rewritten))
+
+
+@pytest.mark.parametrize('sql', [
+    "SELECT * FROM dm_incm_cost_dtl_rpt",
+    "SELECT 外服机构, 金额 FROM dm_incm_cost_dtl_rpt WHERE 金额 > 10",
+    "SELECT AVG(金额) FROM dm_incm_cost_dtl_rpt",
+    "SELECT count(金额) FROM dm_incm_cost_dtl_rpt",
+    "SELECT 外服机构 FROM dm_incm_cost_dtl_rpt",
+    "SELECT c.外服机构, SUM(金额) FROM dm_incm_cost_dtl_rpt d JOIN companies c USING (外服机构) GROUP BY 1",
+    "SELECT 财务期间, SUM(金额) OVER () FROM dm_incm_cost_dtl_rpt",
+    "DELETE FROM dm_incm_cost_dtl_rpt",
+])
+def test_rewrite_rejects(catalog, sql):
+    assert catalog[1].rewrite(sql) is None
+
+
+def test_stale_rollup_is_skipped(catalog, ref_dir):
+    _, rollups = catalog
+    sql = "SELECT 地区, SUM(金额) FROM dm_incm_cost_dtl_rpt GROUP BY 地区"
+    assert rollups.rewrite(sql) is not None
+    duckdb.execute(f"COPY (SELECT * FROM read_parquet('{ref_dir}/dm_incm_cost_dtl_rpt.parquet') LIMIT 5) "
+                   f"TO '{ref_dir}/dm_incm_cost_dtl_rpt.parquet' (FORMAT parquet)")
+    assert rollups.rewrite(sql) is None
+
+
+def test_do_query_verify(catalog, monkeypatch):
+    registry, rollups = catalog
+    rollups.verify = True
+    monkeypatch.setattr(util, 'registry', registry)
+    monkeypatch.setattr(util, 'rollups', rollups)
+    monkeypatch.setattr(util, 'query_cache', QueryCache(max_bytes=0))
+    result = util.do_query("SELECT 地区, count(*) AS n FROM dm_incm_cost_dtl_rpt GROUP BY 地区 ORDER BY 地区")
+    assert result['n'].tolist() == [60, 120]
@@ -3,46 +3,41 @@ import json
 from pathlib import Path
 
 from dotenv import load_dotenv
-import duckdb
-import pandas as pd
 from pydantic_ai.usage import UsageLimits
 
+from base_view import income_cost_view
+from evaluate import evaluate, report
 from single_view_agent import make_agent
+from util import wrap_sql
 
 
 SCRIPT_DIR = Path(__file__).parent
 
 load_dotenv()
-with open(SCRIPT_DIR / '../reference' / "income_cost.sql", "r", encoding="utf-8") as f:
-    base_sql = f.read()
-df = duckdb.query(base_sql).df()
+# 只需要基础表的列定义，数据留在物化的 DuckDB 数据库中
+view = income_cost_view()
+with view.connect() as conn:
+    df = view.schema(conn)
 agent = make_agent(df)
-doc = []
 
 agent_limits = UsageLimits(request_limit=3)
 
+async def generate(prompt: str):
+    result = await agent.run(prompt, 
+                             deps=df, 
+                             usage_limits=agent_limits)
+    return wrap_sql(result.output), result.usage()
+
+def execute(sql: str):
+    with view.connect() as conn:
+        return conn.execute(sql).df()
+
 async def run(questions: list[dict[str, str]]):
-    for question in questions:
-        prompt = question['question']
-        print("[Question]", prompt)
-        try:
-            result = await agent.run(prompt, 
-                                     deps=df, 
-                                     usage_limits=agent_limits)
-            doc.append({
-                'question': prompt,
-                'sql': result.output,
-                'error': ''
-            })
-            print("[SQL]", result.output)
-        except Exception as e:
-            doc.append({
-                'question': prompt,
-                'sql': 'error',
-                'error': str(e)
-            })
-    pd.DataFrame(doc).to_json(SCRIPT_DIR / '../reference' / 'question_with_sql2.json', \
-        orient='records', force_ascii=False)
+    # 每题结果写入 JSONL，中断后重新运行会跳过已完成的题目
+    records = await evaluate(questions, generate, SCRIPT_DIR / '../reference' / 'question_with_sql2.jsonl',
+                             execute=execute,
+                             on_record=lambda r: print("[Question]", r['question'], "\n[SQL]", r['sql'] or r['error']))
+    print(report(records))
 
 def test_make_sql():
     with open('./reference/question.json', 'r', encoding='utf-8') as f:
@@ -0,0 +1,149 @@
+import asyncio
+
+import duckdb
+import pytest
+from pydantic_ai import Agent
+from pydantic_ai.messages import ModelResponse, ToolCallPart
+from pydantic_ai.models.function import FunctionModel
+
+from answer_cache import AnswerCache
+from graph.metric_catalog import MetricCatalog
+import kag_agent
+from kag_agent import SupportDependencies, ask, compile_spec, validate_spec
+from sql_compiler import Filter, OrderBy, QuerySpec, SpecError, compile_sql
+
+
+@pytest.fixture
+def conn(ref_dir):
+    conn = duckdb.connect()
+    for name in ('companies', 'dm_incm_cost_dtl_rpt'):
+        conn.execute(f"CREATE VIEW {name} AS SELECT * FROM read_parquet('{ref_dir}/{name}.parquet')")
+    yield conn
+    conn.close()
+
+
+def compile_for(graph, spec):
+    return compile_spec(SupportDependencies(graph=graph), spec)
+
+
+TYPE_1 = Filter(field='取数类型', value='1')
+
+
+def test_top_n(graph, conn):
+    spec = QuerySpec(metrics=['营业收入'], dimensions=['时间', '地区-所属大区-外服机构'],
+                     group_by=['外服机构'],
+                     filters=[Filter(field='财务期间', value='202503'), TYPE_1],
+                     order_by=[OrderBy(key='营业收入')], limit=2)
+    rows = conn.execute(compile_for(graph, spec)).fetchall()
+    expected = conn.execute("""
+        SELECT 外服机构, SUM(金额) FROM dm_incm_cost_dtl_rpt
+        WHERE 财务期间 = '202503' AND 取数类型 = '1' AND 指标 = '营业收入'
+        GROUP BY 1 ORDER BY 2 DESC LIMIT 2
+    """).fetchall()
+    assert rows == expected
+
+
+@pytest.mark.parametrize('with_catalog', [False, True])
+def test_multiple_metrics(graph, conn, with_catalog):
+    catalog = MetricCatalog.load(graph) if with_catalog else None
+    spec = QuerySpec(metrics=['营业收入', '营业成本'], filters=[TYPE_1])
+    result = conn.execute(compile_spec(SupportDependencies(graph=graph, catalog=catalog), spec))
+    assert [c[0] for c in result.description] == ['营业收入', '营业成本']
+    rows = result.fetchall()
+    expected = conn.execute("""
+        SELECT SUM(CASE WHEN 指标 = '营业收入' THEN 金额 END), SUM(CASE WHEN 指标 = '营业成本' THEN 金额 END)
+        FROM dm_incm_cost_dtl_rpt WHERE 取数类型 = '1'
+    """).fetchall()
+    assert rows == expected
+
+
+def test_dimension_name_expands_hierarchy(graph, conn):
+    spec = QuerySpec(metrics=['营业收入'], dimensions=['地区-所属大区-外服机构'],
+                     group_by=['地区-所属大区-外服机构'], filters=[TYPE_1, Filter(field='财务期间', value='202401')],
+                     order_by=[OrderBy(key='外服机构', desc=False)])
+    result = conn.execute(compile_for(graph, spec))
+    assert [c[0] for c in result.description] == ['地区', '所属大区', '外服机构', '营业收入']
+    assert [r[2] for r in result.fetchall()] == ['上海外服', '北京外服', '成都外服']
+
+
+def test_required_dimension(graph):
+    spec = QuerySpec(metrics=['营业收入'], filters=[Filter(field='财务期间', value='202503')])
+    with pytest.raises(SpecError, match='取数类型'):
+        compile_for(graph, spec)
+
+
+def test_unknown_fields(graph):
+    with pytest.raises(SpecError, match='过滤字段'):
+        compile_for(graph, QuerySpec(metrics=['营业收入'], filters=[TYPE_1, Filter(field='币种', value='CNY')]))
+    with pytest.raises(SpecError, match='分组字段'):
+        compile_for(graph, QuerySpec(metrics=['营业收入'], group_by=['币种'], filters=[TYPE_1]))
+    with pytest.raises(SpecError, match='未找到指标'):
+        compile_sql(QuerySpec(metrics=['不存在']), [])
+
+
+def test_year_to_date_takes_last_period(graph, conn):
+    spec = QuerySpec(metrics=['营业收入'], filters=[
+        Filter(field='取数类型', value='2'),
+        Filter(field='财务期间', op='between', value=['202501', '202503']),
+        Filter(field='外服机构', value='上海外服'),
+    ])
+    sql = compile_for(graph, spec)
+    expected = conn.execute("""
+        SELECT SUM(金额) FROM dm_incm_cost_dtl_rpt
+        WHERE 财务期间 = '202503' AND 取数类型 = '2' AND 指标 = '营业收入' AND 外服机构 = '上海外服'
+    """).fetchone()
+    assert conn.execute(sql).fetchone() == expected
+
+    grouped = spec.model_copy(update={'group_by': ['财务期间']})
+    assert len(conn.execute(compile_for(graph, grouped)).fetchall()) == 3
+
+    mixed = spec.model_copy(update={'filters': [Filter(field='取数类型', op='in', value=['1', '2'])]})
+    with pytest.raises(SpecError, match='本年累计数'):
+        compile_for(graph, mixed)
+
+
+def test_derived_metric(graph, conn):
+    spec = QuerySpec(metrics=['毛利率', '营业收入'], dimensions=['时间'], group_by=['财务期间'],
+                     filters=[TYPE_1, Filter(field='财务期间', op='in', value=['202401', '202402'])],
+                     order_by=[OrderBy(key='财务期间', desc=False)])
+    rows = conn.execute(compile_for(graph, spec)).fetchall()
+    expected = conn.execute("""
+        SELECT 财务期间,
+               (SUM(金额) FILTER (指标 = '营业收入') - SUM(金额) FILTER (指标 = '营业成本'))
+                   / SUM(金额) FILTER (指标 = '营业收入'),
+               SUM(金额) FILTER (指标 = '营业收入')
+        FROM dm_incm_cost_dtl_rpt
+        WHERE 取数类型 = '1' AND 财务期间 IN ('202401', '202402')
+        GROUP BY 1 ORDER BY 1
+    """).fetchall()
+    assert rows == pytest.approx(expected)
+
+
+def test_join_dimension(graph, conn):
+    spec = QuerySpec(metrics=['营业收入'], dimensions=['客户'], group_by=['客户'],
+                     filters=[TYPE_1, Filter(field='财务期间', value='202401')],
+                     order_by=[OrderBy(key='客户', desc=False)])
+    sql = compile_for(graph, spec)
+    assert 'JOIN "companies"' in sql
+    assert [r[0] for r in conn.execute(sql).fetchall()] == ['上海外服', '北京外服', '成都外服']
+
+
+def test_structured_agent_output(graph, conn, monkeypatch):
+    monkeypatch.setattr(kag_agent, 'answer_cache', AnswerCache(max_entries=0))
+    specs = [
+        {'metrics': ['营业收入'], 'filters': [{'field': '财务期间', 'value': '202503'}]},
+        {'metrics': ['营业收入'], 'filters': [{'field': '财务期间', 'value': '202503'},
+                                              {'field': '取数类型', 'value': '1'}]},
+    ]
+
+    def model(messages, info):
+        return ModelResponse(parts=[ToolCallPart(info.output_tools[0].name, specs.pop(0))])
+
+    agent = Agent(FunctionModel(model), deps_type=SupportDependencies, output_type=QuerySpec)
+    agent.output_validator(validate_spec)
+
+    sql = asyncio.run(ask(agent, '2025年3月营业收入', SupportDependencies(graph=graph)))
+    assert not specs
+    assert conn.execute(sql).fetchone()[0] == conn.execute(
+        "SELECT SUM(金额) FROM dm_incm_cost_dtl_rpt WHERE 财务期间 = '202503' AND 取数类型 = '1' AND 指标 = '营业收入'"
+    ).fetchone()[0]
@@ -0,0 +1,55 @@
+import duckdb
+import pytest
+
+from sql_guard import GuardError, SqlGuard
+
+
+@pytest.fixture
+def conn():
+    conn = duckdb.connect()
+    conn.execute("CREATE TABLE t AS SELECT i, i * 2.0 AS x, 'v' || i AS s FROM range(100000) r(i)")
+    yield conn
+    conn.close()
+
+
+@pytest.mark.parametrize('sql', [
+    "DELETE FROM t",
+    "CREATE TABLE u AS SELECT 1",
+    "COPY t TO 'out.csv'",
+    "SELECT 1; DROP TABLE t",
+    "SELEC 1",
+])
+def test_rejects_non_select(conn, sql):
+    with pytest.raises(GuardError):
+        SqlGuard().check(sql, conn)
+    assert conn.execute("SELECT count(*) FROM t").fetchone()[0] == 100000
+
+
+def test_default_limit(conn):
+    guard = SqlGuard(default_limit=50)
+    admission = guard.check("SELECT * FROM t ORDER BY i DESC;", conn)
+    assert admission.limit == 50 and admission.rows == 50
+    assert conn.execute(admission.sql).fetchall()[0][0] == 99999
+    assert len(conn.execute(admission.sql).fetchall()) == 50
+
+    kept = guard.check("SELECT i FROM t LIMIT 5", conn)
+    assert kept.limit is None and kept.sql == "SELECT i FROM t LIMIT 5"
+    assert guard.check("WITH a AS (SELECT i FROM t LIMIT 3) SELECT * FROM a", conn).limit == 50
+
+
+def test_clamps_explicit_limit(conn):
+    admission = SqlGuard(max_rows=1000).check("SELECT i FROM t LIMIT 1000000", conn)
+    assert admission.limit == 1000
+    assert len(conn.execute(admission.sql).fetchall()) == 1000
+
+    admission = SqlGuard(max_rows=50).check("SELECT * FROM range(100) LIMIT (SELECT 100000)", conn)
+    assert admission.limit == 50 and admission.rows <= 50
+    assert len(conn.execute(admission.sql).fetchall()) == 50
+
+
+def test_budgets(conn):
+    with pytest.raises(GuardError, match='关联条件'):
+        SqlGuard(max_plan_rows=10 ** 8).check("SELECT * FROM t a, t b", conn)
+    assert SqlGuard().check("SELECT count(*) FROM t a, t b WHERE a.i = b.i", conn).rows <= 100000
+    with pytest.raises(GuardError, match='MB'):
+        SqlGuard(default_limit=100000, max_bytes=1 << 20).check("SELECT * FROM t", conn)
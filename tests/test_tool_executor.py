@@ -0,0 +1,102 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+import cancellation
+from duckdb_pool import DuckDBPool
+from tool_executor import ToolBusy, ToolExecutor, ToolTimeout
+
+SLOW_SQL = "SELECT sum(i * i) FROM range(100000000000) t(i)"
+
+
+def test_timeout_interrupts_duckdb():
+    pool = DuckDBPool(size=1)
+    executor = ToolExecutor('sql_query', max_workers=1, timeout=0.2)
+    start = time.perf_counter()
+    with pytest.raises(ToolTimeout):
+        asyncio.run(executor.run(pool.query, SLOW_SQL))
+    # 游标被中断后归还，后续查询可以立即执行
+    assert pool.query("SELECT 42 AS x")['x'][0] == 42
+    assert time.perf_counter() - start < 5
+    assert executor.stats()['timeouts'] == 1
+    pool.close()
+
+
+def test_cancel_interrupts_duckdb():
+    pool = DuckDBPool(size=1)
+    executor = ToolExecutor('sql_query', max_workers=1)
+
+    async def main():
+        task = asyncio.create_task(executor.run(pool.query, SLOW_SQL))
+        await asyncio.sleep(0.2)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        return await asyncio.wait_for(executor.run(pool.query, "SELECT 1 AS x"), 5)
+
+    assert asyncio.run(main())['x'][0] == 1
+    pool.close()
+
+
+def test_queue_limit():
+    executor = ToolExecutor('sql_query', max_workers=1, max_queue=1)
+    release = threading.Event()
+
+    async def main():
+        first = asyncio.create_task(executor.run(release.wait))
+        second = asyncio.create_task(executor.run(release.wait))
+        await asyncio.sleep(0.05)
+        with pytest.raises(ToolBusy):
+            await executor.run(release.wait)
+        release.set()
+        return await asyncio.gather(first, second)
+
+    assert asyncio.run(main()) == [True, True]
+    assert executor.stats() == {'pending': 0, 'rejected': 1, 'timeouts': 0}
+
+
+def test_cancelled_scope_refuses_checkout():
+    pool = DuckDBPool(size=1)
+    scope = cancellation.CancelScope()
+    scope.cancel()
+    with pytest.raises(cancellation.Cancelled):
+        scope.run(pool.query, "SELECT 1")
+    assert pool.query("SELECT 1 AS x")['x'][0] == 1
+    pool.close()
+
+
+def test_kuzu_connection_registered(graph):
+    scope = cancellation.CancelScope()
+
+    def check():
+        with graph.connection() as pooled:
+            return pooled.conn in scope._targets
+
+    assert scope.run(check)
+    assert scope._targets == []
+
+
+def test_timeout_while_waiting_frees_thread(graph):
+    pool = DuckDBPool(size=1)
+    executor = ToolExecutor('sql_query', max_workers=1, timeout=0.2)
+
+    async def timed_out(func, *args):
+        with pytest.raises(ToolTimeout):
+            await executor.run(func, *args)
+        # 等待空闲连接的线程也随之退出，不再占用执行器
+        for _ in range(50):
+            if executor.pending == 0:
+                return
+            await asyncio.sleep(0.02)
+        pytest.fail('executor thread still waiting')
+
+    with pool.acquire():
+        asyncio.run(timed_out(pool.query, "SELECT 1"))
+        asyncio.run(timed_out(pool.query, "SELECT 1", 0))
+    with graph.connection():
+        asyncio.run(timed_out(graph.query, "MATCH (m:Metric) RETURN count(*)"))
+    assert pool.query("SELECT 1 AS x")['x'][0] == 1
+    assert pool._idle.qsize() == 1
+    pool.close()
@@ -0,0 +1,65 @@
+from pathlib import Path
+import subprocess
+import sys
+
+import pyarrow as pa
+import pandas as pd
+
+import util
+from util import TableRegistry
+
+
+def test_registry_is_lazy(ref_dir):
+    registry = TableRegistry(ref_dir)
+    assert registry.available() == ['companies', 'dm_incm_cost_dtl_rpt']
+    assert registry._pool is None
+    assert not registry._frames
+
+    with registry.pool.acquire() as cursor:
+        assert cursor.execute('SELECT count(*) FROM df_companies').fetchone() == (3,)
+    assert not registry._frames
+
+    df = registry.df('companies')
+    assert len(df) == 3
+    assert registry.df('companies') is df
+
+
+def test_import_is_lazy():
+    # 导入 util 和 mcp_server 不创建连接池、不加载缓存/汇总表/分区模块
+    code = ("import sys, util, mcp_server; "
+            "assert util.registry._pool is None; "
+            "assert not {'rollup', 'query_cache', 'partition_data'} & set(sys.modules)")
+    subprocess.run([sys.executable, '-c', code], cwd=Path(util.__file__).parent, check=True)
+
+
+def test_do_query(ref_dir, monkeypatch):
+    monkeypatch.setattr(util, 'registry', TableRegistry(ref_dir))
+    result = util.do_query('SELECT count(*) AS n FROM dm_incm_cost_dtl_rpt')
+    assert result['n'][0] == 15 * 3 * 2 * 2
+
+    df = pd.DataFrame({'x': [1, 2, 3]})
+    assert util.do_query('SELECT sum(x) AS s FROM df', df)['s'][0] == 6
+    assert len(util.df_companies) == 3
+
+
+def test_do_query_arrow(ref_dir, monkeypatch):
+    registry = TableRegistry(ref_dir, size=1)
+    monkeypatch.setattr(util, 'registry', registry)
+    reader = util.do_query('SELECT 指标, sum(金额) AS 金额 FROM dm_incm_cost_dtl_rpt GROUP BY 1 ORDER BY 1',
+                           arrow=True)
+    assert reader.schema.names == ['指标', '金额']
+    assert registry.pool._idle.qsize() == 0
+    assert reader.read_all().num_rows == 2
+    assert registry.pool._idle.qsize() == 1
+
+    table = util.result_table(util.do_query('SELECT 1.005::DOUBLE AS f, 2 AS i, NULL::VARCHAR AS n', arrow=True))
+    assert [c.justify for c in table.columns] == ['right', 'right', 'left']
+    assert table.row_count == 1
+
+
+def test_iter_pages():
+    table = pa.table({'x': list(range(23))})
+    pages = list(util.iter_pages(pa.RecordBatchReader.from_batches(table.schema, table.to_batches(max_chunksize=7)), 10))
+    assert [p.num_rows for p in pages] == [10, 10, 3]
+    assert pa.concat_tables(pages).equals(table)
+    assert util.result_table(pages[2]).row_count == 3